@@ -0,0 +1,175 @@
+import json
+import numpy as np
+import os
+import shutil
+import tempfile
+from collections.abc import Mapping, Sequence
+from folds import SPLIT_PATTERN, parse_split, read_dataset_cached, section_indices
+from utils import columns_from_instances, StepFunction
+
+# Arenas are created in shared memory when available, so attaching to them never touches the disk
+ARENA_PARENT_DIRECTORY = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+# The columns that were attached to by this process, per (arena name, key)
+attached_columns = {}
+
+# A set of columnar datasets and arrays that is published once by a parent process and attached to by name from worker processes
+# Every array is stored as a memory-mapped file, so all processes share the same pages instead of holding their own copy
+class DatasetArena:
+    def __init__(self):
+        self.name = tempfile.mkdtemp(prefix="streed_arena_", dir=ARENA_PARENT_DIRECTORY)
+        self.keys = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # Publishes a map of named arrays under a key, unless the key was already published
+    #
+    # key       The key to publish the arrays under
+    # columns   A map from name to array
+    def publish(self, key, columns):
+        if key in self.keys:
+            return
+        self.keys.add(key)
+
+        path = arena_path(self.name, key)
+        os.makedirs(path)
+        for i, column in enumerate(columns.values()):
+            np.save(f"{path}/{i}.npy", column, allow_pickle=column.dtype == object)
+
+        f = open(f"{path}/columns.json", "w")
+        f.write(json.dumps([*columns.keys()]))
+        f.close()
+
+    # Publishes the columns of a full dataset, which all of its folds are views of
+    #
+    # directory     The directory of the dataset type (original, numeric or binary)
+    # filename      The filename of the dataset or of a section of one of its folds
+    def publish_dataset(self, directory, filename):
+        key = dataset_key(filename)
+        if key not in self.keys:
+            self.publish(key, columns_from_instances(read_dataset_cached(f"{directory}/{key}.txt")))
+
+    # Publishes the values of a step function, such as a precomputed hazard function
+    #
+    # key       The key to publish the step function under
+    # function  The step function to publish
+    def publish_step_function(self, key, function):
+        self.publish(key, {"keys": np.array(function.keys), "values": np.array(function.values)})
+
+    # Removes all published arrays
+    def close(self):
+        shutil.rmtree(self.name, ignore_errors=True)
+
+# Returns the directory in which the arrays of a key are stored
+#
+# name      The name of the arena
+# key       The key of the arrays
+def arena_path(name, key):
+    return f"{name}/{key.replace('/', '__')}"
+
+# Returns the key under which the full dataset of a filename is published
+#
+# filename      The filename of the dataset or of a section of one of its folds
+def dataset_key(filename):
+    if SPLIT_PATTERN.match(filename):
+        return parse_split(filename)[1]
+    return filename
+
+# Attaches to the arrays published under a key, without copying them
+# Returns a map from name to (read-only) array
+#
+# name      The name of the arena
+# key       The key of the arrays
+def attach(name, key):
+    if (name, key) not in attached_columns:
+        path = arena_path(name, key)
+
+        f = open(f"{path}/columns.json")
+        column_names = json.loads(f.read())
+        f.close()
+
+        columns = {}
+        for i, column_name in enumerate(column_names):
+            try:
+                columns[column_name] = np.load(f"{path}/{i}.npy", mmap_mode="r")
+            except ValueError:
+                # Object arrays cannot be memory-mapped
+                columns[column_name] = np.load(f"{path}/{i}.npy", allow_pickle=True)
+        attached_columns[(name, key)] = columns
+
+    return attached_columns[(name, key)]
+
+# Attaches to a published step function
+#
+# name      The name of the arena
+# key       The key of the step function
+def attach_step_function(name, key):
+    columns = attach(name, key)
+    return StepFunction(columns["keys"].tolist(), columns["values"].tolist())
+
+# Returns the instances of a dataset or of a section of one of its folds, as views of the published columns
+# Fold sections are selected with the fold manifests, so the dataset must have been published with `publish_dataset`
+#
+# name      The name of the arena
+# filename  The filename of the dataset or of a section of one of its folds
+def attach_split(name, filename):
+    columns = attach(name, dataset_key(filename))
+    n = len(columns["time"])
+
+    if SPLIT_PATTERN.match(filename):
+        section, dataset, repeat, partition = parse_split(filename)
+        return ColumnInstances(columns, section_indices(section, dataset, partition, repeat, n))
+    return ColumnInstances(columns, np.arange(n))
+
+# The features of a single row of a columnar dataset, read from the columns on access
+class RowFeatures(Mapping):
+    __slots__ = ["columns", "names", "row"]
+
+    def __init__(self, columns, names, row):
+        self.columns = columns
+        self.names = names
+        self.row = row
+
+    def __getitem__(self, key):
+        return self.columns[key].item(self.row)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+# An instance that reads its values from a columnar dataset, so it can be used wherever an `Instance` is expected
+class ColumnInstance:
+    __slots__ = ["time", "event", "feats"]
+
+    def __init__(self, columns, names, row):
+        self.time = columns["time"].item(row)
+        self.event = columns["event"].item(row)
+        self.feats = RowFeatures(columns, names, row)
+
+    def __repr__(self):
+        return f"<t = {self.time}, d = {self.event}, feats = {dict(self.feats)}>"
+
+# A sequence of rows of a columnar dataset, whose instances are only created while they are being used
+class ColumnInstances(Sequence):
+    def __init__(self, columns, indices):
+        self.columns = columns
+        self.indices = indices
+        self.names = [j for j in columns if j not in ["time", "event"]]
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return ColumnInstances(self.columns, self.indices[key])
+        return ColumnInstance(self.columns, self.names, self.indices[key])
+
+    def __iter__(self):
+        for row in self.indices.tolist():
+            yield ColumnInstance(self.columns, self.names, row)
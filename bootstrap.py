@@ -0,0 +1,179 @@
+import numpy as np
+import zlib
+from functools import lru_cache
+from predicates import leaf_assignment, survival_arrays
+
+# The number of bootstrap replicates per tree with --bootstrap, bootstrapping is disabled without it
+BOOTSTRAP_REPLICATES = 1000
+
+# The seed from which the resample weights of each test-set are derived
+BOOTSTRAP_SEED = 42
+
+# The number of replicates that are computed at once, which bounds the memory used per tree
+BOOTSTRAP_CHUNK_SIZE = 100
+
+# The metrics for which bootstrap replicates are computed
+BOOTSTRAP_METRICS = ["integrated_brier_score_ratio", "concordance_score", "objective_score"]
+
+# Returns the number of bootstrap replicates given on the command line, as --bootstrap (for `BOOTSTRAP_REPLICATES`) or --bootstrap=<replicates>
+# Returns 0 if bootstrapping is not enabled
+#
+# arguments     The command line arguments
+def bootstrap_option(arguments):
+    replicates = 0
+    for arg in arguments:
+        if arg == "--bootstrap":
+            replicates = BOOTSTRAP_REPLICATES
+        elif arg.startswith("--bootstrap="):
+            replicates = int(arg.split("=", 1)[1])
+    return replicates
+
+# Draws the resample counts of a test-set as a (replicates x n) matrix, where row b holds how often each instance is drawn in replicate b
+# The counts only depend on the key and size of the test-set, so every tree evaluated on the same test-set is resampled identically
+# They are stored in the smallest integer type that can hold n, so the counts of a large test-set can be kept (or shared) for all of its trees
+#
+# n             The number of instances
+# key           The name of the test-set
+# replicates    The number of replicates
+def resample_counts(n, key, replicates):
+    counts = np.zeros((replicates, n), dtype=np.min_scalar_type(n))
+    if n == 0:
+        return counts
+
+    num_chunks = -(-replicates // BOOTSTRAP_CHUNK_SIZE)
+    seeds = np.random.SeedSequence(BOOTSTRAP_SEED, spawn_key=(zlib.crc32(key.encode()),)).spawn(num_chunks)
+    for j, seed in enumerate(seeds):
+        start = j * BOOTSTRAP_CHUNK_SIZE
+        size = min(BOOTSTRAP_CHUNK_SIZE, replicates - start)
+        # Drawing n row ids per replicate and counting them is a much faster way to sample the uniform multinomial distribution
+        draws = np.random.default_rng(seed).integers(0, n, size=(size, n))
+        draws += np.arange(size)[:, None] * n
+        counts[start:start + size] = np.bincount(draws.ravel(), minlength=size * n).reshape(size, n)
+    return counts
+
+# Returns the resample counts of a test-set, which are only drawn once per process
+@lru_cache(maxsize=2)
+def cached_resample_counts(n, key, replicates):
+    return resample_counts(n, key, replicates)
+
+# Returns the resample weights of a test-set in chunks of `BOOTSTRAP_CHUNK_SIZE` replicates, which bounds the memory used per tree
+#
+# counts    The resample counts of the test-set, as returned by `resample_counts`
+def weight_chunks(counts):
+    for start in range(0, len(counts), BOOTSTRAP_CHUNK_SIZE):
+        yield counts[start:start + BOOTSTRAP_CHUNK_SIZE].astype(np.float64)
+
+# The vectorized version of `relative_score` of step 9
+#
+# values        The scores of the tree per replicate
+# base_values   The scores of the base tree per replicate
+def relative_scores(values, base_values):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = np.where(base_values > 1e-6, 1 - values / base_values, 1)
+    scores[np.abs(scores) < 1e-6] = 0
+    return scores
+
+# Returns the contribution of each test instance to the exact integrated Brier score of a tree
+# The score is linear in the resample weights: a replicate's score is the weighted sum of the contributions divided by the sum of the weights
+#
+# root          The tree to evaluate
+# context       The evaluation context of the train- and test-set
+# method        Either "leblanc" or "kaplan_meier"
+def brier_contributions(root, context, method):
+    leaves, leaf_ids = root.apply(context.test_instances)
+    leaf_ids = leaf_ids[context.keep]
+
+    # Per leaf, the integral over the points at which an instance is a case (from its position onward) or a control (before it)
+    estimates = context.leaf_survival_matrix(leaves, "points", method)
+    case_terms = np.square(estimates) * context.widths
+    control_terms = np.square(1 - estimates) * context.control_weights * context.widths
+    case_tails = np.concatenate([np.cumsum(case_terms[:, ::-1], axis=1)[:, ::-1], np.zeros((len(leaves), 1))], axis=1)
+    control_heads = np.concatenate([np.zeros((len(leaves), 1)), np.cumsum(control_terms, axis=1)], axis=1)
+
+    contributions = np.zeros(len(context.keep))
+    contributions[context.keep] = context.case_weights * case_tails[leaf_ids, context.positions] + control_heads[leaf_ids, context.positions]
+    return contributions / (context.upper - context.lower)
+
+# Returns, per leaf, the indicator matrix of its deaths weighted by their negative log hazard, and of its deaths
+# Weighted sums of these give the error of each leaf per replicate
+#
+# leaf_ids      The index of the leaf of each instance
+# num_leaves    The number of leaves
+# events        The event of each instance
+# hazards       The negative log hazard of each instance
+def error_matrices(leaf_ids, num_leaves, events, hazards):
+    deaths = np.zeros((len(leaf_ids), num_leaves))
+    deaths[np.arange(len(leaf_ids)), leaf_ids] = events
+    return deaths * hazards[:, None], deaths
+
+# Calculates the bootstrap replicates of the IBS ratio, Harrell's C-index and the objective score of a tree on the test-set of a context
+# The tree is classified once; every replicate reweights the same leaf assignment with a row of a (replicates x n) multinomial weight matrix,
+# so all replicates of a metric are computed with a few batched reductions
+# Returns a map from metric name to an array with one value per replicate
+#
+# root          The tree to evaluate, filled with the train-set of the context
+# context       The evaluation context of the train- and test-set
+# method        Either "leblanc" or "kaplan_meier"
+# counts        The resample counts of the test-set, as returned by `resample_counts`
+def bootstrap_replicates(root, context, method, counts):
+    instances, hazard_function = context.instances["test"], context.hazard_functions["test"]
+    times, events = survival_arrays(instances)
+    n = len(times)
+
+    # Integrated Brier score contributions and error matrices of the tree, with the labels of the train-set
+    contributions = brier_contributions(root, context, method)
+    keep = context.keep.astype(float)
+    leaves, leaf_ids = leaf_assignment(root, instances)
+    thetas = np.array([leaf.theta for leaf in leaves], dtype=float)
+    negative_log_hazards = -np.log(hazard_function.evaluate(times))
+    hazard_sums, death_sums = error_matrices(leaf_ids, len(leaves), events, negative_log_hazards)
+
+    # The replicates of the base tree are the same for every tree evaluated on the context
+    if ("bootstrap", len(counts)) not in context.base_scores:
+        base_contributions = brier_contributions(context.base_tree, context, "kaplan_meier")
+        base_hazard_sums, base_death_sums = error_matrices(np.zeros(n, dtype=np.int64), 1, events, negative_log_hazards)
+        base_replicates = []
+        for weights in weight_chunks(counts):
+            base_ibs = weights @ base_contributions / (weights @ keep)
+            base_errors = np.maximum(0, weights @ base_hazard_sums - (weights @ base_death_sums) * np.log(context.base_tree.theta)).sum(axis=1)
+            base_replicates.append((base_ibs, base_errors))
+        context.base_scores[("bootstrap", len(counts))] = base_replicates
+
+    # Risk groups of Harrell's C-index, with the instances of each group sorted by time
+    _, buckets = np.unique(thetas[leaf_ids], return_inverse=True)
+    order = context.orders["test"]
+    deaths = np.flatnonzero(events == 1)
+    groups = []
+    for bucket in range(buckets.max() + 1 if n else 0):
+        members = order[buckets[order] == bucket]
+        groups.append((bucket, members, np.searchsorted(times[members], times[deaths], side="right")))
+
+    replicates = {metric: [] for metric in BOOTSTRAP_METRICS}
+    for weights, (base_ibs, base_errors) in zip(weight_chunks(counts), context.base_scores[("bootstrap", len(counts))]):
+        ibs = weights @ contributions / (weights @ keep)
+        replicates["integrated_brier_score_ratio"].append(relative_scores(ibs, base_ibs))
+
+        errors = np.maximum(0, weights @ hazard_sums - (weights @ death_sums) * np.log(thetas)).sum(axis=1)
+        replicates["objective_score"].append(relative_scores(errors, base_errors))
+
+        # Every pair of a death i and a later instance j counts with weight w_i * w_j
+        death_weights = weights[:, deaths]
+        cc = np.zeros(len(weights))
+        tr = np.zeros(len(weights))
+        dc = np.zeros(len(weights))
+        for bucket, members, positions in groups:
+            cumulative = np.concatenate([np.zeros((len(weights), 1)), np.cumsum(weights[:, members], axis=1)], axis=1)
+            survivors = (cumulative[:, -1:] - cumulative[:, positions]) * death_weights
+            cc += survivors[:, buckets[deaths] > bucket].sum(axis=1)
+            tr += survivors[:, buckets[deaths] == bucket].sum(axis=1)
+            dc += survivors[:, buckets[deaths] < bucket].sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            replicates["concordance_score"].append(np.where(cc + tr + dc > 0, (cc + 0.5 * tr) / (cc + tr + dc), 1))
+
+    return {metric: np.concatenate(values) if values else np.empty(0) for metric, values in replicates.items()}
+
+# Returns the 95% percentile interval of bootstrap replicates
+#
+# replicates    The replicates of a metric
+def percentile_interval(replicates):
+    return tuple(np.percentile(replicates, [2.5, 97.5]).tolist())
@@ -0,0 +1,170 @@
+import numpy as np
+import pandas as pd
+import warnings
+from itertools import combinations
+from scipy.stats import wilcoxon, ttest_ind
+from results_store import SETTINGS_COLUMNS
+
+# The settings that identify a run, named as in the frames of `load_results`; runs of different algorithms with the same settings are compared
+SETTINGS_KEY = ["dataset" if column == "dataset" else key for column, key in SETTINGS_COLUMNS.items()]
+
+# The metrics that are compared between algorithms
+COMPARED_METRICS = ["num_nodes", "integrated_brier_score_ratio"] + [
+    f"{type}_{metric}" for metric in ["objective_score", "concordance_score", "uno_concordance_score"] for type in ["train", "test"]
+]
+
+# Runs that took at least this many seconds have timed out, and are left out of every comparison they are part of
+TIMEOUT = 600
+
+# Differences of at most this size count as ties
+TIE_TOLERANCE = 1e-6
+
+# The number of random sign vectors of the Monte Carlo permutation test (at most 10 ** 6); comparisons of at most log2 of this many settings are tested exactly
+PERMUTATIONS = 10 ** 5
+
+# The seed of the random sign vectors of the permutation test
+PERMUTATION_SEED = 42
+
+# The number of (sign vector, setting) entries of the permutation test that are kept in memory at once
+PERMUTATION_CHUNK_ENTRIES = 10 ** 7
+
+# Aligns the runs of any number of algorithms on their settings, with a hash join instead of relying on the order of the output files
+# Returns a frame with one row per setting and a column per (metric, algorithm); settings an algorithm was not run with hold NaN
+# Runs of an algorithm with the same settings (e.g. repeated runs) are paired in the order in which they were run
+#
+# df        The results of the algorithms, as returned by `load_results`
+# methods   The algorithms to align
+# metrics   The metrics to keep (the runtime is always kept)
+def align_results(df, methods, metrics=COMPARED_METRICS):
+    df = df[df["method"].isin(methods)]
+    occurrence = df.groupby(["method"] + SETTINGS_KEY, dropna=False).cumcount().rename("occurrence")
+    columns = ["runtime"] + [j for j in metrics if j != "runtime"]
+    return df.assign(occurrence=occurrence).set_index(SETTINGS_KEY + ["occurrence", "method"])[columns].unstack("method")
+
+# Returns the settings that only one of two algorithms was run with, and which of the two that is
+#
+# aligned   The aligned results, as returned by `align_results`
+# alg1      The name of algorithm 1
+# alg2      The name of algorithm 2
+def unmatched_settings(aligned, alg1, alg2):
+    present1, present2 = aligned["runtime"][alg1].notna(), aligned["runtime"][alg2].notna()
+    unmatched = aligned.index[present1 != present2].to_frame(index=False)
+    unmatched["method"] = np.where(present1[present1 != present2], alg1, alg2)
+    return unmatched
+
+# Returns, per metric and pair of algorithms, the matrices of the values of both algorithms on every setting
+# Values on settings that are unmatched, timed out or have no value for the metric are NaN
+#
+# aligned   The aligned results, as returned by `align_results`
+# pairs     The pairs of algorithms to compare
+# metrics   The metrics to compare
+def paired_values(aligned, pairs, metrics):
+    runtime = aligned["runtime"]
+    values1, values2 = [], []
+    for alg1, alg2 in pairs:
+        compared = ((runtime[alg1] < TIMEOUT) & (runtime[alg2] < TIMEOUT)).to_numpy()
+        for metric in metrics:
+            value1, value2 = aligned[metric][alg1].to_numpy(dtype=float), aligned[metric][alg2].to_numpy(dtype=float)
+            valid = compared & ~np.isnan(value1) & ~np.isnan(value2)
+            values1.append(np.where(valid, value1, np.nan))
+            values2.append(np.where(valid, value2, np.nan))
+    shape = (len(pairs) * len(metrics), len(aligned))
+    return np.array(values1, dtype=float).reshape(shape), np.array(values2, dtype=float).reshape(shape)
+
+# Yields the sign vectors of a permutation test on k differences as chunks of a (vectors x k) matrix of -1s and 1s
+# If 2^k is at most the number of permutations, all 2^k sign vectors are enumerated, otherwise random ones are drawn
+#
+# k             The number of differences
+# permutations  The number of random sign vectors
+# seed          The seed of the random sign vectors
+def sign_chunks(k, permutations=PERMUTATIONS, seed=PERMUTATION_SEED):
+    exact = 2 ** k <= permutations
+    total = 2 ** k if exact else permutations
+    chunk_size = max(1, PERMUTATION_CHUNK_ENTRIES // max(k, 1))
+    rng = np.random.default_rng(seed)
+    for start in range(0, total, chunk_size):
+        size = min(chunk_size, total - start)
+        if exact:
+            bits = (np.arange(start, start + size)[:, None] >> np.arange(k)) & 1
+        else:
+            bits = rng.integers(0, 2, size=(size, k), dtype=np.int8)
+        yield 2.0 * bits - 1.0
+
+# Calculates the two-sided p-values of paired sign-flip permutation tests on the sum of the differences, for every row of a matrix at once
+# Under the null hypothesis every difference is equally likely to have either sign, so each row is compared to its sums under all sign vectors
+# The differences of each row are packed to the left, so a single (vectors x k) sign matrix product tests all rows, where k is the largest number of differences;
+# padded zeros do not change a sum, so rows with fewer differences are still tested exactly when all 2^k sign vectors are enumerated
+# Rows without differences get a NaN p-value
+#
+# diffs         A (rows x settings) matrix of differences, with NaN for settings that are not compared
+# permutations  The number of random sign vectors when there are too many differences to enumerate all sign vectors
+# seed          The seed of the random sign vectors
+def sign_flip_p_values(diffs, permutations=PERMUTATIONS, seed=PERMUTATION_SEED):
+    valid = ~np.isnan(diffs)
+    n = valid.sum(axis=1)
+    k = int(n.max()) if len(n) else 0
+
+    packed = np.zeros((len(diffs), k))
+    packed[np.arange(k) < n[:, None]] = diffs[valid]
+    observed = np.abs(packed.sum(axis=1))
+    # Sums that are equal up to rounding count as at least as extreme
+    threshold = observed - 1e-9 * np.maximum(1, np.abs(packed).sum(axis=1))
+
+    extreme = np.zeros(len(diffs))
+    total = 0
+    for signs in sign_chunks(k, permutations, seed):
+        extreme += (np.abs(signs @ packed.T) >= threshold).sum(axis=0)
+        total += len(signs)
+
+    # The observed signs are one of the enumerated vectors; random vectors get the usual correction that counts the observed signs as one of them
+    p_values = extreme / total if 2 ** k <= permutations else (extreme + 1) / (total + 1)
+    return np.where(n > 0, np.minimum(p_values, 1), np.nan)
+
+# Compares every pair of algorithms on every metric in one batched pass over a (metric x pair, settings) matrix of differences
+# Returns a frame with one row per metric and pair, holding:
+# - the number of compared settings and the number of unmatched settings
+# - how often algorithm 1 scored lower than, equal to and higher than algorithm 2
+# - the mean and variance of the differences, and the smallest difference with the training file it was found on
+# - the p-values of the Wilcoxon signed-rank test and the sign-flip permutation test on the differences, and of Welch's t-test on the values
+#
+# aligned   The aligned results, as returned by `align_results`
+# methods   The algorithms to compare, of which every pair (in this order) is compared
+# metrics   The metrics to compare
+def paired_comparisons(aligned, methods, metrics=COMPARED_METRICS):
+    pairs = [*combinations(methods, 2)]
+    values1, values2 = paired_values(aligned, pairs, metrics)
+    diffs = values1 - values2
+    valid = ~np.isnan(diffs)
+    n = valid.sum(axis=1)
+
+    runtime = aligned["runtime"]
+    unmatched = [int((runtime[alg1].notna() != runtime[alg2].notna()).sum()) for alg1, alg2 in pairs]
+
+    worst = np.where(valid, diffs, np.inf).argmin(axis=1) if len(aligned) else np.zeros(len(diffs), dtype=np.int64)
+    files = aligned.index.get_level_values("file").to_numpy()
+
+    with warnings.catch_warnings(), np.errstate(invalid="ignore", divide="ignore"):
+        warnings.simplefilter("ignore")
+        means = np.nanmean(diffs, axis=1)
+        variances = np.nanvar(diffs, axis=1)
+        wilcoxon_p = wilcoxon(diffs, axis=1, nan_policy="omit").pvalue if diffs.size else np.full(len(diffs), np.nan)
+        welch_p = ttest_ind(values1, values2, axis=1, equal_var=False, nan_policy="omit").pvalue if diffs.size else np.full(len(diffs), np.nan)
+
+    table = pd.DataFrame({
+        "metric": [metric for _ in pairs for metric in metrics],
+        "alg1": [alg1 for alg1, _ in pairs for _ in metrics],
+        "alg2": [alg2 for _, alg2 in pairs for _ in metrics],
+        "n": n,
+        "unmatched": np.repeat(unmatched, len(metrics)),
+        "less": (valid & (diffs < -TIE_TOLERANCE)).sum(axis=1),
+        "equal": (valid & (np.abs(diffs) <= TIE_TOLERANCE)).sum(axis=1),
+        "greater": (valid & (diffs > TIE_TOLERANCE)).sum(axis=1),
+        "mean": means,
+        "variance": variances,
+        "worst": np.where(n > 0, diffs[np.arange(len(diffs)), worst] if len(aligned) else np.nan, np.nan),
+        "worst_file": np.where(n > 0, files[worst] if len(aligned) else None, None),
+        "wilcoxon_p": np.asarray(wilcoxon_p, dtype=float),
+        "welch_p": np.asarray(welch_p, dtype=float),
+        "permutation_p": sign_flip_p_values(diffs),
+    })
+    return table.set_index(["alg1", "alg2", "metric"]).sort_index()
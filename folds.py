@@ -0,0 +1,262 @@
+import numpy as np
+import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from utils import parse_settings, read_dataset
+from utils import DIRECTORY, FOLDS_DIRECTORY
+
+# Matches filenames such as "train/acath_partition_0" or "test/acath_repeat_2_partition_0", which refer to a fold of a dataset instead of a file on disk
+SPLIT_PATTERN = re.compile(r"^(train|test)/(.+?)(?:_repeat_(\d+))?_partition_(\d+)$")
+
+# The number of threads used to write manifests and train/test-files
+WRITE_WORKERS = 8
+
+# A read-only sequence that selects elements of a base sequence by index, without copying them
+# Iterating over it yields the same objects as the base sequence, so many views of one dataset share a single copy
+class IndexView:
+    def __init__(self, base, indices):
+        self.base = base
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return IndexView(self.base, self.indices[key])
+        return self.base[self.indices[key]]
+
+    def __iter__(self):
+        base = self.base
+        for idx in self.indices.tolist():
+            yield base[idx]
+
+    def __repr__(self):
+        return f"<IndexView of {len(self)} / {len(self.base)} rows>"
+
+# Returns the suffixes that are appended to a dataset name to refer to each of its folds
+#
+# k             The number of folds per repeat
+# r             The number of repeats (a single repeat uses the plain "_partition_i" names)
+def fold_suffixes(k, r=1):
+    if r == 1:
+        return [f"_partition_{i}" for i in range(k)]
+    return [f"_repeat_{j}_partition_{i}" for j in range(r) for i in range(k)]
+
+# Returns the path of the manifest containing the test row ids of a fold
+#
+# name          The name of the dataset (without directory or extension)
+# partition     The index of the fold
+# repeat        The index of the repeat, or None for a single k-fold split
+def fold_manifest_path(name, partition, repeat=None):
+    if repeat is None:
+        return f"{FOLDS_DIRECTORY}/{name}_partition_{partition}.npy"
+    return f"{FOLDS_DIRECTORY}/{name}_repeat_{repeat}_partition_{partition}.npy"
+
+# Writes the test row ids of each fold of a dataset as compact arrays, using multiple threads
+#
+# name          The name of the dataset (without directory or extension)
+# partitions    A list with the test row ids of each fold, or a list of such lists for repeated folds
+# repeated      Whether `partitions` contains one list of folds per repeat
+def write_fold_manifests(name, partitions, repeated=False):
+    if not os.path.exists(FOLDS_DIRECTORY):
+        os.makedirs(FOLDS_DIRECTORY)
+
+    jobs = []
+    for j, repeat_partitions in enumerate(partitions if repeated else [partitions]):
+        for i, partition in enumerate(repeat_partitions):
+            test_indices = np.array(sorted(partition), dtype=np.int32)
+            jobs.append((fold_manifest_path(name, i, j if repeated else None), test_indices))
+
+    with ThreadPoolExecutor(WRITE_WORKERS) as executor:
+        for _ in executor.map(lambda job: np.save(*job), jobs):
+            pass
+
+# Reads the test row ids of a fold, memory-mapped so that reading it is nearly free
+#
+# name          The name of the dataset (without directory or extension)
+# partition     The index of the fold
+# repeat        The index of the repeat, or None for a single k-fold split
+def read_fold_manifest(name, partition, repeat=None):
+    return np.load(fold_manifest_path(name, partition, repeat), mmap_mode="r")
+
+# Assigns every instance to a fold for each of `r` repeats of a `k`-fold split, all in one vectorized pass
+# Instances are stratified on both their event and the quantile of their time within their event group, and each repeat uses its own seed
+# Returns an (r x n) array with the fold of each instance in each repeat
+#
+# events            The event indicator of each instance
+# times             The time of each instance
+# k                 The number of folds per repeat
+# r                 The number of repeats
+# seed              The seed from which the seed of each repeat is derived
+# time_quantiles    The number of time quantiles per event group
+def repeated_stratified_folds(events, times, k, r, seed, time_quantiles=4):
+    events = np.asarray(events, dtype=np.int64)
+    times = np.asarray(times, dtype=np.float64)
+    n = len(events)
+
+    # Determine the stratum of each instance
+    strata = np.zeros(n, dtype=np.int64)
+    for event in range(2):
+        mask = events == event
+        if not mask.any():
+            continue
+        edges = np.quantile(times[mask], np.linspace(0, 1, time_quantiles + 1)[1:-1])
+        strata[mask] = event * time_quantiles + np.searchsorted(edges, times[mask], side="right")
+
+    # Shuffle within each stratum using one random key per instance per repeat
+    keys = np.stack([np.random.default_rng(s).random(n) for s in np.random.SeedSequence(seed).spawn(r)])
+    order = np.lexsort((keys, np.broadcast_to(strata, (r, n))), axis=-1)
+
+    # Deal the sorted instances out over the folds, so each stratum is spread evenly and leftovers carry over to the next stratum
+    assignments = np.empty((r, n), dtype=np.int32)
+    np.put_along_axis(assignments, order, np.broadcast_to(np.arange(n) % k, (r, n)), axis=-1)
+    return assignments
+
+# Turns an (r x n) fold assignment into the test row ids of each fold of each repeat
+#
+# assignments   The fold of each instance in each repeat
+# k             The number of folds per repeat
+def assignments_to_partitions(assignments, k):
+    order = np.argsort(assignments, axis=-1, kind="stable")
+    sizes = np.stack([np.bincount(row, minlength=k) for row in assignments])
+    bounds = np.concatenate([np.zeros((len(sizes), 1), dtype=np.int64), np.cumsum(sizes, axis=-1)], axis=-1)
+    return [[order[j, bounds[j, i]:bounds[j, i + 1]] for i in range(k)] for j in range(len(assignments))]
+
+# Returns the row ids that are used for training in a fold, given the row ids used for testing
+#
+# n             The number of rows in the dataset
+# test_indices  The sorted row ids of the test set
+def train_indices(n, test_indices):
+    mask = np.ones(n, dtype=bool)
+    mask[test_indices] = False
+    return np.flatnonzero(mask)
+
+# Returns the row ids of the train- or test-section of a fold
+#
+# section       Either "train" or "test"
+# name          The name of the dataset (without directory or extension)
+# partition     The index of the fold
+# repeat        The index of the repeat, or None for a single k-fold split
+# n             The number of rows in the dataset
+def section_indices(section, name, partition, repeat, n):
+    test_indices = read_fold_manifest(name, partition, repeat)
+    if section == "test":
+        return test_indices
+    return train_indices(n, test_indices)
+
+# Reads a dataset once per process, so all folds of a dataset share the same parsed instances
+@lru_cache(maxsize=8)
+def read_dataset_cached(path):
+    return read_dataset(path)
+
+# Reads the header and data lines of a dataset once per process
+@lru_cache(maxsize=8)
+def read_lines_cached(path):
+    f = open(path)
+    lines = f.read().strip().split("\n")
+    f.close()
+
+    return lines[0], lines[1:]
+
+# Returns whether a filename refers to a fold that only exists as a manifest
+#
+# directory     The directory of the dataset type (original, numeric or binary)
+# filename      The filename relative to the directory, without extension
+def is_virtual_split(directory, filename):
+    if not SPLIT_PATTERN.match(filename):
+        return False
+    _, name, repeat, partition = parse_split(filename)
+    return os.path.exists(fold_manifest_path(name, partition, repeat))
+
+# Splits a filename that refers to a fold into its section, dataset name, repeat (or None) and partition
+#
+# filename      The filename relative to the dataset directory, e.g. "train/acath_partition_0"
+def parse_split(filename):
+    section, name, repeat, partition = SPLIT_PATTERN.match(filename).groups()
+    return section, name, None if repeat is None else int(repeat), int(partition)
+
+# Returns the instances of a dataset or of a section of one of its folds
+# Folds are returned as views of the cached full dataset, which keeps older materialized train/test-files working as well
+#
+# directory     The directory of the dataset type (original, numeric or binary)
+# filename      The filename relative to the directory, without extension (e.g. "acath" or "train/acath_partition_0")
+def load_split(directory, filename):
+    if not is_virtual_split(directory, filename):
+        return read_dataset_cached(f"{directory}/{filename}.txt")
+
+    section, name, repeat, partition = parse_split(filename)
+    instances = read_dataset_cached(f"{directory}/{name}.txt")
+    return IndexView(instances, section_indices(section, name, partition, repeat, len(instances)))
+
+# Returns the header line and the data lines of a dataset or of a section of one of its folds
+#
+# directory     The directory of the dataset type (original, numeric or binary)
+# filename      The filename relative to the directory, without extension
+def read_split_lines(directory, filename):
+    if not is_virtual_split(directory, filename):
+        return read_lines_cached(f"{directory}/{filename}.txt")
+
+    section, name, repeat, partition = parse_split(filename)
+    info_line, data_lines = read_lines_cached(f"{directory}/{name}.txt")
+    indices = section_indices(section, name, partition, repeat, len(data_lines))
+    return info_line, [data_lines[j] for j in indices.tolist()]
+
+# Writes a section of a fold as a text file, for solvers that can only read datasets from disk
+# Files that are newer than both the dataset and the manifest are left untouched
+# Returns the path of the text file
+#
+# directory     The directory of the dataset type (original, numeric or binary)
+# filename      The filename relative to the directory, without extension
+def materialize_split(directory, filename):
+    path = f"{directory}/{filename}.txt"
+    if not is_virtual_split(directory, filename):
+        return path
+
+    _, name, repeat, partition = parse_split(filename)
+    sources = [f"{directory}/{name}.txt", fold_manifest_path(name, partition, repeat)]
+    if os.path.exists(path) and os.path.getmtime(path) >= max(os.path.getmtime(j) for j in sources):
+        return path
+
+    info_line, lines = read_split_lines(directory, filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    f = open(path, "w")
+    f.write(info_line + "\n")
+    f.write("\n".join(lines))
+    f.close()
+
+    return path
+
+# Writes the text files of all folds that are referenced in the settings file, using multiple threads
+#
+# directory     The directory of the dataset type (original, numeric or binary)
+def materialize_settings(directory):
+    filenames = []
+    for settings in parse_settings(f"{DIRECTORY}/output/settings.txt"):
+        for key in ["file", "test-file"]:
+            if settings[key] not in filenames and is_virtual_split(directory, settings[key]):
+                filenames.append(settings[key])
+
+    # Handle one dataset at a time, so the threads share its cached lines
+    names = []
+    for filename in filenames:
+        if parse_split(filename)[1] not in names:
+            names.append(parse_split(filename)[1])
+
+    with ThreadPoolExecutor(WRITE_WORKERS) as executor:
+        for name in names:
+            read_lines_cached(f"{directory}/{name}.txt")
+            curr_filenames = [j for j in filenames if parse_split(j)[1] == name]
+            for filename, _ in zip(curr_filenames, executor.map(lambda filename: materialize_split(directory, filename), curr_filenames)):
+                print(f"\033[35mMaterialized \033[1m{filename}\033[0m")
+
+if __name__ == "__main__":
+    # Usage: python folds.py <original|numeric|binary>
+    # Writes the train/test-files needed by the solvers that read from disk (OST and CTree)
+    dataset_type = sys.argv[1] if len(sys.argv) > 1 else "original"
+    materialize_settings(f"{DIRECTORY}/datasets/{dataset_type}")
+
+    print("\033[32;1mDone!\033[0m")
@@ -20,8 +20,8 @@ def plot_leaf_distributions(tree, path=""):
     ax.set_ylim([0, 1])
 
     df = pd.DataFrame.from_dict({
-        "time": [inst.time for inst in tree.instances],
-        "event": [inst.event for inst in tree.instances],
+        "time": tree.summary.times,
+        "event": tree.summary.event_flags,
     })
 
     kmf = KaplanMeierFitter(label="")
@@ -0,0 +1,382 @@
+import hashlib
+import importlib
+import json
+import os
+import re
+import subprocess
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from folds import fold_manifest_path
+from utils import file_hash, files_in_directory, step_profile
+from utils import DIRECTORY, ORIGINAL_DIRECTORY, NUMERIC_DIRECTORY, BINARY_DIRECTORY, CATALOG_FILE
+
+# The file in which the fingerprint of every node that ran successfully is stored, together with the hashes of the files it has seen
+STATE_FILE = f"{DIRECTORY}/.pipeline_state.json"
+
+# The number of nodes that are run at the same time
+JOBS = 4
+
+# The algorithms whose trees are created and evaluated
+ALGORITHMS = ["streed", "ost", "ctree"]
+
+# The steps that create the datasets and the settings of each experiment, and the steps that process its results
+EXPERIMENTS = {
+    "real": {"source": "step_1_download_datasets", "settings": "step_5b_generate_real_data_settings", "reports": ["step_10_process_results", "step_11_output_tables"]},
+    "synthetic": {"source": "step_2a_generate_synthetic_datasets", "settings": "step_5a_generate_synthetic_settings", "reports": ["step_10_process_results", "step_12_output_figures", "step_14_output_train_score"]},
+    "scalability": {"source": "step_2c_generate_scalability_datasets", "settings": "step_5c_generate_scalability_settings", "reports": ["step_13_output_scale_figure"]},
+}
+
+# The sources that generate their datasets in a process pool of their own
+POOLED_SOURCES = ["step_2a_generate_synthetic_datasets", "step_2c_generate_scalability_datasets"]
+
+# The main output of each step that processes results, which marks the step as done
+REPORT_OUTPUTS = {
+    "step_10_process_results": f"{DIRECTORY}/plots/sorted_ibs_ratio.png",
+    "step_11_output_tables": f"{DIRECTORY}/tables/hc_ibs_survset.txt",
+    "step_12_output_figures": f"{DIRECTORY}/plots/synthetic_inc_n.pdf",
+    "step_13_output_scale_figure": f"{DIRECTORY}/plots/runtime_d.pdf",
+    "step_14_output_train_score": f"{DIRECTORY}/plots/train_score.pdf",
+}
+
+# A step of the pipeline, or the part of a step that handles a single dataset or algorithm
+# A node is stale when its fingerprint (its action, code and the contents of its inputs) differs from the last time it ran, or when an output is missing
+# Nodes that read an output of another node (or a file inside an output directory of it) run after that node
+# An exclusive node runs in the main process once no other node is running, so it has every CPU to itself: the solvers, whose runtimes are results,
+# and the steps that start a process pool of their own
+class Node:
+    # name      The name of the node, such as "step_3:veteran"
+    # action    The function to run, as "module.function"
+    # args      The arguments of the function
+    # inputs    The files the node reads
+    # outputs   The files and directories the node writes
+    # code      The source files the node depends on, by default those of the module of the action and its local imports
+    # exclusive Whether the node runs on its own
+    def __init__(self, name, action, args=(), inputs=(), outputs=(), code=None, exclusive=False):
+        self.name = name
+        self.action = action
+        self.args = [*args]
+        self.inputs = [*inputs]
+        self.outputs = [*outputs]
+        self.code = code if code is not None else code_files(action.rsplit(".", 1)[0])
+        self.exclusive = exclusive
+
+    def __repr__(self):
+        return self.name
+
+# Returns the source files of a module of this repository and of all modules of this repository it imports, directly or indirectly
+#
+# module    The name of the module
+def code_files(module):
+    files = []
+    queue = [module]
+    while queue:
+        path = f"{DIRECTORY}/{queue.pop()}.py"
+        if path in files or not os.path.exists(path):
+            continue
+        files.append(path)
+
+        f = open(path)
+        queue.extend(re.findall(r"^\s*(?:from|import)\s+(\w+)", f.read(), flags=re.MULTILINE))
+        f.close()
+    return sorted(files)
+
+# Imports and runs the action of a node, in a worker process (or in the main process for exclusive nodes)
+# The node is profiled like a step run by hand, with its profile written to the profile directory of the module of the action (or to the output directory)
+#
+# action    The function to run, as "module.function"
+# args      The arguments of the function
+# name      The name of the node
+def run_action(action, args, name):
+    module, function = action.rsplit(".", 1)
+    module = importlib.import_module(module)
+    with step_profile(name.replace(":", "_"), getattr(module, "PROFILE_DIRECTORY", f"{DIRECTORY}/output")):
+        return getattr(module, function)(*args)
+
+# Writes the train/test-files a solver reads and runs the solver as a separate program
+#
+# dataset_type  The type of datasets the solver reads (original, numeric or binary)
+# command       The command that runs the solver
+def run_solver(dataset_type, command):
+    from folds import materialize_settings
+    materialize_settings(f"{DIRECTORY}/datasets/{dataset_type}")
+    subprocess.run(command, cwd=DIRECTORY, check=True)
+
+# Keeps the hashes of the files seen by the pipeline, and the fingerprints of the nodes that ran successfully
+# A file is only hashed again once its size or modification time changes
+class PipelineState:
+    def __init__(self, path=STATE_FILE):
+        self.path = path
+        self.files = {}
+        self.nodes = {}
+        if os.path.exists(path):
+            f = open(path)
+            state = json.load(f)
+            f.close()
+            self.files, self.nodes = state["files"], state["nodes"]
+
+    # Returns the hash of the contents of a file or directory, or "missing" if it does not exist
+    #
+    # path      The path to hash
+    def path_hash(self, path):
+        if os.path.isdir(path):
+            return hashlib.sha256(json.dumps([(j, self.path_hash(f"{path}/{j}")) for j in sorted(os.listdir(path))]).encode()).hexdigest()
+        if not os.path.exists(path):
+            return "missing"
+
+        stat = os.stat(path)
+        key = [stat.st_size, stat.st_mtime_ns]
+        if path not in self.files or self.files[path][:2] != key:
+            self.files[path] = key + [file_hash(path)]
+        return self.files[path][2]
+
+    # Returns the fingerprint of a node, given the current contents of its inputs and code
+    #
+    # node      The node to fingerprint
+    def fingerprint(self, node):
+        parts = [node.action, node.args, [self.path_hash(j) for j in node.code], [(j, self.path_hash(j)) for j in node.inputs]]
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+    # Returns whether a node has to run, and its current fingerprint
+    #
+    # node      The node to check
+    def is_stale(self, node):
+        fingerprint = self.fingerprint(node)
+        return self.nodes.get(node.name) != fingerprint or not all(os.path.exists(j) for j in node.outputs), fingerprint
+
+    def save(self):
+        f = open(f"{self.path}.tmp", "w")
+        json.dump({"files": self.files, "nodes": self.nodes}, f)
+        f.close()
+        os.replace(f"{self.path}.tmp", self.path)
+
+# Returns the names of the datasets of an experiment that are in the original directory
+#
+# experiment    The name of the experiment
+def experiment_datasets(experiment):
+    generated = experiment != "real"
+    return sorted(j[:-4] for j in files_in_directory(ORIGINAL_DIRECTORY) if j.startswith("generated_dataset_") == generated)
+
+# Returns the node that creates the original datasets of an experiment
+#
+# experiment    The name of the experiment
+def source_node(experiment):
+    source = EXPERIMENTS[experiment]["source"]
+    return Node(source.split("_")[0] + "_" + source.split("_")[1], f"{source}.main", outputs=[ORIGINAL_DIRECTORY], exclusive=source in POOLED_SOURCES)
+
+# Returns all nodes of an experiment, with a node per dataset for converting (step 3) and splitting (step 4) it
+# The datasets are those currently in the original directory, so the source of the experiment must have run first
+#
+# experiment    The name of the experiment
+def build_graph(experiment):
+    from step_4_split_datasets import split_order, K, R
+    datasets = experiment_datasets(experiment)
+    nodes = [source_node(experiment)]
+
+    def original(name):
+        return f"{ORIGINAL_DIRECTORY}/{name}.txt"
+
+    def feature_meanings(name):
+        return f"{DIRECTORY}/datasets/feature_meanings/{name}.txt"
+
+    def folds(name):
+        if experiment != "real":
+            return []
+        return [fold_manifest_path(name, i, j if R > 1 else None) for j in range(R) for i in range(K)]
+
+    for name in datasets:
+        nodes.append(Node(f"step_3:{name}", "step_3_convert_datasets.convert_dataset", [name],
+            inputs=[original(name)], outputs=[f"{NUMERIC_DIRECTORY}/{name}.txt", f"{BINARY_DIRECTORY}/{name}.txt", feature_meanings(name)]))
+        if experiment == "real":
+            # A single repeat continues the stream of the datasets that are shuffled before this one, so their sizes are inputs as well
+            order = split_order()
+            shuffled_before = order[:order.index(name)] if R == 1 and name in order else []
+            nodes.append(Node(f"step_4:{name}", "step_4_split_datasets.split_dataset", [name],
+                inputs=[original(j) for j in shuffled_before + [name]], outputs=folds(name)))
+
+    settings_file = f"{DIRECTORY}/output/settings.txt"
+    settings = EXPERIMENTS[experiment]["settings"]
+    nodes.append(Node(settings.split("_")[0] + "_" + settings.split("_")[1], f"{settings}.main", inputs=[original(j) for j in datasets], outputs=[settings_file]))
+
+    # The solvers read the settings, the datasets of their type and the folds
+    # They run one at a time, since the runtimes they measure are compared between them
+    fold_inputs = [j for name in datasets for j in folds(name)]
+    nodes.append(Node("step_6", "step_6_run_streed.main",
+        inputs=[settings_file] + [f"{BINARY_DIRECTORY}/{j}.txt" for j in datasets] + [feature_meanings(j) for j in datasets] + fold_inputs,
+        outputs=[f"{DIRECTORY}/output/streed_trees.csv"], exclusive=True))
+    nodes.append(Node("step_7", "pipeline.run_solver", ["original", ["julia", "step_7_run_ost.jl"]],
+        inputs=[settings_file] + [original(j) for j in datasets] + [feature_meanings(j) for j in datasets] + fold_inputs,
+        outputs=[f"{DIRECTORY}/output/ost_trees.csv"], code=[f"{DIRECTORY}/step_7_run_ost.jl"] + code_files("folds"), exclusive=True))
+    nodes.append(Node("step_8", "pipeline.run_solver", ["numeric", ["Rscript", "step_8_run_ctree.r"]],
+        inputs=[settings_file] + [f"{NUMERIC_DIRECTORY}/{j}.txt" for j in datasets] + [feature_meanings(j) for j in datasets] + fold_inputs,
+        outputs=[f"{DIRECTORY}/output/ctree_trees.csv"], code=[f"{DIRECTORY}/step_8_run_ctree.r"] + code_files("folds"), exclusive=True))
+
+    # Each algorithm is evaluated on its own, so a rerun of one solver only requires its own trees to be evaluated again
+    # Step 9 evaluates the trees in a process pool of its own
+    for algorithm in ALGORITHMS:
+        nodes.append(Node(f"step_9:{algorithm}", "step_9_evaluate_trees.evaluate_algorithm", [algorithm],
+            inputs=[f"{DIRECTORY}/output/{algorithm}_trees.csv"] + [original(j) for j in datasets] + fold_inputs,
+            outputs=[f"{DIRECTORY}/output/{algorithm}_output.csv"], exclusive=True))
+
+    for report in EXPERIMENTS[experiment]["reports"]:
+        inputs = [f"{DIRECTORY}/output/{j}_output.csv" for j in ALGORITHMS] + [CATALOG_FILE]
+        if report == "step_13_output_scale_figure":
+            inputs.append(f"{DIRECTORY}/output/streed_nod2_output.csv")
+        nodes.append(Node(report.split("_")[0] + "_" + report.split("_")[1], f"{report}.main", inputs=inputs, outputs=[REPORT_OUTPUTS[report]]))
+
+    return nodes
+
+# Returns, for each node, the names of the nodes that write one of its inputs
+#
+# nodes     The nodes of the graph
+def dependencies(nodes):
+    producers = {}
+    for node in nodes:
+        for output in node.outputs:
+            producers[output] = node.name
+
+    result = {}
+    for node in nodes:
+        result[node.name] = set()
+        for path in node.inputs:
+            # An input is written by the node that writes it or one of its parent directories
+            parent = path
+            while parent not in producers and os.path.dirname(parent) != parent:
+                parent = os.path.dirname(parent)
+            if parent in producers and producers[parent] != node.name:
+                result[node.name].add(producers[parent])
+    return result
+
+# Returns the nodes that are needed for a list of targets: the targets and everything they depend on
+# A target is the name of a node or the part before the colon, such as "step_3" for the conversion of every dataset
+#
+# nodes     The nodes of the graph
+# targets   The names of the targets, or an empty list for all nodes
+def select_nodes(nodes, targets):
+    if not targets:
+        return nodes
+
+    depends_on = dependencies(nodes)
+    selected = set()
+    queue = [j.name for j in nodes if j.name in targets or j.name.split(":")[0] in targets]
+    while queue:
+        name = queue.pop()
+        if name not in selected:
+            selected.add(name)
+            queue.extend(depends_on[name])
+    return [j for j in nodes if j.name in selected]
+
+# Runs the stale nodes of a graph, each as soon as the nodes it depends on are done, with at most `jobs` nodes at once
+# Exclusive nodes wait until no other node is running and then run in this process, one at a time
+# A node is only checked for staleness once the nodes it depends on are done, so a node whose inputs were rewritten with the same contents is not run again
+# Returns the names of the nodes that failed, or could not run because a node they depend on failed
+#
+# nodes     The nodes to run
+# state     The pipeline state with the fingerprints of earlier runs
+# jobs      The number of nodes to run at the same time
+# force     Whether to run every node, whether it is stale or not
+# dry_run   Whether to only print which nodes would run, assuming every node after a stale node changes its outputs
+def run_graph(nodes, state, jobs=JOBS, force=False, dry_run=False):
+    depends_on = dependencies(nodes)
+    by_name = {j.name: j for j in nodes}
+    pending = [j.name for j in nodes]
+    done, failed, changed = set(), set(), set()
+    running = {}
+    exclusive = []
+
+    def finish(node, fingerprint, result, error):
+        if error is not None:
+            print(f"\033[31;1mFailed {node.name}: {error!r}\033[0m")
+            failed.add(node.name)
+            state.nodes.pop(node.name, None)
+            state.save()
+            return
+
+        # The catalog is only written here, so the conversions of different datasets never write it at the same time
+        if node.action == "step_3_convert_datasets.convert_dataset":
+            from step_3_convert_datasets import update_catalog
+            update_catalog([result])
+
+        state.nodes[node.name] = fingerprint
+        state.save()
+        done.add(node.name)
+
+    with ProcessPoolExecutor(jobs) as executor:
+        while pending or running or exclusive:
+            # Start every node whose dependencies are done
+            for name in [j for j in pending if depends_on[j] <= done | failed]:
+                pending.remove(name)
+                node = by_name[name]
+                if depends_on[name] & failed:
+                    print(f"\033[31mSkipped \033[1m{name}\033[0;31m, a node it depends on failed\033[0m")
+                    failed.add(name)
+                    continue
+
+                stale, fingerprint = state.is_stale(node)
+                if not (stale or force or depends_on[name] & changed):
+                    done.add(name)
+                    continue
+                if dry_run:
+                    print(f"\033[34mWould run \033[1m{name}\033[0m")
+                    changed.add(name)
+                    done.add(name)
+                    continue
+
+                if node.exclusive:
+                    exclusive.append((node, fingerprint))
+                    continue
+                print(f"\033[35mRunning \033[1m{name}\033[0m")
+                running[executor.submit(run_action, node.action, node.args, node.name)] = (node, fingerprint)
+
+            if not running:
+                if exclusive:
+                    node, fingerprint = exclusive.pop(0)
+                    print(f"\033[35mRunning \033[1m{node.name}\033[0;35m on its own\033[0m")
+                    try:
+                        finish(node, fingerprint, run_action(node.action, node.args, node.name), None)
+                    except Exception as e:
+                        finish(node, fingerprint, None, e)
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                node, fingerprint = running.pop(future)
+                try:
+                    result = future.result()
+                except BaseException as e:
+                    finish(node, fingerprint, None, e)
+                    continue
+                finish(node, fingerprint, result, None)
+
+    return sorted(failed)
+
+# Runs the stale part of the pipeline of an experiment
+# The source of the experiment runs first, as the nodes of the later steps depend on the datasets it creates
+#
+# experiment    The name of the experiment
+# targets       The names of the nodes to bring up to date (with everything they depend on), or an empty list for all nodes
+# jobs          The number of nodes to run at the same time
+# force         Whether to run every selected node, whether it is stale or not
+# dry_run       Whether to only print which nodes would run
+def run_pipeline(experiment, targets=(), jobs=JOBS, force=False, dry_run=False):
+    state = PipelineState()
+
+    # A dry run cannot create the datasets, so it only checks the nodes of the datasets that already exist
+    failed = [] if dry_run else run_graph([source_node(experiment)], state, jobs, force)
+    if not failed:
+        failed = run_graph(select_nodes(build_graph(experiment), [*targets]), state, jobs, force, dry_run)
+    return failed
+
+if __name__ == "__main__":
+    # Usage: python pipeline.py <real|synthetic|scalability> [<target> ...] [--jobs=<n>] [--force] [--dry-run]
+    # Brings the outputs of the targets (by default all steps of the experiment) up to date, only running the steps whose inputs or code changed
+    options = [j for j in sys.argv[1:] if j.startswith("--")]
+    arguments = [j for j in sys.argv[1:] if not j.startswith("--")]
+    experiment = arguments[0] if arguments else "real"
+    jobs = int(next((j.split("=")[1] for j in options if j.startswith("--jobs=")), JOBS))
+
+    failed = run_pipeline(experiment, arguments[1:], jobs, force="--force" in options, dry_run="--dry-run" in options)
+    if failed:
+        print(f"\033[31;1mFailed: {', '.join(failed)}\033[0m")
+        sys.exit(1)
+
+    print("\033[32;1mDone!\033[0m")
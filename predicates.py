@@ -0,0 +1,151 @@
+import numpy as np
+import threading
+from collections import OrderedDict
+from arena import ColumnInstances, RowFeatures
+from folds import IndexView
+from utils import columns_from_instances
+
+# The number of datasets for which predicate caches are kept per process
+MAX_CACHED_DATASETS = 8
+
+# The number of set bits in each possible byte
+POPCOUNT_TABLE = np.array([bin(j).count("1") for j in range(256)], dtype=np.int64)
+
+# The predicate caches of this process, per dataset, and the lock that guards them when trees are evaluated in threads
+predicate_caches = OrderedDict()
+predicate_caches_lock = threading.Lock()
+
+# Returns a key that is equal for predicates with the same code and bound values, such as two separately parsed copies of `lambda x: x['num_age'] > 55`
+#
+# predicate     The function to make a key for
+def predicate_key(predicate):
+    code = predicate.__code__
+    closure = tuple(cell.cell_contents for cell in predicate.__closure__ or [])
+    key = (code.co_code, code.co_consts, code.co_names, closure)
+    try:
+        hash(key)
+    except TypeError:
+        # Predicates bound to unhashable values are only shared with themselves
+        return predicate
+    return key
+
+# Returns the number of set bits in a bit-packed mask
+#
+# mask      The bit-packed mask
+def popcount(mask):
+    return int(POPCOUNT_TABLE[mask].sum())
+
+# The values of all instances of a dataset, accessed like the features of a single instance
+# Predicates such as `lambda x: x['num_age'] > 55` are thereby evaluated for all instances at once
+class ColumnFeatures:
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __getitem__(self, key):
+        return self.columns[key]
+
+# Evaluates the split predicates of trees on a dataset, and stores the result of each distinct predicate as a bit-packed mask
+# Leaf membership of any tree on the dataset is then found with bitwise operations on these masks
+class PredicateCache:
+    def __init__(self, columns):
+        self.columns = columns
+        self.n = len(next(iter(columns.values())))
+        self.names = [j for j in columns if j not in ["time", "event"]]
+        self.masks = {}
+
+    # Returns the bit-packed mask of the instances for which a predicate holds
+    #
+    # predicate     The predicate to evaluate
+    def mask(self, predicate):
+        key = predicate_key(predicate)
+        if key not in self.masks:
+            self.masks[key] = np.packbits(self.evaluate(predicate))
+        return self.masks[key]
+
+    # Evaluates a predicate for all instances
+    # Predicates that cannot be evaluated on whole columns (e.g. `lambda x: x['fac'] in [...]`) are evaluated per instance
+    #
+    # predicate     The predicate to evaluate
+    def evaluate(self, predicate):
+        try:
+            result = predicate(ColumnFeatures(self.columns))
+            if isinstance(result, np.ndarray) and result.shape == (self.n,):
+                return result.astype(bool)
+        except (TypeError, ValueError):
+            pass
+
+        return np.fromiter((bool(predicate(RowFeatures(self.columns, self.names, j))) for j in range(self.n)), dtype=bool, count=self.n)
+
+    # Returns the leaves of a tree together with the bit-packed mask of the instances that end up in each of them
+    #
+    # tree      The tree to classify the instances with
+    # rows      The bit-packed mask of the instances to classify, or None for all instances
+    def leaf_masks(self, tree, rows=None):
+        if rows is None:
+            rows = np.packbits(np.ones(self.n, dtype=bool))
+
+        if not tree.trees:
+            return [(tree, rows)]
+
+        mask = self.mask(tree.criterium)
+        return self.leaf_masks(tree.trees[0], rows & ~mask) + self.leaf_masks(tree.trees[1], rows & mask)
+
+    # Returns the number of instances in each leaf of a tree
+    #
+    # tree      The tree to classify the instances with
+    # rows      The bit-packed mask of the instances to classify, or None for all instances
+    def leaf_counts(self, tree, rows=None):
+        return [(leaf, popcount(mask)) for leaf, mask in self.leaf_masks(tree, rows)]
+
+    # Returns the leaves of a tree and, for each of the given instances, the index of the leaf it ends up in
+    #
+    # tree      The tree to classify the instances with
+    # indices   The row ids of the instances to classify
+    def leaf_ids(self, tree, indices):
+        leaf_ids = np.zeros(self.n, dtype=np.int64)
+        leaves = []
+        for j, (leaf, mask) in enumerate(self.leaf_masks(tree)):
+            leaf_ids[np.unpackbits(mask, count=self.n).astype(bool)] = j
+            leaves.append(leaf)
+        return leaves, leaf_ids[indices]
+
+# Returns the predicate cache of the full dataset that a sequence of instances belongs to, and the row ids of the instances within it
+# All folds of a dataset, and all trees evaluated on them, share the same cache
+#
+# instances     The instances (a list, a fold view, a columnar view or a map from feature name to column)
+def predicate_cache(instances):
+    if isinstance(instances, dict):
+        base, indices = instances, np.arange(len(next(iter(instances.values()))))
+    elif isinstance(instances, ColumnInstances):
+        base, indices = instances.columns, instances.indices
+    elif isinstance(instances, IndexView):
+        base, indices = instances.base, instances.indices
+    else:
+        base, indices = instances, np.arange(len(instances))
+
+    # The base object is stored along with its cache, so its id cannot be reused while it is cached
+    key = id(base)
+    with predicate_caches_lock:
+        if key not in predicate_caches:
+            columns = base if isinstance(base, dict) else columns_from_instances(base)
+            predicate_caches[key] = (base, PredicateCache(columns))
+            if len(predicate_caches) > MAX_CACHED_DATASETS:
+                predicate_caches.popitem(last=False)
+        predicate_caches.move_to_end(key)
+
+        return predicate_caches[key][1], indices
+
+# Returns the leaves of a tree and, for each instance, the index of the leaf it ends up in
+#
+# tree          The tree to classify the instances with
+# instances     The instances to classify
+def leaf_assignment(tree, instances):
+    cache, indices = predicate_cache(instances)
+    return cache.leaf_ids(tree, indices)
+
+# Returns the times and events of the instances as arrays
+#
+# instances     The instances (a list, a fold view or a columnar view)
+def survival_arrays(instances):
+    cache, indices = predicate_cache(instances)
+    return cache.columns["time"][indices], cache.columns["event"][indices]
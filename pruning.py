@@ -0,0 +1,144 @@
+import sys
+from step_9_evaluate_trees import calculate_concordance, calculate_integrated_brier_score, evaluation_context, relative_score
+from utils import fill_tree, parse_tree, Tree
+from utils import DIRECTORY
+
+# Returns the summaries of every node of a tree, merged upward from the summaries of its leaves
+#
+# tree              The tree to summarize
+# leaf_summaries    One summary per leaf, in the order of `get_leaves`
+def node_summaries(tree, leaf_summaries):
+    summaries = {}
+    leaves = iter(leaf_summaries)
+
+    def merge(node):
+        if not node.trees:
+            summaries[node] = next(leaves)
+        else:
+            summaries[node] = merge(node.trees[0]).merge(merge(node.trees[1]))
+        return summaries[node]
+
+    merge(tree)
+    return summaries
+
+# Returns the internal nodes of a tree that are not inside a collapsed subtree
+#
+# tree          The tree to search
+# collapsed     The set of nodes that are turned into leaves
+def internal_nodes(tree, collapsed):
+    if not tree.trees or tree in collapsed:
+        return []
+    return [tree] + internal_nodes(tree.trees[0], collapsed) + internal_nodes(tree.trees[1], collapsed)
+
+# Returns the nodes that act as leaves of a tree once some of its subtrees are collapsed
+#
+# tree          The tree to search
+# collapsed     The set of nodes that are turned into leaves
+def effective_leaves(tree, collapsed):
+    if not tree.trees or tree in collapsed:
+        return [tree]
+    return effective_leaves(tree.trees[0], collapsed) + effective_leaves(tree.trees[1], collapsed)
+
+# Returns the weakest-link (cost-complexity) pruning sequence of a tree
+# Each step collapses the internal nodes whose removal increases the error the least per removed leaf
+# Returns a list of (alpha, set of collapsed nodes), starting with the full tree and ending with only the root
+#
+# tree      The tree to prune
+# errors    The error of each node when it is turned into a leaf
+def pruning_sequence(tree, errors):
+    collapsed = set()
+    sequence = [(0, set())]
+    alpha = 0
+
+    while tree.trees and tree not in collapsed:
+        strengths = {}
+        for node in internal_nodes(tree, collapsed):
+            leaves = effective_leaves(node, collapsed)
+            strengths[node] = (errors[node] - sum(errors[j] for j in leaves)) / (len(leaves) - 1)
+
+        # Collapse all weakest links at once, and never let alpha decrease
+        weakest = min(strengths.values())
+        collapsed |= {node for node, strength in strengths.items() if strength <= weakest + 1e-12}
+        alpha = max(alpha, weakest)
+        sequence.append((alpha, set(collapsed)))
+
+    return sequence
+
+# Returns a copy of a tree in which some subtrees are collapsed into leaves
+# The leaves take their labels from the labeled nodes, so the copy can be evaluated like any other tree
+#
+# tree          The tree to copy
+# collapsed     The set of nodes that are turned into leaves
+# labels        The labeled leaf to copy for each node
+def pruned_copy(tree, collapsed, labels):
+    if not tree.trees or tree in collapsed:
+        label = labels[tree]
+        leaf = Tree(-1, None, None)
+        leaf.theta, leaf.kaplan_meier_distribution, leaf.leblanc_distribution = label.theta, label.kaplan_meier_distribution, label.leblanc_distribution
+        return leaf
+    return Tree(tree.criterium, pruned_copy(tree.trees[0], collapsed, labels), pruned_copy(tree.trees[1], collapsed, labels))
+
+# Evaluates every subtree on the weakest-link pruning path of a tree on a train- and test-set
+# The train- and test-set are summarized per leaf once, and the summaries are merged upward, so every node knows its label and errors
+# The subtrees share the cached predicate masks of the datasets, so the path costs about as much as evaluating the tree itself
+# Returns a list with, for each subtree, its alpha, number of nodes, IBS ratio and objective and concordance scores
+#
+# tree              The (unfilled) tree to prune
+# train_filename    The filename of the train-set
+# test_filename     The filename of the test-set
+# sd_method         The survival distribution method, either "kaplan_meier" or "leblanc"
+# arena_name        The name of the arena to attach to, or None to read the datasets directly
+def pruning_path(tree, train_filename, test_filename, sd_method="kaplan_meier", arena_name=None):
+    context = evaluation_context(train_filename, test_filename, arena_name)
+    fill_tree(tree, context.train_instances, context.train_hazard_function)
+
+    # Label every node as if it were a leaf, using the summaries of the train-set
+    labels = {}
+    for node, summary in node_summaries(tree, [leaf.summary for leaf in tree.get_leaves()]).items():
+        label = Tree(-1, None, None)
+        label.summary = summary
+        label.calculate_label()
+        label.calculate_leblanc_km_estimator(context.train_hazard_function)
+        labels[node] = label
+
+    # The error of every node as a leaf, on both sets
+    errors = {}
+    for name in ["train", "test"]:
+        summaries = node_summaries(tree, tree.summarize(context.instances[name], context.hazard_functions[name], keep_times=False))
+        errors[name] = {node: summary.error(labels[node].theta) for node, summary in summaries.items()}
+
+    path = []
+    base_tree_ibs = context.base_integrated_brier_score()
+    for alpha, collapsed in pruning_sequence(tree, errors["train"]):
+        subtree = pruned_copy(tree, collapsed, labels)
+        leaves = effective_leaves(tree, collapsed)
+
+        results = {
+            "alpha": alpha,
+            "num_nodes": subtree.size(),
+            "integrated_brier_score_ratio": relative_score(calculate_integrated_brier_score(subtree, context, method=sd_method), base_tree_ibs),
+        }
+        for name in ["train", "test"]:
+            results[name] = {
+                "objective_score": relative_score(sum(errors[name][j] for j in leaves), context.base_error(name)),
+                "concordance_score": calculate_concordance(subtree, context.instances[name], method=sd_method, order=context.orders[name]),
+            }
+        path.append(results)
+
+    return path
+
+if __name__ == "__main__":
+    # Usage: python pruning.py <streed|ost|ctree> [line number]
+    # Prints the pruning path of a tree of a trees file
+    algorithm = sys.argv[1] if len(sys.argv) > 1 else "streed"
+    line_number = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+
+    f = open(f"{DIRECTORY}/output/{algorithm}_trees.csv")
+    lines = f.read().strip().split("\n")
+    f.close()
+
+    null = None
+    _, settings, _, flat_tree = [eval(j) for j in lines[line_number].split(";")]
+    print(f"\033[35;1m{settings}\033[0m")
+    for results in pruning_path(parse_tree(flat_tree), settings["file"], settings["test-file"]):
+        print(f"\033[34m{results}\033[0m")
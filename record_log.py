@@ -0,0 +1,74 @@
+import os
+from utils import DIRECTORY
+
+# The line that marks that a solver has finished, after which no more records are appended to its log
+END_MARKER = "#END#"
+
+# The number of seconds to wait before looking for new records again
+POLL_INTERVAL = 0.5
+
+# Returns the path of the record log of an algorithm
+#
+# algorithm     The name of the algorithm
+def record_log_path(algorithm):
+    return f"{DIRECTORY}/output/{algorithm}_trees.log"
+
+# Starts a new, empty record log for an algorithm, replacing the log of a previous run
+#
+# algorithm     The name of the algorithm
+def start_record_log(algorithm):
+    f = open(record_log_path(algorithm), "w")
+    f.close()
+
+# Appends a line to the record log of an algorithm with a single write, so a reader never sees part of a line followed by another line
+#
+# algorithm     The name of the algorithm
+# line          The line to append, without newline
+def append_line(algorithm, line):
+    fd = os.open(record_log_path(algorithm), os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+    try:
+        os.write(fd, (line + "\n").encode())
+    finally:
+        os.close(fd)
+
+# Appends the record of a finished run to the record log of an algorithm, as "<index>;<settings>;<time>;<tree>"
+#
+# algorithm     The name of the algorithm
+# index         The index of the settings of the run in the settings file
+# record        The settings, time and tree of the run, as "<settings>;<time>;<tree>"
+def append_record(algorithm, index, record):
+    append_line(algorithm, f"{index};{record}")
+
+# Marks the record log of an algorithm as finished
+#
+# algorithm     The name of the algorithm
+def end_record_log(algorithm):
+    append_line(algorithm, END_MARKER)
+
+# Follows the record log of an algorithm while it is being written, until it is marked as finished
+# Yields each record as (index, "<settings>;<time>;<tree>"), and None whenever there is no new record yet,
+# so the caller can do other work (or wait `POLL_INTERVAL` seconds) in between
+#
+# algorithm     The name of the algorithm
+def follow_record_log(algorithm):
+    path = record_log_path(algorithm)
+    while not os.path.exists(path):
+        yield None
+
+    f = open(path)
+    buffer = ""
+    while True:
+        chunk = f.read()
+        if not chunk:
+            yield None
+            continue
+
+        # Only complete lines are handled, the rest is kept until the line is finished
+        buffer += chunk
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            if line == END_MARKER:
+                f.close()
+                return
+            index, record = line.split(";", 1)
+            yield int(index), record
@@ -0,0 +1,221 @@
+import numpy as np
+import os
+import pandas as pd
+import sqlite3
+import sys
+from utils import file_hash, CATALOG_FILE
+
+DIRECTORY = os.path.realpath(os.path.dirname(__file__))
+
+# The database with the flat results table, which holds one row per setting and algorithm
+RESULTS_DATABASE = f"{DIRECTORY}/output/results.sqlite"
+
+# The columns of the results table that come from the settings, with their names in the settings
+SETTINGS_COLUMNS = {
+    "file": "file",
+    "test_file": "test-file",
+    "dataset": "core-file",
+    "max_depth": "max-depth",
+    "max_num_nodes": "max-num-nodes",
+    "hyper_tune": "hyper-tune",
+    "cost_complexity": "cost-complexity",
+}
+
+# The columns of the results table that hold a metric of the whole tree
+TREE_METRICS = ["runtime", "num_nodes", "integrated_brier_score_ratio"]
+
+# The metrics that are computed on both the train- and the test-set, which are stored as "train_<metric>" and "test_<metric>"
+SET_METRICS = ["objective_score", "concordance_score", "uno_concordance_score", "mean_cumulative_dynamic_auc"]
+
+# The type of each column of the results table
+COLUMN_TYPES = {
+    "method": "TEXT",
+    "id": "INTEGER",
+    **{column: "TEXT" for column in ["file", "test_file", "dataset", "hyper_tune"]},
+    **{column: "INTEGER" for column in ["max_depth", "max_num_nodes", "num_nodes"]},
+    **{column: "REAL" for column in ["cost_complexity", "runtime", "integrated_brier_score_ratio"]},
+    **{f"{type}_{metric}": "REAL" for type in ["train", "test"] for metric in SET_METRICS},
+}
+
+# The columns that the steps processing the results have always worked with
+FRAME_COLUMNS = [
+    "method", "file", "runtime", "num_nodes", "integrated_brier_score_ratio", "max_depth", "max_num_nodes", "hyper_tune", "cost_complexity",
+    "train_objective_score", "train_concordance_score", "test_objective_score", "test_concordance_score",
+]
+
+# The columns that can be filtered on when loading results
+FILTER_COLUMNS = ["method", "dataset", "max_depth"]
+
+# The number of seconds to wait for another process (e.g. step 9 evaluating another algorithm) to finish writing
+LOCK_TIMEOUT = 60
+
+def connect():
+    connection = sqlite3.connect(RESULTS_DATABASE, timeout=LOCK_TIMEOUT)
+    columns = ", ".join(f'"{column}" {type}' for column, type in COLUMN_TYPES.items())
+    connection.execute(f"CREATE TABLE IF NOT EXISTS results ({columns}, PRIMARY KEY (method, id))")
+    for column in FILTER_COLUMNS:
+        connection.execute(f'CREATE INDEX IF NOT EXISTS results_{column} ON results ("{column}")')
+    # The state of the output file of step 9 of each algorithm when its results were last replaced
+    connection.execute("CREATE TABLE IF NOT EXISTS output_files (method TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, hash TEXT)")
+    return connection
+
+# Returns the path of the output file of step 9 of an algorithm
+#
+# method    The name of the algorithm
+def output_file_path(method):
+    return f"{DIRECTORY}/output/{method}_output.csv"
+
+# Records the current state of the output file of an algorithm, whose results are in the results table from now on
+#
+# connection    The connection to the results table
+# method        The name of the algorithm
+def record_output_file(connection, method):
+    path = output_file_path(method)
+    if not os.path.exists(path):
+        connection.execute("DELETE FROM output_files WHERE method = ?", (method,))
+        return
+    stat = os.stat(path)
+    connection.execute("INSERT OR REPLACE INTO output_files VALUES (?, ?, ?, ?)", (method, stat.st_size, stat.st_mtime_ns, file_hash(path)))
+
+# Returns whether the output file of an algorithm changed since its results were last replaced, such as when it was copied in or written elsewhere
+# The file is only hashed again once its size or modification time changes
+#
+# method    The name of the algorithm
+def output_file_changed(method):
+    path = output_file_path(method)
+    if not os.path.exists(path):
+        return False
+    stat = os.stat(path)
+
+    connection = connect()
+    recorded = connection.execute("SELECT size, mtime_ns, hash FROM output_files WHERE method = ?", (method,)).fetchone()
+    changed = recorded is None or ((recorded[0], recorded[1]) != (stat.st_size, stat.st_mtime_ns) and recorded[2] != file_hash(path))
+    if recorded is not None and not changed:
+        with connection:
+            connection.execute("UPDATE output_files SET size = ?, mtime_ns = ? WHERE method = ?", (stat.st_size, stat.st_mtime_ns, method))
+    connection.close()
+    return changed
+
+# Flattens the settings and results of a single tree into a row of the results table
+#
+# method    The name of the algorithm
+# id        The id of the tree
+# settings  The settings the tree was created with
+# results   The results of step 9
+def results_row(method, id, settings, results):
+    row = {"method": method, "id": id}
+    row.update({column: settings.get(key) for column, key in SETTINGS_COLUMNS.items()})
+    row.update({metric: results.get(metric) for metric in TREE_METRICS})
+    for type in ["train", "test"]:
+        set_results = dict(results.get(type, {}))
+        if "cumulative_dynamic_auc" in set_results:
+            set_results["mean_cumulative_dynamic_auc"] = float(np.mean(set_results["cumulative_dynamic_auc"]))
+        row.update({f"{type}_{metric}": set_results.get(metric) for metric in SET_METRICS})
+
+    # Store plain Python values, so every column keeps its declared type
+    return {key: value.item() if isinstance(value, np.generic) else value for key, value in row.items()}
+
+# Stores rows in the results table, replacing the rows of the same trees
+#
+# method    The name of the algorithm
+# rows      The rows to store, as made by `results_row`
+# replace   Whether to remove all other results of the algorithm first, after which the output file as it is now is no longer imported
+def store_rows(method, rows, replace):
+    os.makedirs(os.path.dirname(RESULTS_DATABASE), exist_ok=True)
+    columns = [*COLUMN_TYPES]
+    names = ", ".join(f'"{column}"' for column in columns)
+    placeholders = ", ".join("?" for _ in columns)
+
+    connection = connect()
+    with connection:
+        if replace:
+            connection.execute("DELETE FROM results WHERE method = ?", (method,))
+            record_output_file(connection, method)
+        connection.executemany(f"INSERT OR REPLACE INTO results ({names}) VALUES ({placeholders})", [[row.get(column) for column in columns] for row in rows])
+    connection.close()
+
+# Replaces the results of an algorithm in the results table
+# Step 9 writes its output file first, so the file is only imported again once it is written by something else
+#
+# method    The name of the algorithm
+# rows      The rows to store, as made by `results_row`
+def write_results(method, rows):
+    store_rows(method, rows, replace=True)
+
+# Adds results of an algorithm to the results table while its trees are still being evaluated
+#
+# method    The name of the algorithm
+# rows      The rows to store, as made by `results_row`
+def add_results(method, rows):
+    store_rows(method, rows, replace=False)
+
+# Stores the results of an algorithm from its output file of step 9
+#
+# method    The name of the algorithm
+def import_output_file(method):
+    f = open(output_file_path(method))
+    lines = f.read().strip().split("\n")
+    f.close()
+
+    rows = []
+    for line in lines[1:]:
+        id, settings, results = [eval(j) for j in line.split(";")]
+        rows.append(results_row(method, id, settings, results))
+    write_results(method, rows)
+
+# Loads results with a single query, only reading the requested columns and rows
+# Algorithms whose output file of step 9 changed since their results were stored (e.g. runs evaluated elsewhere) are imported again first
+# The setting columns are named as in the settings (e.g. "max-depth"), so the frame can be used like the output files
+#
+# methods   The algorithms to load
+# columns   The columns to load, or None for all columns
+# filters   Values or lists of values to select rows on, for the columns in `FILTER_COLUMNS` other than method (e.g. dataset=[...], max_depth=3)
+def load_results(methods, columns=None, **filters):
+    for method in methods:
+        if output_file_changed(method):
+            print(f"\033[33mImporting the changed output file of \033[1m{method}\033[0m")
+            import_output_file(method)
+
+    conditions, parameters = [], []
+    for column, values in [("method", methods)] + [*filters.items()]:
+        if column not in FILTER_COLUMNS:
+            raise ValueError(f"cannot filter results on {column}")
+        values = values if isinstance(values, (list, tuple, set)) else [values]
+        conditions.append(f'"{column}" IN ({", ".join("?" for _ in values)})')
+        parameters.extend(values)
+
+    selected = ", ".join(f'"{j}"' for j in (columns or [*COLUMN_TYPES]))
+    connection = connect()
+    df = pd.read_sql_query(f"SELECT {selected} FROM results WHERE {' AND '.join(conditions)} ORDER BY method, id", connection, params=parameters)
+    connection.close()
+
+    return df.rename(columns={column: key for column, key in SETTINGS_COLUMNS.items() if column != "dataset"})
+
+# Rebuilds the records of the output files of step 9 (id, settings and nested results) from the rows of a results frame
+#
+# df    A frame with all columns of the results table, as returned by `load_results`
+def nested_records(df):
+    records = []
+    for row in df.to_dict("records"):
+        settings = {key: row[key] for key in SETTINGS_COLUMNS.values() if key != "core-file"}
+        settings["core-file"] = row["dataset"]
+        results = {metric: row[metric] for metric in TREE_METRICS}
+        results.update({type: {metric: row[f"{type}_{metric}"] for metric in SET_METRICS} for type in ["train", "test"]})
+        records.append({"id": row["id"], "settings": settings, "results": results})
+    return records
+
+# Loads the dataset catalog written by step 3, with the censoring category of each dataset
+# Censoring of at most 25% is "Low", of at least 75% is "High" and otherwise "Moderate"
+def load_catalog():
+    catalog = pd.read_csv(CATALOG_FILE, float_precision="round_trip")
+    catalog["censoring_category"] = np.select([catalog["censoring"] <= 0.25, catalog["censoring"] >= 0.75], ["Low", "High"], "Moderate")
+    return catalog
+
+if __name__ == "__main__":
+    # Usage: python results_store.py <algorithm> [<algorithm> ...]
+    # Stores the output files of step 9 of the given algorithms in the results table
+    for method in sys.argv[1:]:
+        import_output_file(method)
+        print(f"\033[35mStored the results of \033[1m{method}\033[0m")
+
+    print("\033[32;1mDone!\033[0m")
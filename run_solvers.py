@@ -0,0 +1,233 @@
+import asyncio
+import os
+import sys
+import time
+from asyncio.subprocess import PIPE
+from bootstrap import bootstrap_option
+from folds import materialize_settings
+from record_log import append_record, end_record_log, start_record_log
+from step_6_run_streed import clear_streed_files, contains_pareto_key, create_pareto_key, make_streed_compatible, parse_streed_output
+from step_6_run_streed import pareto_front, print_streed_result, prune_results, serialize_tree_with_features, streed_arguments, use_streed_files
+from step_6_run_streed import DATASET_TYPE, EXEC_PATH, PARETO_PRUNING
+from utils import get_feature_meanings, step_profile, DIRECTORY
+
+# The algorithms that are run
+ALGORITHMS = ["streed", "ost", "ctree"]
+
+# The number of runs of all solvers together that are executed at the same time; every run uses a single CPU
+CPU_BUDGET = os.cpu_count() or 1
+
+# The commands that start a long-lived worker of a solver, which reads settings lines from stdin (STreeD is started anew for every run instead)
+WORKER_COMMANDS = {
+    "ost": ["julia", "step_7_run_ost.jl", "--worker"],
+    "ctree": ["Rscript", "step_8_run_ctree.r", "--worker"],
+}
+
+# The dataset type each solver reads, whose fold files are written before the solvers start
+DATASET_TYPES = {"streed": DATASET_TYPE, "ost": "original", "ctree": "numeric"}
+
+# The start of the lines in which workers report the result of a run, as "<settings line>;<time>;<tree>"
+RESULT_MARKER = "#RESULT#"
+
+# The fraction of the CPU budget with which step 9 evaluates trees while the solvers run, the solvers use the rest
+EVALUATION_SHARE = 0.25
+
+# The solvers are kept single-threaded, so the number of busy CPUs stays within the budget
+WORKER_ENVIRONMENT = {**os.environ, "JULIA_NUM_THREADS": "1", "OMP_NUM_THREADS": "1", "OPENBLAS_NUM_THREADS": "1"}
+
+# A long-lived process of a solver that runs the settings lines it is sent one at a time
+# The process is only started for its first run, so its start-up (e.g. the warm-up of OST) also counts towards the CPU budget
+class SolverWorker:
+    # command   The command that starts the process in worker mode
+    def __init__(self, command):
+        self.command = command
+        self.process = None
+
+    # Runs the solver with a single settings line and returns its result as "<settings line>;<time>;<tree>"
+    # Any other output of the solver is passed on
+    #
+    # settings_line     The settings to run the solver with, as a line of the settings file
+    async def run(self, settings_line):
+        if self.process is None:
+            self.process = await asyncio.create_subprocess_exec(*self.command, cwd=DIRECTORY, env=WORKER_ENVIRONMENT, stdin=PIPE, stdout=PIPE, limit=2 ** 26)
+
+        self.process.stdin.write(settings_line.encode() + b"\n")
+        await self.process.stdin.drain()
+        while True:
+            line = await self.process.stdout.readline()
+            if not line:
+                raise RuntimeError(f"{' '.join(self.command)} stopped with exit code {await self.process.wait()}")
+            line = line.decode().rstrip("\n")
+            if line.startswith(RESULT_MARKER):
+                return line[len(RESULT_MARKER):]
+            print(line)
+
+    # Closes the input of the process, after which it finishes, or kills it if the runs were halted
+    #
+    # kill  Whether to kill the process instead of letting it finish
+    async def stop(self, kill=False):
+        if self.process is None or self.process.returncode is not None:
+            return
+        if kill:
+            self.process.kill()
+        else:
+            self.process.stdin.close()
+        await self.process.wait()
+
+# Runs STreeD with a single set of parameters, like step 6 does, and returns its result as "<settings>;<time>;<tree>"
+# The train-file of each fold is only converted once, since the conversion happens between awaits and the files of different settings are shared
+#
+# params                The parameters to run STreeD with
+# cpus                  The semaphore that limits the number of runs at the same time
+# feature_names         The feature names of the train-files that have been converted, by STreeD path
+async def run_streed_setting(params, cpus, feature_names):
+    dataset_directory = f"{DIRECTORY}/datasets/{DATASET_TYPE}"
+    train_filename, test_filename = use_streed_files(params, dataset_directory)
+    if params["file"] not in feature_names:
+        feature_names[params["file"]] = make_streed_compatible(dataset_directory, train_filename, params["file"])
+
+    async with cpus:
+        # Settings are only checked against the Pareto front once they may start, so time-outs of runs that finished in the meantime are known
+        pareto_key = create_pareto_key(params)
+        if PARETO_PRUNING and contains_pareto_key(pareto_key):
+            time_duration, tree = -1e9, "[None]"
+        else:
+            args = streed_arguments(params)
+            print(f"\033[35;1m{EXEC_PATH} {' '.join(args)}\033[0m")
+            proc = await asyncio.create_subprocess_exec(EXEC_PATH, *args, stdin=PIPE, stdout=PIPE)
+            out, _ = await proc.communicate()
+            time_duration, tree = parse_streed_output(out)
+            if time_duration < 0 and PARETO_PRUNING:
+                pareto_front.append(pareto_key)
+    print_streed_result(params, time_duration, tree)
+
+    tree = serialize_tree_with_features(eval(tree), feature_names[params["file"]], get_feature_meanings(params["core-file"]))
+    params["file"] = train_filename
+    params["test-file"] = test_filename
+    return ";".join(str(j) for j in (params, time_duration, tree))
+
+# Runs all settings with a single solver, spread over a number of workers that each take the next setting as soon as they are idle
+# Every finished run is appended to the record log of the solver right away, so its tree can be evaluated while the other runs continue
+#
+# algorithm         The name of the solver
+# settings_lines    The lines of the settings file
+# results           The list in which the result of each setting is stored, as soon as it finishes
+# cpus              The semaphore that limits the number of runs of all solvers at the same time
+# num_workers       The number of workers of the solver
+async def run_algorithm(algorithm, settings_lines, results, cpus, num_workers):
+    queue = asyncio.Queue()
+    for index, settings_line in enumerate(settings_lines):
+        queue.put_nowait((index, settings_line))
+    feature_names = {}
+
+    async def work():
+        worker = SolverWorker(WORKER_COMMANDS[algorithm]) if algorithm in WORKER_COMMANDS else None
+        try:
+            while not queue.empty():
+                index, settings_line = queue.get_nowait()
+                if worker is None:
+                    results[index] = await run_streed_setting(eval(settings_line), cpus, feature_names)
+                else:
+                    async with cpus:
+                        results[index] = await worker.run(settings_line)
+                append_record(algorithm, index, results[index])
+            if worker is not None:
+                await worker.stop()
+        finally:
+            if worker is not None:
+                await worker.stop(kill=True)
+
+    await asyncio.gather(*[work() for _ in range(min(num_workers, len(settings_lines)))])
+
+# Writes the results of a solver to its trees file in the order of the settings, as steps 6 to 8 would
+# The settings of STreeD that a serial run of step 6 would have skipped due to the Pareto front are skipped here as well,
+# since runs that were started before the time-out that rules them out was known may have finished
+#
+# algorithm         The name of the solver
+# settings_lines    The lines of the settings file
+# results           The result of each setting, or None for settings that did not finish
+def write_trees(algorithm, settings_lines, results):
+    finished = [(j, result) for j, result in zip(settings_lines, results) if result is not None]
+    results = prune_results(finished) if algorithm == "streed" else [result for _, result in finished]
+
+    f = open(f"{DIRECTORY}/output/{algorithm}_trees.csv", "w")
+    f.write("id;settings;time;tree\n")
+    for i, result in enumerate(results):
+        f.write(f"{i};{result}\n")
+    f.close()
+
+# Runs a solver and writes its trees file as soon as it is done, or when the runs are halted
+#
+# algorithm         The name of the solver
+# settings_lines    The lines of the settings file
+# cpus              The semaphore that limits the number of runs of all solvers at the same time
+# num_workers       The number of workers of the solver
+async def run_and_write(algorithm, settings_lines, cpus, num_workers):
+    start_time = time.time()
+    results = [None] * len(settings_lines)
+    try:
+        await run_algorithm(algorithm, settings_lines, results, cpus, num_workers)
+    finally:
+        write_trees(algorithm, settings_lines, results)
+        end_record_log(algorithm)
+    print(f"\033[34mFinished \033[1m{algorithm}\033[0;34m in \033[1m{time.time() - start_time:.4f}\033[0;34m seconds\033[0m")
+
+# Runs the settings with all solvers at the same time, within a global budget of CPUs
+# STreeD may use every CPU, since its runs have no start-up cost; each other solver gets an equal share of the budget in workers,
+# so the number of worker processes stays close to the budget while any CPU that is free can still be used by any solver
+#
+# With evaluate, step 9 follows the record logs of the solvers in a separate process, so trees are evaluated while the solvers are still running
+# Its workers take `EVALUATION_SHARE` of the budget (at least one CPU), so the runtimes of the solvers are not measured on CPUs that are busy evaluating;
+# with a budget of a single CPU, the solvers and step 9 share it, and the runtimes are not comparable to those of separate runs
+#
+# algorithms    The solvers to run
+# cpu_budget    The number of runs at the same time
+# evaluate      Whether to evaluate the trees as soon as they are created
+# replicates    The number of bootstrap replicates per evaluated tree (0 disables bootstrapping)
+async def run_solvers(algorithms, cpu_budget=CPU_BUDGET, evaluate=False, replicates=0):
+    f = open(f"{DIRECTORY}/output/settings.txt")
+    settings_lines = [j for j in f.read().split("\n") if j.strip()]
+    f.close()
+
+    for dataset_type in sorted({DATASET_TYPES[j] for j in algorithms}):
+        materialize_settings(f"{DIRECTORY}/datasets/{dataset_type}")
+    if "streed" in algorithms:
+        clear_streed_files()
+
+    for algorithm in algorithms:
+        start_record_log(algorithm)
+    evaluator = None
+    if evaluate:
+        evaluation_workers = max(1, round(cpu_budget * EVALUATION_SHARE))
+        cpu_budget = max(1, cpu_budget - evaluation_workers)
+        evaluator = await asyncio.create_subprocess_exec(
+            sys.executable, f"{DIRECTORY}/step_9_evaluate_trees.py", "--stream", f"--workers={evaluation_workers}", f"--bootstrap={replicates}", *algorithms, cwd=DIRECTORY,
+        )
+
+    cpus = asyncio.Semaphore(cpu_budget)
+    worker_share = max(1, -(-cpu_budget // len(algorithms)))
+    await asyncio.gather(*[
+        run_and_write(j, settings_lines, cpus, cpu_budget if j not in WORKER_COMMANDS else worker_share) for j in algorithms
+    ])
+    if evaluator is not None:
+        await evaluator.wait()
+
+if __name__ == "__main__":
+    # Usage: python run_solvers.py [<algorithm> ...] [--cpus=<n>] [--evaluate] [--bootstrap[=<replicates>]]
+    # Runs steps 6, 7 and 8 (or only those of the given algorithms) at the same time, on at most n CPUs (by default all of them)
+    # With --evaluate, step 9 evaluates every tree as soon as it is created (with bootstrap replicates if --bootstrap is given as well)
+    args = [j for j in sys.argv[1:] if not j.startswith("--")]
+    cpu_budget = CPU_BUDGET
+    for arg in sys.argv[1:]:
+        if arg.startswith("--cpus="):
+            cpu_budget = int(arg.split("=", 1)[1])
+
+    total_start_time = time.time()
+    try:
+        with step_profile("run_solvers", f"{DIRECTORY}/output"):
+            asyncio.run(run_solvers(args or ALGORITHMS, cpu_budget, "--evaluate" in sys.argv[1:], bootstrap_option(sys.argv[1:])))
+    except KeyboardInterrupt:
+        print("\033[33;1mHalted program!\033[0m")
+    print(f"\033[34mTotal time: \033[1m{time.time() - total_start_time:.4f}\033[0;34m seconds\033[0m")
+
+    print("\033[32;1mDone!\033[0m")
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import gmean
+from comparisons import TIMEOUT
+
+# The number of original features of the scalability datasets per unit of the feature label (e.g. 12 features is "f=2")
+FEATURES_PER_LABEL = 6
+
+# Returns the feature label of each row, such as "f=1" for datasets with 6 (to 11) original features
+#
+# n_features    The number of original features of each row
+def feature_labels(n_features):
+    return "f=" + (n_features // FEATURES_PER_LABEL).astype(int).astype(str)
+
+# Returns the mean runtime of each method per group of runs, with one column per method
+#
+# df        The results, with a "method" and a "runtime" column
+# keys      The columns to group the runs on, such as ["dataset", "max-depth"]
+def mean_runtimes(df, keys):
+    return df.groupby(keys + ["method"])["runtime"].mean().unstack("method")
+
+# Returns for each group of runs whether all of the given methods finished within the time limit on average
+# Groups that a method was not run on do not count as finished
+#
+# runtimes  The mean runtimes per group, as returned by `mean_runtimes`
+# methods   The methods that must have finished
+# timeout   The time limit in seconds
+def within_timeout(runtimes, methods, timeout=TIMEOUT):
+    return (runtimes[methods] <= timeout).all(axis=1).rename("within_timeout")
+
+# Keeps the runs that belong to a group for which a mask holds, by joining the mask on the group columns
+#
+# df        The results
+# mask      A boolean series indexed by the group columns, such as the one returned by `within_timeout`
+def select_groups(df, mask):
+    keys = [*mask.index.names]
+    selected = df.join(mask.rename("selected"), on=keys)["selected"]
+    return df[selected.fillna(False).astype(bool)]
+
+# Returns the geometric mean over all groups of the speedup of a method over a baseline
+#
+# runtimes  The mean runtimes per group, as returned by `mean_runtimes`
+# baseline  The method to compare to
+# method    The method whose speedup is computed
+def geometric_mean_speedup(runtimes, baseline, method):
+    return gmean(runtimes[baseline] / runtimes[method])
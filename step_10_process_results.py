@@ -1,10 +1,16 @@
 import matplotlib.pyplot as plt
 import numpy as np
 import os
-from scipy.stats import wilcoxon, ttest_ind
+from bootstrap import BOOTSTRAP_METRICS
+from comparisons import align_results, paired_comparisons, unmatched_settings
+from results_store import load_results, nested_records
+from utils import phase, step_profile
 
 DIRECTORY = os.path.realpath(os.path.dirname(__file__))
 
+# The directory to which the profile of this step is written
+PROFILE_DIRECTORY = f"{DIRECTORY}/plots"
+
 if not os.path.exists(f"{DIRECTORY}/plots"):
     os.mkdir(f"{DIRECTORY}/plots")
 
@@ -16,20 +22,15 @@ ALG_INFO = {
 TRAIN_TEST_SCORE_TYPES = [
     ("Objective score", "objective_score"),
     ("Concordance score", "concordance_score"),
+    ("Uno's concordance score", "uno_concordance_score"),
 ]
 
 def format_p(p):
     if p < 0.05: return p, f"\033[35;1mp = {p}\033[0m"
     return p, f"p = {p}"
 
-WILCOXON = True
-
-def stat_test(vals1, vals2):
-    if WILCOXON:
-        diffs = [vals1[i] - vals2[i] for i in range(len(vals1))]
-        return wilcoxon(diffs)[1]
-    else:
-        return ttest_ind(vals1, vals2, equal_var=False)[1]
+# The test whose p-values are printed when comparing algorithms: "permutation" (the sign-flip permutation test), "wilcoxon" or "welch"
+STAT_TEST = "permutation"
 
 # Makes plots for each of the algorithms by sorting a list of outcomes and laying it out over a [0, 1]-range
 #
@@ -44,7 +45,8 @@ def plot_sorted_scores(data):
         xs = [j / (len(ys) - 1) for j in range(len(ys))]
         plt.plot(xs, ys, c=color, label=title, linewidth=3)
     plt.legend()
-    plt.savefig(f"{DIRECTORY}/plots/sorted_num_nodes.png")
+    with phase("write"):
+        plt.savefig(f"{DIRECTORY}/plots/sorted_num_nodes.png")
 
     # Plot IBS ratio
     plt.clf()
@@ -55,7 +57,8 @@ def plot_sorted_scores(data):
         xs = [j / (len(ys) - 1) for j in range(len(ys))]
         plt.plot(xs, ys, c=color, label=title, linewidth=3)
     plt.legend()
-    plt.savefig(f"{DIRECTORY}/plots/sorted_ibs_ratio.png")
+    with phase("write"):
+        plt.savefig(f"{DIRECTORY}/plots/sorted_ibs_ratio.png")
 
     # Plot scores
     for name, attr in TRAIN_TEST_SCORE_TYPES:
@@ -68,140 +71,112 @@ def plot_sorted_scores(data):
                 xs = [j / (len(ys) - 1) for j in range(len(ys))]
                 plt.plot(xs, ys, c=color, label=title, linewidth=3)
             plt.legend()
-            plt.savefig(f"{DIRECTORY}/plots/sorted_{attr}_{type}.png")
+            with phase("write"):
+                plt.savefig(f"{DIRECTORY}/plots/sorted_{attr}_{type}.png")
 
-# Compares the results of two algorithms (only if they have been run with the same list of settings)
+# Prints the 95% bootstrap confidence interval of the mean test scores of each algorithm on each dataset
+# The replicates are written by step 9; trees that timed out are left out
 #
 # data  The output data for each of the algorithms
-# alg1  The name of algorithm 1
-# alg2  The name of algorithm 2
-def compare_algs(data, alg1, alg2):
-    alg1_data = data[alg1]
-    alg2_data = data[alg2]
-
-    # Determine whether the same settigns were used for both algorithms
-    correct = True
-    if len(alg1_data) != len(alg2_data):
-        correct = False
-    for line1, line2 in zip(alg1_data, alg2_data):
-        if line1["settings"] != line2["settings"]:
-            correct = False
-            break
-    if not correct:
-        print("\033[31;1mThe algorithms to compare were not run with the same settings\033[0m")
-        return
-
-    def sign(x):
-        return (x > 1e-6) - (x < -1e-6)
+def print_bootstrap_intervals(data):
+    for alg, alg_data in data.items():
+        path = f"{DIRECTORY}/output/bootstrap/{alg}_bootstrap.npz"
+        if not os.path.exists(path):
+            continue
+        replicates = np.load(path)
+        rows = {id: j for j, id in enumerate(replicates["ids"].tolist())}
+
+        # Group the rows of the trees per dataset
+        datasets = {}
+        for line in alg_data:
+            if line["results"]["runtime"] >= 600 or line["id"] not in rows: continue
+            datasets.setdefault(line["settings"]["core-file"], []).append(line)
+
+        print(f"\033[37;1mBootstrap 95% confidence intervals ({ALG_INFO[alg][0]})\033[0m")
+        for dataset, dataset_lines in datasets.items():
+            dataset_rows = [rows[line["id"]] for line in dataset_lines]
+            intervals = []
+            for metric in BOOTSTRAP_METRICS:
+                # The replicates of all trees on a dataset share their resample weights per test-set, so the mean is taken per replicate
+                means = replicates[metric][dataset_rows].mean(axis=0)
+                lower, upper = np.percentile(means, [2.5, 97.5])
+                value = np.mean([line["results"][metric] if metric in line["results"] else line["results"]["test"][metric] for line in dataset_lines])
+                intervals.append(f"{metric} = {value:.4f} [{lower:.4f}, {upper:.4f}]")
+            print(f"\033[30m  {dataset}: {', '.join(intervals)}\033[0m")
+        print()
+
+# Prints the comparison of two algorithms on a single metric
+#
+# comparison    The row of the comparison table of the metric
+# title         The title to print
+# alg1          The name of algorithm 1
+# alg2          The name of algorithm 2
+# p             The p-value to print
+def print_comparison(comparison, title, alg1, alg2, p):
+    p, p_str = format_p(p)
+    print(f"\033[37;1m{title}\033[0m")
+    print(f"\033[31m  {alg1} < {alg2}:    {comparison['less']}\033[0m")
+    print(f"\033[33m  {alg1} = {alg2}:    {comparison['equal']}\033[0m")
+    print(f"\033[32m  {alg1} > {alg2}:    {comparison['greater']}\033[0m")
+    print(f"\033[30m  Difference: (μ, σ²) = ({comparison['mean']:.4}, {comparison['variance']:.4}), {p_str} \033[0m")
+    print()
+
+# Compares the results of two algorithms on the settings that both were run with
+# Settings that only one of them was run with are reported and left out
+#
+# comparisons   The comparison table of all pairs of algorithms, as returned by `paired_comparisons`
+# aligned       The aligned results of the algorithms, as returned by `align_results`
+# alg1          The name of algorithm 1
+# alg2          The name of algorithm 2
+def compare_algs(comparisons, aligned, alg1, alg2):
+    unmatched = unmatched_settings(aligned, alg1, alg2)
+    if len(unmatched):
+        print(f"\033[31;1m{len(unmatched)} settings were only run with one of the algorithms to compare, these are left out\033[0m")
+        for method, count in unmatched["method"].value_counts().items():
+            print(f"\033[31m  Only {method}: {count}\033[0m")
+        print()
+
+    comparison = comparisons.loc[(alg1, alg2)]
+    p_column = f"{STAT_TEST}_p"
 
     # Compare num nodes
-    counts = [0, 0, 0]
-    diffs = []
-    vals1 = []
-    vals2 = []
-    for line1, line2 in zip(alg1_data, alg2_data):
-        if line1["results"]["runtime"] >= 600 or line2["results"]["runtime"] >= 600: continue
-        val1 = line1["results"]["num_nodes"]
-        val2 = line2["results"]["num_nodes"]
-        diff = val1 - val2
-        counts[1 + sign(diff)] += 1
-        diffs.append(diff)
-        vals1.append(val1)
-        vals2.append(val2)
-    if all([d == 0 for d in diffs]):
-        p, p_str = format_p(0.5)
-    else:
-        p, p_str = format_p(stat_test(vals1, vals2))
-    print("\033[37;1mNum nodes\033[0m")
-    print(f"\033[31m  {alg1} < {alg2}:    {counts[0]}\033[0m")
-    print(f"\033[33m  {alg1} = {alg2}:    {counts[1]}\033[0m")
-    print(f"\033[32m  {alg1} > {alg2}:    {counts[2]}\033[0m")
-    print(f"\033[30m  Difference: (μ, σ²) = ({np.average(diffs):.4}, {np.var(diffs):.4}), {p_str} \033[0m")
-    print()
+    num_nodes = comparison.loc["num_nodes"]
+    # The Wilcoxon test is undefined when all differences are zero
+    p = 0.5 if STAT_TEST == "wilcoxon" and num_nodes["less"] == num_nodes["greater"] == 0 else num_nodes[p_column]
+    print_comparison(num_nodes, "Num nodes", alg1, alg2, p)
 
     # Compare IBS ratio
-    counts = [0, 0, 0]
-    diffs = []
-    vals1 = []
-    vals2 = []
-    for line1, line2 in zip(alg1_data, alg2_data):
-        if line1["results"]["runtime"] >= 600 or line2["results"]["runtime"] >= 600: continue
-        
-        val1 = line1["results"]["integrated_brier_score_ratio"]
-        val2 = line2["results"]["integrated_brier_score_ratio"]
-        diff = val1 - val2
-        counts[1 + sign(diff)] += 1
-        diffs.append(diff)
-        vals1.append(val1)
-        vals2.append(val2)
-    p, p_str = format_p(stat_test(vals1, vals2))
-    print("\033[37;1mIBS Ratio\033[0m")
-    print(f"\033[31m  {alg1} < {alg2}:    {counts[0]}\033[0m")
-    print(f"\033[33m  {alg1} = {alg2}:    {counts[1]}\033[0m")
-    print(f"\033[32m  {alg1} > {alg2}:    {counts[2]}\033[0m")
-    print(f"\033[30m  Difference: (μ, σ²) = ({np.average(diffs):.4}, {np.var(diffs):.4}), {p_str} \033[0m")
-    print()
+    ibs = comparison.loc["integrated_brier_score_ratio"]
+    print_comparison(ibs, "IBS Ratio", alg1, alg2, ibs[p_column])
 
     # Compare scores
     for name, attr in TRAIN_TEST_SCORE_TYPES:
-        max_diff = 0
         for type in ["train", "test"]:
-            counts = [0, 0, 0]
-            diffs = []
-            vals1 = []
-            vals2 = []
-            for line1, line2 in zip(alg1_data, alg2_data):
-                if line1["results"]["runtime"] >= 600 or line2["results"]["runtime"] >= 600: continue
-                
-                val1 = line1["results"][f"{type}"][attr]
-                val2 = line2["results"][f"{type}"][attr]
-                diff = val1  - val2
-                counts[1 + sign(diff)] += 1
-                diffs.append(diff)
-                vals1.append(val1)
-                vals2.append(val2)
-
-                if type == "test" and diff < max_diff:
-                    max_diff = diff
-                    print("worst: ", max_diff, line1["settings"]['file'])
-
-            p, p_str = format_p(stat_test(vals1, vals2))
-            print(f"\033[37;1m{name} ({type})\033[0m")
-            print(f"\033[31m  {alg1} < {alg2}:    {counts[0]}\033[0m")
-            print(f"\033[33m  {alg1} = {alg2}:    {counts[1]}\033[0m")
-            print(f"\033[32m  {alg1} > {alg2}:    {counts[2]}\033[0m")
-            print(f"\033[30m  Difference: (μ, σ²) = ({np.average(diffs):.4}, {np.var(diffs):.4}), {p_str} \033[0m")
-            print()
+            score = comparison.loc[f"{type}_{attr}"]
+            if type == "test" and score["worst"] < 0:
+                print("worst: ", score["worst"], score["worst_file"])
+            print_comparison(score, f"{name} ({type})", alg1, alg2, score[p_column])
 
 def main():
     # Load data for each algorithm
-    data = {}
-    for algorithm in ["ctree", "ost", "streed"]:
-        f = open(f"{DIRECTORY}/output/{algorithm}_output.csv")
-        lines = f.read().strip().split("\n")
-        f.close()
-
-        alg_data = []
-        for line in lines[1:]:
-            _, settings, results = [eval(j) for j in line.split(";")]
-
-
-            alg_data.append({
-                "settings": settings,
-                "results": results
-            })
-
-        data[algorithm] = alg_data
+    algorithms = ["ctree", "ost", "streed"]
+    with phase("load"):
+        df = load_results(algorithms)
+    data = {algorithm: nested_records(df[df["method"] == algorithm]) for algorithm in algorithms}
 
     # Process the data
     plot_sorted_scores(data)
-    compare_algs(data, "streed", "ost")
+    print_bootstrap_intervals(data)
+    aligned = align_results(df, ["streed", "ost", "ctree"])
+    comparisons = paired_comparisons(aligned, ["streed", "ost", "ctree"])
+    compare_algs(comparisons, aligned, "streed", "ost")
     print("=" * 42 + "\n")
-    compare_algs(data, "streed", "ctree")
+    compare_algs(comparisons, aligned, "streed", "ctree")
     print("=" * 42 + "\n")
-    compare_algs(data, "ost", "ctree")
+    compare_algs(comparisons, aligned, "ost", "ctree")
 
     print("\033[32;1mDone!\033[0m")
 
 if __name__ == "__main__":
-    main()
+    with step_profile("step_10_process_results", PROFILE_DIRECTORY):
+        main()
@@ -2,43 +2,27 @@ import pandas as pd
 import os
 from contextlib import redirect_stdout
 from scipy.stats import gmean
+from results_store import load_catalog, load_results, FRAME_COLUMNS
+from utils import phase, step_profile
 
 DIRECTORY = os.path.realpath(os.path.dirname(__file__))
 
+# The directory to which the profile of this step is written
+PROFILE_DIRECTORY = f"{DIRECTORY}/tables"
+
 if not os.path.exists(f"{DIRECTORY}/tables"):
     os.mkdir(f"{DIRECTORY}/tables")
 
 def main():
     # Load data for each algorithm
-    data = []
     algorithms = ["ctree", "ost", "streed"]
-    for algorithm in algorithms:
-        with open(f"{DIRECTORY}/output/{algorithm}_output.csv") as f:
-            lines = f.read().strip().split("\n")
-            for line in lines[1:]:
-                _, settings, _results = [eval(j) for j in line.split(";")]
-                results = {key: _results[key] for key in ["runtime", "num_nodes", "integrated_brier_score_ratio"]}
-                results.update({key: settings[key] for key in ["max-depth","max-num-nodes", "hyper-tune", "cost-complexity"]})
-                results["dataset"] = settings["file"].replace("train/","").split("_")[0]
-                results["method"] = algorithm
-                results.update({"train_"+key: _results["train"][key] for key in ["objective_score", "concordance_score"]})
-                results.update({"test_"+key: _results["test"][key] for key in ["objective_score", "concordance_score"]})
-                data.append(results)
-
-    df = pd.DataFrame.from_dict(data)
+    with phase("load"):
+        df = load_results(algorithms, columns=FRAME_COLUMNS)
+    df["dataset"] = df.pop("file").str.replace("train/", "").str.split("_").str[0]
     datasets = df["dataset"].unique()
 
-    dataset_info = {}
-    for dataset in datasets:
-        with open(f"{DIRECTORY}/datasets/binary/{dataset}.txt") as f2:
-            lines = f2.readlines()
-            n_instances = len(lines) - 1
-            n_binary_features = len(lines[0].split(",")) - 2
-            censoring = 1.0 - sum([int(line.split(",")[1]) for line in lines[1:]]) / n_instances
-        with open(f"{DIRECTORY}/datasets/original/{dataset}.txt") as f2:
-            lines = f2.readlines()
-            n_features = len(lines[0].split(",")) - 2
-        dataset_info[dataset] = {"n_instances": n_instances, "n_features": n_features, "n_binary_features": n_binary_features, "censoring": censoring}
+    with phase("load"):
+        dataset_info = load_catalog().set_index("dataset").loc[datasets].to_dict("index")
 
 
     timeouts = df["runtime"] >= 600
@@ -57,7 +41,7 @@ def main():
 
     wins = {t: {a: 0 for a in algorithms} for t in ["ibs", "hc"]}
 
-    with open(f"{DIRECTORY}/tables/hc_ibs_survset.txt", "w") as f:
+    with phase("write"), open(f"{DIRECTORY}/tables/hc_ibs_survset.txt", "w") as f:
         with redirect_stdout(f):
             for dataset in sorted(datasets):
                 print("{} &".format(dataset.capitalize()))
@@ -129,4 +113,5 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    with step_profile("step_11_output_tables", PROFILE_DIRECTORY):
+        main()
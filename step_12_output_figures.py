@@ -3,9 +3,14 @@ import os
 import seaborn as sns
 import matplotlib.pyplot as plt
 from matplotlib.ticker import FormatStrFormatter
+from results_store import load_catalog, load_results, FRAME_COLUMNS
+from utils import phase, step_profile
 
 DIRECTORY = os.path.realpath(os.path.dirname(__file__))
 
+# The directory to which the profile of this step is written
+PROFILE_DIRECTORY = f"{DIRECTORY}/plots"
+
 if not os.path.exists(f"{DIRECTORY}/plots"):
     os.mkdir(f"{DIRECTORY}/plots")
 
@@ -23,47 +28,17 @@ def main():
     plt.rc('text', usetex = True)
     sns.set_palette("colorblind")
 
-    data = []
     algorithms = ["streed", "ost", "ctree"]
     algorithm_name = {"ost": "OST", "streed": "SurTree", "ctree": "CTree"}
-    for algorithm in algorithms:
-        with open(f"{DIRECTORY}/output/{algorithm}_output.csv") as f:
-            lines = f.read().strip().split("\n")
-            for line in lines[1:]:
-                _, settings, _results = [eval(j) for j in line.split(";")]
-                if float(_results["runtime"]) < -1e-3 or float(_results["runtime"]) >= 600: continue
-                results = {key: _results[key] for key in ["runtime", "num_nodes", "integrated_brier_score_ratio"]}
-                results.update({key: settings[key] for key in ["max-depth","max-num-nodes", "hyper-tune", "cost-complexity"]})
-                results["dataset"] = "_".join(settings["file"].replace("train/","").split("_"))
-                results["method"] = algorithm_name[algorithm]
-                results.update({"train_"+key: _results["train"][key] for key in ["objective_score", "concordance_score"]})
-                results.update({"test_"+key: _results["test"][key] for key in ["objective_score", "concordance_score"]})
-                data.append(results)
-
-    df = pd.DataFrame.from_dict(data)
-    datasets = df["dataset"].unique()
-
-    dataset_info = {}
-    for dataset in datasets:
-        with open(f"{DIRECTORY}/datasets/binary/{dataset}.txt") as f2:
-            lines = f2.readlines()
-            n_instances = len(lines) - 1
-            n_binary_features = len(lines[0].split(",")) - 2
-            censoring = 1.0 - sum([int(line.split(",")[1]) for line in lines[1:]]) / n_instances
-        with open(f"{DIRECTORY}/datasets/original/{dataset}.txt") as f2:
-            lines = f2.readlines()
-            n_features = len(lines[0].split(",")) - 2
-        dataset_info[dataset] = {"n_instances": n_instances, "n_features": n_features, "n_binary_features": n_binary_features, "censoring": censoring}
+    with phase("load"):
+        df = load_results(algorithms, columns=FRAME_COLUMNS)
+    df = df[(df["runtime"] >= -1e-3) & (df["runtime"] < 600)].reset_index(drop=True)
+    df["dataset"] = df.pop("file").str.replace("train/", "")
+    df["method"] = df["method"].map(algorithm_name)
 
-        df.loc[df["dataset"] == dataset, "n_instances"] = n_instances
-        df.loc[df["dataset"] == dataset, "n_features"] = n_features
-        df.loc[df["dataset"] == dataset, "censoring"] = censoring
-        censoring_category = "Moderate"
-        if censoring <= 0.25:
-            censoring_category = "Low"
-        elif censoring >= 0.75:
-            censoring_category = "High"
-        df.loc[df["dataset"] == dataset, "censoring_category"] = censoring_category
+    with phase("load"):
+        catalog = load_catalog()
+    df = df.merge(catalog[["dataset", "n_instances", "n_features", "censoring", "censoring_category"]], on="dataset", how="left", validate="many_to_one")
 
        
     df2 = df.melt(id_vars=["dataset", "method", "censoring_category", "n_instances"], value_vars=["test_concordance_score", "integrated_brier_score_ratio"])
@@ -103,8 +78,10 @@ def main():
     plt.subplots_adjust(wspace=0.1, hspace=0.15)
 
     #plt.show()
-    plt.savefig(f"{DIRECTORY}/plots/synthetic_inc_n.pdf", bbox_inches="tight", pad_inches = 0)
+    with phase("write"):
+        plt.savefig(f"{DIRECTORY}/plots/synthetic_inc_n.pdf", bbox_inches="tight", pad_inches = 0)
 
     
 if __name__ == "__main__":
-    main()
+    with step_profile("step_12_output_figures", PROFILE_DIRECTORY):
+        main()
@@ -3,9 +3,14 @@ import os
 import seaborn as sns
 import matplotlib.pyplot as plt
 from matplotlib.ticker import MaxNLocator
+from results_store import load_results, FRAME_COLUMNS
+from utils import phase, step_profile
 
 DIRECTORY = os.path.realpath(os.path.dirname(__file__))
 
+# The directory to which the profile of this step is written
+PROFILE_DIRECTORY = f"{DIRECTORY}/plots"
+
 if not os.path.exists(f"{DIRECTORY}/plots"):
     os.mkdir(f"{DIRECTORY}/plots")
 
@@ -23,25 +28,13 @@ def main():
     plt.rc('text', usetex = True)
     sns.set_palette("colorblind")
 
-    data = []
     algorithms = ["streed", "ost", "ctree"]
     algorithm_name = {"ost": "OST", "streed": "SurTree", "ctree": "CTree"}
-    for algorithm in algorithms:
-        with open(f"{DIRECTORY}/output/{algorithm}_output.csv") as f:
-            lines = f.read().strip().split("\n")
-            for line in lines[1:]:
-                _, settings, _results = [eval(j) for j in line.split(";")]
-                if _results["runtime"] >= 600 or _results["runtime"] < -1e6:
-                    _results["runtime"] = 1200
-                results = {key: _results[key] for key in ["runtime", "num_nodes", "integrated_brier_score_ratio"]}
-                results.update({key: settings[key] for key in ["max-depth","max-num-nodes", "hyper-tune", "cost-complexity"]})
-                results["dataset"] = settings["file"].replace("train/","")
-                results["method"] = algorithm_name[algorithm]
-                results.update({"train_"+key: _results["train"][key] for key in ["objective_score", "concordance_score"]})
-                results.update({"test_"+key: _results["test"][key] for key in ["objective_score", "concordance_score"]})
-                data.append(results)
-
-    df = pd.DataFrame.from_dict(data)
+    with phase("load"):
+        df = load_results(algorithms, columns=FRAME_COLUMNS)
+    df.loc[(df["runtime"] >= 600) | (df["runtime"] < -1e6), "runtime"] = 1200
+    df["dataset"] = df.pop("file").str.replace("train/", "")
+    df["method"] = df["method"].map(algorithm_name)
     datasets = df["dataset"].unique()
     _means =  df.groupby(["method", "max-depth"])["train_objective_score"].mean()
     means = df.groupby(["method", "max-depth"])[["train_objective_score"]].mean().reset_index()
@@ -77,8 +70,9 @@ def main():
     
     plt.tight_layout()
     #plt.show()
-    plt.savefig(f"{DIRECTORY}/plots/train_score.pdf", bbox_inches="tight", pad_inches = 0)
+    with phase("write"):
+        plt.savefig(f"{DIRECTORY}/plots/train_score.pdf", bbox_inches="tight", pad_inches = 0)
 
 if __name__ == "__main__":
-    main()
-
+    with step_profile("step_14_output_train_score", PROFILE_DIRECTORY):
+        main()
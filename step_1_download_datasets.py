@@ -1,7 +1,10 @@
 import os
 from SurvSet.data import SurvLoader
-from utils import files_in_directory
-from utils import ORIGINAL_DIRECTORY
+from utils import files_in_directory, step_profile
+from utils import DIRECTORY, ORIGINAL_DIRECTORY
+
+# The directory to which the profile of this step is written
+PROFILE_DIRECTORY = f"{DIRECTORY}/datasets"
 
 def main():
     # Create necessary directories
@@ -64,4 +67,5 @@ def main():
         print(f"\033[35mDownloaded \033[1m{dataset_name}\033[0;35m (dropped \033[1m{removed_instances} / {total_instances}\033[0;35m instances)\033[0m")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with step_profile("step_1_download_datasets", PROFILE_DIRECTORY):
+        main()
@@ -1,7 +1,11 @@
 import numpy as np
 import os
-from utils import files_in_directory
-from utils import ORIGINAL_DIRECTORY
+from concurrent.futures import ProcessPoolExecutor
+from utils import files_in_directory, step_profile
+from utils import DIRECTORY, ORIGINAL_DIRECTORY
+
+# The directory to which the profile of this step is written
+PROFILE_DIRECTORY = f"{DIRECTORY}/datasets"
 
 # These are the distributions that can be used in each leaf node
 #   - Exponential(lambda)
@@ -44,141 +48,219 @@ DISTRIBUTIONS = [
 ]
 
 SEED = 4136121025
-np.random.seed(SEED)
+
+# The number of processes to generate datasets with
+WORKERS = os.cpu_count()
+
+# Draws a number of times from one of the leaf distributions at once
+#
+# dist      The distribution to draw from (see `DISTRIBUTIONS`)
+# size      The number of times to draw
+# rng       The random generator to draw with
+def sample_times(dist, size, rng):
+    if dist[0] == "exp":
+        return rng.exponential(dist[1], size)
+    if dist[0] == "wei":
+        return rng.weibull(dist[1], size) * dist[2]
+    if dist[0] == "lgn":
+        return rng.lognormal(dist[1], dist[2], size)
+    if dist[0] == "gam":
+        return rng.gamma(dist[1], dist[2], size)
 
 # Recursively splits a set of instances and assigns times to them
-# If successful it returns true, else false
+# If successful it returns the ground truth tree, else None
+# Decision nodes are returned as [feature, value, left, right] and leaf nodes as [distribution]
 # This algorithm is based on the algorithm in "Optimal Survival Trees" (Bertsimas et al.), Algorithm 1
 #
 # depth         The depth of the tree
-# instances     The instances to be given a time
+# indices       The row ids of the instances to be given a time
+# columns       The feature columns of the dataset
+# times         The array in which the sampled times are stored
 # min_bucket    The minimum number of instances that need to be in a leaf
 # depth_margin  The amount of layers a subtree is allowed to skim off, in the event that it has too little instances to split
-def generate_tree(depth, instances, min_bucket, depth_margin):
+# rng           The random generator to draw with
+def generate_tree(depth, indices, columns, times, min_bucket, depth_margin, rng):
     # If there are too little instances, this tree is not okay
-    if len(instances) < min_bucket << depth:
+    if len(indices) < min_bucket << depth:
         if depth > 0 and depth_margin > 0:
-            return generate_tree(depth - 1, instances, min_bucket, depth_margin - 1)
-        return -1
+            return generate_tree(depth - 1, indices, columns, times, min_bucket, depth_margin - 1, rng)
+        return None
 
     # When no recursions are allowed any longer, use a random distribution to apply to the remaining nodes
     if depth == 0:
-        dist = DISTRIBUTIONS[np.random.randint(len(DISTRIBUTIONS))]
-        for inst in instances:
-            if dist[0] == "exp":
-                inst[0] = np.random.exponential(dist[1])
-            if dist[0] == "wei":
-                inst[0] = np.random.weibull(dist[1]) * dist[2]
-            if dist[0] == "lgn":
-                inst[0] = np.random.lognormal(dist[1], dist[2])
-            if dist[0] == "gam":
-                inst[0] = np.random.gamma(dist[1], dist[2])
-        return 1
-
-    features = [*range(len(instances[0]) - 2)]
-    np.random.shuffle(features)
-
-    for f in features:
-        predicates = []
-        values = [*{inst[f + 2] for inst in instances}]
-        np.random.shuffle(values)
-        if type(instances[0][f + 2]) == str:
-            predicates = [lambda x: x[f + 2] == v for v in values]
-        else:
-            predicates = [lambda x: x[f + 2] >= v for v in values]
-
-        for pred in predicates:
-            left_instances = []
-            right_instances = []
-            for inst in instances:
-                if not pred(inst):
-                    left_instances.append(inst)
-                else:
-                    right_instances.append(inst)
-
-            left_num_nodes = generate_tree(depth - 1, left_instances, min_bucket, depth_margin)
-            if left_num_nodes == -1:
-                return -1
-            right_num_nodes = generate_tree(depth - 1, right_instances, min_bucket, depth_margin)
-            if right_num_nodes == -1:
-                return -1
-
-            return left_num_nodes + right_num_nodes
-
-    return generate_tree(depth - 1, instances, min_bucket, depth_margin - 1)
+        dist = DISTRIBUTIONS[rng.integers(len(DISTRIBUTIONS))]
+        times[indices] = sample_times(dist, len(indices), rng)
+        return [dist]
+
+    if not columns:
+        return generate_tree(depth - 1, indices, columns, times, min_bucket, depth_margin - 1, rng)
+
+    # Split on a random feature, comparing to one of the values that occur in it
+    f = rng.integers(len(columns))
+    values = columns[f][indices]
+    value = rng.choice(np.unique(values))
+    if values.dtype.kind == "U":
+        mask = values == value
+    else:
+        mask = values >= value
+
+    left_tree = generate_tree(depth - 1, indices[~mask], columns, times, min_bucket, depth_margin, rng)
+    if left_tree is None:
+        return None
+    right_tree = generate_tree(depth - 1, indices[mask], columns, times, min_bucket, depth_margin, rng)
+    if right_tree is None:
+        return None
+
+    return [f, value, left_tree, right_tree]
+
+# Generates the feature columns of a dataset
+#
+# n         The amount of instances in the dataset
+# f         How many times to repeat the six preset features
+# rng       The random generator to draw with
+def generate_features(n, f, rng):
+    # Generate (a total of `f` times):
+    #   3 continuous random values between 0 and 1
+    #   2 boolean values
+    #   A discrete value with 3 options
+    #   A discrete value with 5 options
+    columns = []
+    for _ in range(f):
+        columns.append(rng.random(n))
+        columns.append(rng.random(n))
+        columns.append(rng.random(n))
+        columns.append(rng.integers(2, size=n))
+        columns.append(np.array([*"XYZ"])[rng.integers(3, size=n)])
+        columns.append(np.array([*"ABCDE"])[rng.integers(5, size=n)])
+    return columns
+
+# Returns the order in which to store the instances, such that the censored and non-censored instances are interleaved to properly divide them among sublists
+# Each block of 100 instances consists of `100 - c` non-censored instances followed by `c` censored instances
+#
+# censored  Whether each instance is censored
+# c         The percentage of instances that is censored (between 0 and 100)
+def interleave_order(censored, c):
+    noncensored_indices = np.flatnonzero(~censored)[::-1]
+    censored_indices = np.flatnonzero(censored)[::-1]
+
+    take_noncensored = max(1, 100 - c)
+    take_censored = max(1, c)
+    j = np.arange(len(noncensored_indices))
+    noncensored_keys = (j // take_noncensored) * 100 + j % take_noncensored
+    j = np.arange(len(censored_indices))
+    censored_keys = (j // take_censored) * 100 + (100 - c) + j % take_censored
+
+    keys = np.concatenate([noncensored_keys, censored_keys])
+    indices = np.concatenate([noncensored_indices, censored_indices])
+    return indices[np.argsort(keys, kind="stable")]
 
 # Generates a dataset according to some contraints
+# Returns the columns of the dataset, starting with `time` and `event`
 #
 # n         The amount of instances in the dataset
 # f         How many times to repeat the six preset features
 # c         The percentage of instances that should be censored (between 0 and 100)
-def generate_dataset(n, f, c):
+# rng       The random generator to draw with
+def generate_dataset(n, f, c, rng):
     while True:
-        instances = []
-        
-        for _ in range(n):
-            # Placeholder values for `time` and `event`
-            instance = [0, 0]
-
-            # Generate (a total of `f` times):
-            #   3 continuous random values between 0 and 1
-            #   2 boolean values
-            #   A discrete value with 3 options
-            #   A discrete value with 5 options
-            for _ in range(f):
-                instance.append(np.random.rand())
-                instance.append(np.random.rand())
-                instance.append(np.random.rand())
-                instance.append(np.random.randint(2))
-                instance.append("XYZ"[np.random.randint(3)])
-                instance.append("ABCDE"[np.random.randint(5)])
-            instances.append(instance)
-        
+        columns = generate_features(n, f, rng)
+
         # Generate the ground truth tree and sample instance times with it
-        num_nodes = generate_tree(4, instances, 1, 1)
-        if num_nodes > -1:
+        times = np.zeros(n)
+        tree = generate_tree(4, np.arange(n), columns, times, 1, 1, rng)
+        if tree is not None:
             break
 
     # Figure out what `k` is needed to censor each particular instance
-    ks = []
-    for inst in instances:
-        inst[0] = max(1e-9, inst[0])
-        u = 1 - np.random.random() ** 2
-
-        inst[1] = u
-        ks.append(inst[0] / u)
+    times = np.maximum(1e-9, times)
+    u = 1 - rng.random(n) ** 2
+    ks = times / u
 
     # Find a `k` such that `c` percent of the instances is censored
-    ks = sorted(ks)
-    k = ks[int(n * (1 + 1e-9 - c / 100))] - 1e-9
+    idx = int(n * (1 + 1e-9 - c / 100))
+    k = np.partition(ks, idx)[idx] - 1e-9
 
     # Apply censoring to the chosen instances
-    noncensored_instances = []
-    censored_instances = []
-    for inst in instances:
-        censor = k * inst[1]
-
-        if censor < inst[0]:
-            inst[0] = censor
-            inst[1] = 0
-            censored_instances.append(inst)
-        else:
-            inst[1] = 1
-            noncensored_instances.append(inst)
-    
-    assert len(censored_instances) == n * c // 100
-    
-    # Interleave the censored and non-censored data to properly divide them among sublists
-    take_noncensored = 100 - c
-    take_censored = c
-    instances = []
-    while len(instances) < n:
-        for _ in range(take_noncensored):
-            instances.append(noncensored_instances.pop())
-        for _ in range(take_censored):
-            instances.append(censored_instances.pop())
-
-    return instances
+    censor = k * u
+    censored = censor < times
+    times = np.where(censored, censor, times)
+    events = (~censored).astype(int)
+
+    assert censored.sum() == n * c // 100
+
+    order = interleave_order(censored, c)
+    return [column[order] for column in [times, events, *columns]]
+
+# Writes the header of a generated dataset to a file
+#
+# file          The opened file to write to
+# num_features  The amount of features in the dataset
+def write_header(file, num_features):
+    file.write("time,event," + ",".join(f"F{j}" for j in range(num_features)))
+    file.write("\n")
+
+# Writes instances of a generated dataset to a file, one line per instance
+#
+# file      The opened file to write to
+# columns   The columns of the instances, starting with `time` and `event`
+def write_rows(file, columns):
+    for row in zip(*[map(str, column.tolist()) for column in columns]):
+        file.write(",".join(row))
+        file.write("\n")
+
+# Writes some of the instances of a generated dataset to a file
+#
+# path      The path of the file to write
+# columns   The columns of the dataset, starting with `time` and `event`
+# rows      The slice of instances to write
+def write_dataset(path, columns, rows):
+    file = open(path, "w")
+    write_header(file, len(columns) - 2)
+    write_rows(file, [column[rows] for column in columns])
+    file.close()
+
+# Returns the random generator for a setting
+# Its stream is the child of `SeedSequence(SEED)` that `spawn` would create, but keyed by the setting instead of by position,
+# so every setting gets the same data regardless of the order, the number of workers, or which other settings are generated
+#
+# max_n     The amount of instances generated for the setting
+# setting   The (f, c, i) setting
+def setting_rng(max_n, setting):
+    return np.random.default_rng(np.random.SeedSequence(SEED, spawn_key=(max_n, *setting)))
+
+# Generates the dataset of one setting and writes a file for each of its sizes
+# Returns the names of the written files
+#
+# max_n     The amount of instances to generate
+# ns        The sizes of the files to write
+# setting   The (f, c, i) setting
+def generate_setting(max_n, ns, setting):
+    f, c, i = setting
+    columns = generate_dataset(max_n, f, c, setting_rng(max_n, setting))
+
+    filenames = []
+    for n in ns:
+        filename = f"generated_dataset_{n:05}_{f}_{c}_{i}"
+
+        if n <= 5000: # For the training instances, take the n first ones
+            rows = slice(None, n)
+        else: # for the test set take the n last instances
+            rows = slice(-n, None)
+        write_dataset(f"{ORIGINAL_DIRECTORY}/{filename}.txt", columns, rows)
+        filenames.append(filename)
+
+    return filenames
+
+# Generates the datasets of all settings using a pool of processes
+#
+# max_n     The amount of instances to generate per setting
+# ns        The sizes of the files to write per setting
+# settings  The (f, c, i) settings
+def generate_settings(max_n, ns, settings):
+    with ProcessPoolExecutor(WORKERS) as executor:
+        for filenames in executor.map(generate_setting, [max_n] * len(settings), [ns] * len(settings), settings):
+            for filename in filenames:
+                print(f"\033[35mCreated \033[1m{filename}\033[0m")
 
 def main():
     # The settings to generate with
@@ -206,28 +288,10 @@ def main():
             os.remove(f"{ORIGINAL_DIRECTORY}/{filename}")
 
     # Generate a dataset for each setting
-    for f, c, i in SETTINGS:
-        instances = generate_dataset(MAX_N, f, c)
-
-        for n in ns:
-            filename = f"generated_dataset_{n:05}_{f}_{c}_{i}"
-
-            file = open(f"{ORIGINAL_DIRECTORY}/{filename}.txt", "w")
-            file.write("time,event," + ",".join(f"F{j}" for j in range(len(instances[0]) - 2)))
-            file.write("\n")
-
-            if n <= 5000: # For the training instances, take the n first ones
-                curr_instances = instances[:n]
-            else: # for the test set take the n last instances
-                curr_instances = instances[-n:]
-            for inst in curr_instances:
-                file.write(",".join(str(j) for j in inst))
-                file.write("\n")
-            file.close()
-
-            print(f"\033[35mCreated \033[1m{filename}\033[0m")
+    generate_settings(MAX_N, ns, SETTINGS)
 
     print("\033[32;1mDone!\033[0m")
 
 if __name__ == "__main__":
-    main()
+    with step_profile("step_2a_generate_synthetic_datasets", PROFILE_DIRECTORY):
+        main()
@@ -1,186 +1,104 @@
 import numpy as np
 import os
-from utils import files_in_directory
-from utils import ORIGINAL_DIRECTORY
-
-# These are the distributions that can be used in each leaf node
-#   - Exponential(lambda)
-#   - Weibull(k, lambda)
-#   - Lognormal(mu, sigma^2)
-#   - Gamma(k, theta)
-DISTRIBUTIONS = [
-    ("exp", 0.3),
-    ("exp", 0.4),
-    ("exp", 0.6),
-    ("exp", 0.8),
-    ("exp", 0.9),
-    ("exp", 1.15),
-    ("exp", 1.5),
-    ("exp", 1.8),
-    ("wei", 0.8, 0.4),
-    ("wei", 0.9, 0.5),
-    ("wei", 0.9, 0.7),
-    ("wei", 0.9, 1.1),
-    ("wei", 0.9, 1.5),
-    ("wei", 1.0, 1.1),
-    ("wei", 1.0, 1.9),
-    ("wei", 1.3, 0.5),
-    ("lgn", 0.1, 1.0),
-    ("lgn", 0.2, 0.75),
-    ("lgn", 0.3, 0.3),
-    ("lgn", 0.3, 0.5),
-    ("lgn", 0.3, 0.8),
-    ("lgn", 0.4, 0.32),
-    ("lgn", 0.5, 0.3),
-    ("lgn", 0.5, 0.7),
-    ("gam", 0.2, 0.75),
-    ("gam", 0.3, 1.3),
-    ("gam", 0.3, 2.0),
-    ("gam", 0.5, 1.5),
-    ("gam", 0.8, 1.0),
-    ("gam", 0.9, 1.3),
-    ("gam", 1.4, 0.9),
-    ("gam", 1.5, 0.7),
-]
-
-SEED = 4136121025
-np.random.seed(SEED)
-
-# Recursively splits a set of instances and assigns times to them
-# If successful it returns true, else false
-# This algorithm is based on the algorithm in "Optimal Survival Trees" (Bertsimas et al.), Algorithm 1
-#
-# depth         The depth of the tree
-# instances     The instances to be given a time
-# min_bucket    The minimum number of instances that need to be in a leaf
-# depth_margin  The amount of layers a subtree is allowed to skim off, in the event that it has too little instances to split
-def generate_tree(depth, instances, min_bucket, depth_margin):
-    # If there are too little instances, this tree is not okay
-    if len(instances) < min_bucket << depth:
-        if depth > 0 and depth_margin > 0:
-            return generate_tree(depth - 1, instances, min_bucket, depth_margin - 1)
-        return -1
-
-    # When no recursions are allowed any longer, use a random distribution to apply to the remaining nodes
-    if depth == 0:
-        dist = DISTRIBUTIONS[np.random.randint(len(DISTRIBUTIONS))]
-        for inst in instances:
-            if dist[0] == "exp":
-                inst[0] = np.random.exponential(dist[1])
-            if dist[0] == "wei":
-                inst[0] = np.random.weibull(dist[1]) * dist[2]
-            if dist[0] == "lgn":
-                inst[0] = np.random.lognormal(dist[1], dist[2])
-            if dist[0] == "gam":
-                inst[0] = np.random.gamma(dist[1], dist[2])
-        return 1
-
-    features = [*range(len(instances[0]) - 2)]
-    np.random.shuffle(features)
-
-    for f in features:
-        predicates = []
-        values = [*{inst[f + 2] for inst in instances}]
-        np.random.shuffle(values)
-        if type(instances[0][f + 2]) == str:
-            predicates = [lambda x: x[f + 2] == v for v in values]
-        else:
-            predicates = [lambda x: x[f + 2] >= v for v in values]
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from step_2a_generate_synthetic_datasets import generate_features, generate_settings, generate_tree, sample_times, setting_rng, write_header, write_rows
+from step_2a_generate_synthetic_datasets import WORKERS
+from utils import files_in_directory, step_profile
+from utils import DIRECTORY, ORIGINAL_DIRECTORY
+
+# The directory to which the profile of this step is written
+PROFILE_DIRECTORY = f"{DIRECTORY}/datasets"
 
-        for pred in predicates:
-            left_instances = []
-            right_instances = []
-            for inst in instances:
-                if not pred(inst):
-                    left_instances.append(inst)
-                else:
-                    right_instances.append(inst)
+# The amount of instances on which the ground truth tree and the censoring constant of large datasets are determined
+SAMPLE_SIZE = 100000
 
-            left_num_nodes = generate_tree(depth - 1, left_instances, min_bucket, depth_margin)
-            if left_num_nodes == -1:
-                return -1
-            right_num_nodes = generate_tree(depth - 1, right_instances, min_bucket, depth_margin)
-            if right_num_nodes == -1:
-                return -1
+# The amount of instances of large datasets that are generated and written at once
+CHUNK_SIZE = 100000
 
-            return left_num_nodes + right_num_nodes
+# Samples times for instances using a ground truth tree made by `generate_tree`
+# Returns the sampled times
+#
+# tree      The ground truth tree
+# columns   The feature columns of the instances
+# rng       The random generator to draw with
+def apply_tree(tree, columns, rng):
+    times = np.zeros(len(columns[0]))
+
+    stack = [(tree, np.arange(len(times)))]
+    while stack:
+        node, indices = stack.pop()
+        if len(node) == 1:
+            times[indices] = sample_times(node[0], len(indices), rng)
+            continue
+
+        f, value, left_tree, right_tree = node
+        values = columns[f][indices]
+        if values.dtype.kind == "U":
+            mask = values == value
+        else:
+            mask = values >= value
+        stack.append((right_tree, indices[mask]))
+        stack.append((left_tree, indices[~mask]))
 
-    return generate_tree(depth - 1, instances, min_bucket, depth_margin - 1)
+    return times
 
-# Generates a dataset according to some contraints
+# Generates a dataset that is too large to keep in memory, and writes it to a file in chunks
+# The ground truth tree and the censoring constant `k` are determined on a preliminary sample, after which every chunk is drawn independently
+# Since all instances are drawn from the same distribution, they are not interleaved by censoring status like in `generate_dataset`
 #
+# path      The path of the file to write
 # n         The amount of instances in the dataset
 # f         How many times to repeat the six preset features
 # c         The percentage of instances that should be censored (between 0 and 100)
-def generate_dataset(n, f, c):
+# rng       The random generator to draw with
+def generate_large_dataset(path, n, f, c, rng):
+    # Generate the ground truth tree on a preliminary sample
     while True:
-        instances = []
-        
-        for _ in range(n):
-            # Placeholder values for `time` and `event`
-            instance = [0, 0]
-
-            # Generate (a total of `f` times):
-            #   3 continuous random values between 0 and 1
-            #   2 boolean values
-            #   A discrete value with 3 options
-            #   A discrete value with 5 options
-            for _ in range(f):
-                instance.append(np.random.rand())
-                instance.append(np.random.rand())
-                instance.append(np.random.rand())
-                instance.append(np.random.randint(2))
-                instance.append("XYZ"[np.random.randint(3)])
-                instance.append("ABCDE"[np.random.randint(5)])
-            instances.append(instance)
-        
-        # Generate the ground truth tree and sample instance times with it
-        num_nodes = generate_tree(4, instances, 1, 1)
-        if num_nodes > -1:
+        columns = generate_features(SAMPLE_SIZE, f, rng)
+        times = np.zeros(SAMPLE_SIZE)
+        tree = generate_tree(4, np.arange(SAMPLE_SIZE), columns, times, 1, 1, rng)
+        if tree is not None:
             break
 
-    # Figure out what `k` is needed to censor each particular instance
-    ks = []
-    for inst in instances:
-        inst[0] = max(1e-9, inst[0])
-        u = 1 - np.random.random() ** 2
-
-        inst[1] = u
-        ks.append(inst[0] / u)
-
-    # Find a `k` such that `c` percent of the instances is censored
-    ks = sorted(ks)
-    k = ks[int(n * (1 + 1e-9 - c / 100))] - 1e-9
-
-    # Apply censoring to the chosen instances
-    noncensored_instances = []
-    censored_instances = []
-    for inst in instances:
-        censor = k * inst[1]
-
-        if censor < inst[0]:
-            inst[0] = censor
-            inst[1] = 0
-            censored_instances.append(inst)
-        else:
-            inst[1] = 1
-            noncensored_instances.append(inst)
-    
-    assert len(censored_instances) == n * c // 100
-    
-    # Interleave the censored and non-censored data to properly divide them among sublists
-    take_noncensored = 100 - c
-    take_censored = c
-    instances = []
-    while len(instances) < n:
-        for _ in range(take_noncensored):
-            instances.append(noncensored_instances.pop())
-        for _ in range(take_censored):
-            instances.append(censored_instances.pop())
-
-    return instances
-
-def main():
+    # Estimate the `k` such that `c` percent of the instances is censored from the sample
+    ks = np.maximum(1e-9, times) / (1 - rng.random(SAMPLE_SIZE) ** 2)
+    k = np.quantile(ks, 1 - c / 100)
+
+    file = open(path, "w")
+    write_header(file, len(columns))
+    for start in range(0, n, CHUNK_SIZE):
+        size = min(CHUNK_SIZE, n - start)
+
+        # Sample the instances of this chunk with the ground truth tree
+        columns = generate_features(size, f, rng)
+        times = np.maximum(1e-9, apply_tree(tree, columns, rng))
+
+        # Apply censoring to the chosen instances
+        censor = k * (1 - rng.random(size) ** 2)
+        censored = censor < times
+        times = np.where(censored, censor, times)
+        events = (~censored).astype(int)
+
+        write_rows(file, [times, events, *columns])
+    file.close()
+
+# Generates the large dataset of one setting
+# Returns the name of the written file
+#
+# n         The amount of instances to generate
+# setting   The (f, c, i) setting
+def generate_large_setting(n, setting):
+    f, c, i = setting
+    filename = f"generated_dataset_{n:05}_{f}_{c}_{i}"
+    generate_large_dataset(f"{ORIGINAL_DIRECTORY}/{filename}.txt", n, f, c, setting_rng(n, setting))
+    return filename
+
+# Generates the datasets of every setting, and the large datasets of the given sizes
+# Large datasets take a lot of memory and disk space in the later steps, so none are generated by default
+#
+# large_ns  The sizes of the datasets that are generated in chunks (e.g. 1000000 and 10000000)
+def main(large_ns=()):
     # The settings to generate with
     
     MAX_N = 5000
@@ -206,25 +124,19 @@ def main():
             os.remove(f"{ORIGINAL_DIRECTORY}/{filename}")
 
     # Generate a dataset for each setting
-    for f, c, i in SETTINGS:
-        instances = generate_dataset(MAX_N, f, c)
-
-        for n in ns:
-            filename = f"generated_dataset_{n:05}_{f}_{c}_{i}"
-
-            file = open(f"{ORIGINAL_DIRECTORY}/{filename}.txt", "w")
-            file.write("time,event," + ",".join(f"F{j}" for j in range(len(instances[0]) - 2)))
-            file.write("\n")
-
-            curr_instances = instances[:n]
-            for inst in curr_instances:
-                file.write(",".join(str(j) for j in inst))
-                file.write("\n")
-            file.close()
+    generate_settings(MAX_N, ns, SETTINGS)
 
-            print(f"\033[35mCreated \033[1m{filename}\033[0m")
+    # Generate the large datasets for each setting
+    jobs = [(n, setting) for n in large_ns for setting in SETTINGS]
+    if jobs:
+        with ProcessPoolExecutor(WORKERS) as executor:
+            for filename in executor.map(generate_large_setting, *zip(*jobs)):
+                print(f"\033[35mCreated \033[1m{filename}\033[0m")
 
     print("\033[32;1mDone!\033[0m")
 
 if __name__ == "__main__":
-    main()
+    # Usage: python step_2c_generate_scalability_datasets.py [<large n> ...]
+    # Also generates a large dataset of each given size for every setting, in chunks
+    with step_profile("step_2c_generate_scalability_datasets", PROFILE_DIRECTORY):
+        main([int(j) for j in sys.argv[1:]])
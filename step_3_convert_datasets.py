@@ -1,9 +1,13 @@
 import os
 import shutil
-from utils import files_in_directory, parse_line
-from utils import DIRECTORY, ORIGINAL_DIRECTORY, NUMERIC_DIRECTORY, BINARY_DIRECTORY
+import sys
+from utils import file_hash, files_in_directory, parse_line, parse_value, phase, step_profile
+from utils import DIRECTORY, ORIGINAL_DIRECTORY, NUMERIC_DIRECTORY, BINARY_DIRECTORY, CATALOG_FILE, CATALOG_COLUMNS
 from collections import Counter
 
+# The directory to which the profile of this step is written
+PROFILE_DIRECTORY = f"{DIRECTORY}/datasets"
+
 MAX_BINARIZATIONS_PER_FEATURE = 10
 
 # Checks for binary features that make the same split and removes one of them, and removes binary features for which all instances have the same value
@@ -164,24 +168,48 @@ def turn_binary(feature_names, instances):
 
     return new_feature_names, new_instances, new_feature_meanings
 
-def main():
-    # Create a folder for binary feature meanings
-    if os.path.exists(f"{DIRECTORY}/datasets/feature_meanings"):
-        shutil.rmtree(f"{DIRECTORY}/datasets/feature_meanings")
-    os.mkdir(f"{DIRECTORY}/datasets/feature_meanings")
-
-    for output_directory in [NUMERIC_DIRECTORY, BINARY_DIRECTORY]:
-        # Remove all previously converted datasets
-        if not os.path.exists(output_directory):
-            os.mkdir(output_directory)
-        for filename in files_in_directory(output_directory):
-            os.remove(f"{output_directory}/{filename}")
-
-    for input_filename in files_in_directory(ORIGINAL_DIRECTORY):
-        name = input_filename[:-4]
+# Returns the catalog entry of a converted dataset, so later steps do not have to read the dataset files for its metadata
+#
+# name              The name of the dataset
+# feature_names     The names of the features of the original dataset
+# binary_instances  The instances of the binary dataset
+def catalog_entry(name, feature_names, binary_instances):
+    times = [inst[0] for inst in binary_instances]
+    return {
+        "dataset": name,
+        "n_instances": len(binary_instances),
+        "n_features": len(feature_names) - 2,
+        "n_binary_features": len(binary_instances[0]) - 2,
+        "censoring": 1.0 - sum(inst[1] for inst in binary_instances) / len(binary_instances),
+        "min_time": min(times),
+        "max_time": max(times),
+        "original_hash": file_hash(f"{ORIGINAL_DIRECTORY}/{name}.txt"),
+        "binary_hash": file_hash(f"{BINARY_DIRECTORY}/{name}.txt"),
+    }
+
+# Writes the dataset catalog, with one line per dataset
+#
+# entries   The catalog entries of the datasets
+def write_catalog(entries):
+    f = open(CATALOG_FILE, "w")
+    f.write(",".join(CATALOG_COLUMNS))
+    f.write("\n")
+    for entry in sorted(entries, key=lambda x: x["dataset"]):
+        f.write(",".join(repr(entry[j]) if isinstance(entry[j], float) else str(entry[j]) for j in CATALOG_COLUMNS))
+        f.write("\n")
+    f.close()
 
-        # Read instances from file
-        f = open(f"{ORIGINAL_DIRECTORY}/{input_filename}")
+# Converts a single dataset to its numeric and binary version and writes their files and binary feature meanings
+# Returns the catalog entry of the dataset
+#
+# name      The name of the dataset (its filename in the original directory, without extension)
+def convert_dataset(name):
+    for directory in [NUMERIC_DIRECTORY, BINARY_DIRECTORY, f"{DIRECTORY}/datasets/feature_meanings"]:
+        os.makedirs(directory, exist_ok=True)
+
+    # Read instances from file
+    with phase("load"):
+        f = open(f"{ORIGINAL_DIRECTORY}/{name}.txt")
         lines = f.read().strip().split("\n")
         f.close()
 
@@ -192,11 +220,12 @@ def main():
             inst = parse_line(line)
             instances.append(inst)
 
-        # Convert to numeric instances
-        numeric_feature_names, numeric_instances, numeric_feature_meanings = turn_numeric(feature_names, instances)
-        numeric_feature_names, numeric_instances = remove_redundant_binary_features(numeric_feature_names, numeric_instances)
+    # Convert to numeric instances
+    numeric_feature_names, numeric_instances, numeric_feature_meanings = turn_numeric(feature_names, instances)
+    numeric_feature_names, numeric_instances = remove_redundant_binary_features(numeric_feature_names, numeric_instances)
 
-        # Write numeric instances
+    # Write numeric instances
+    with phase("write"):
         f = open(f"{NUMERIC_DIRECTORY}/{name}.txt", "w")
         f.write(",".join(numeric_feature_names))
         f.write("\n")
@@ -205,13 +234,14 @@ def main():
             f.write("\n")
         f.close()
 
-        # Convert to binary instances
-        binary_feature_names, binary_instances, binary_feature_meanings = turn_binary(numeric_feature_names, numeric_instances)
-        binary_feature_names, binary_instances = remove_redundant_binary_features(binary_feature_names, binary_instances)
-        for key, value in numeric_feature_meanings.items():
-            binary_feature_meanings[key] = value
+    # Convert to binary instances
+    binary_feature_names, binary_instances, binary_feature_meanings = turn_binary(numeric_feature_names, numeric_instances)
+    binary_feature_names, binary_instances = remove_redundant_binary_features(binary_feature_names, binary_instances)
+    for key, value in numeric_feature_meanings.items():
+        binary_feature_meanings[key] = value
 
-        # Write binary instances
+    # Write binary instances and binary feature meanings
+    with phase("write"):
         f = open(f"{BINARY_DIRECTORY}/{name}.txt", "w")
         f.write(",".join(binary_feature_names))
         f.write("\n")
@@ -220,20 +250,64 @@ def main():
             f.write("\n")
         f.close()
 
-        # Write binary feature meanings
         f = open(f"{DIRECTORY}/datasets/feature_meanings/{name}.txt", "w")
         for key, value in binary_feature_meanings.items():
             f.write(f"{key} = {value}")
             f.write("\n")
         f.close()
 
-        # Print progress
-        print(f"\033[35mConverted \033[1m{str(input_filename)}\033[0;35m (\033[1m{len(binary_instances)}\033[0;35m instances)\033[0m")
-        print(f"\033[34m  - Original    \033[1m{len(instances[0]) - 2}\033[0;34m features\033[0m")
-        print(f"\033[34m  - Numeric     \033[1m{len(numeric_instances[0]) - 2}\033[0;34m features\033[0m")
-        print(f"\033[34m  - Binary      \033[1m{len(binary_instances[0]) - 2}\033[0;34m features\033[0m")
+    # Print progress
+    print(f"\033[35mConverted \033[1m{name}.txt\033[0;35m (\033[1m{len(binary_instances)}\033[0;35m instances)\033[0m")
+    print(f"\033[34m  - Original    \033[1m{len(instances[0]) - 2}\033[0;34m features\033[0m")
+    print(f"\033[34m  - Numeric     \033[1m{len(numeric_instances[0]) - 2}\033[0;34m features\033[0m")
+    print(f"\033[34m  - Binary      \033[1m{len(binary_instances[0]) - 2}\033[0;34m features\033[0m")
+
+    return catalog_entry(name, feature_names, binary_instances)
+
+# Replaces the catalog entries of some datasets, and drops the entries of datasets that no longer exist
+# Used when only some of the datasets are converted again
+#
+# entries   The new catalog entries
+def update_catalog(entries):
+    catalog = {}
+    if os.path.exists(CATALOG_FILE):
+        f = open(CATALOG_FILE)
+        lines = f.read().strip().split("\n")
+        f.close()
+        for line in lines[1:]:
+            values = line.split(",")
+            catalog[values[0]] = {key: value if key in ["dataset", "original_hash", "binary_hash"] else parse_value(value) for key, value in zip(CATALOG_COLUMNS, values)}
+
+    catalog.update({entry["dataset"]: entry for entry in entries})
+    write_catalog([entry for name, entry in catalog.items() if os.path.exists(f"{ORIGINAL_DIRECTORY}/{name}.txt")])
+
+def main():
+    # Create a folder for binary feature meanings
+    if os.path.exists(f"{DIRECTORY}/datasets/feature_meanings"):
+        shutil.rmtree(f"{DIRECTORY}/datasets/feature_meanings")
+    os.mkdir(f"{DIRECTORY}/datasets/feature_meanings")
+
+    for output_directory in [NUMERIC_DIRECTORY, BINARY_DIRECTORY]:
+        # Remove all previously converted datasets
+        if not os.path.exists(output_directory):
+            os.mkdir(output_directory)
+        for filename in files_in_directory(output_directory):
+            os.remove(f"{output_directory}/{filename}")
+
+    catalog = []
+    for input_filename in files_in_directory(ORIGINAL_DIRECTORY):
+        catalog.append(convert_dataset(input_filename[:-4]))
+
+    write_catalog(catalog)
 
     print("\033[32;1mDone!\033[0m")
 
 if __name__ == "__main__":
-    main()
+    # Usage: python step_3_convert_datasets.py [<dataset> ...]
+    # Without arguments all datasets are converted, otherwise only the given datasets are converted and their catalog entries are replaced
+    with step_profile("step_3_convert_datasets", PROFILE_DIRECTORY):
+        if len(sys.argv) > 1:
+            update_catalog([convert_dataset(name) for name in sys.argv[1:]])
+            print("\033[32;1mDone!\033[0m")
+        else:
+            main()
@@ -1,82 +1,134 @@
 import numpy as np
 import os
 import shutil
-from utils import files_in_directory, parse_line
-from utils import ORIGINAL_DIRECTORY, NUMERIC_DIRECTORY, BINARY_DIRECTORY
+import sys
+from folds import assignments_to_partitions, repeated_stratified_folds, write_fold_manifests
+from utils import files_in_directory, phase, step_profile
+from utils import DIRECTORY, ORIGINAL_DIRECTORY, NUMERIC_DIRECTORY, BINARY_DIRECTORY, FOLDS_DIRECTORY
+
+# The directory to which the profile of this step is written
+PROFILE_DIRECTORY = f"{DIRECTORY}/datasets"
 
 SEED = 4136121025
-np.random.seed(SEED)
 
 K = 5
 
+# The number of times the `K`-fold split is repeated
+# A single repeat uses the original splitting procedure, which is stratified on the event only
+# Multiple repeats are stratified on both the event and `TIME_QUANTILES` quantiles of the time
+R = 1
+TIME_QUANTILES = 4
+
+# Returns the datasets that are split, in the order in which they are shuffled
+def split_order():
+    return [j[:-4] for j in files_in_directory(ORIGINAL_DIRECTORY) if not j.startswith("generated")]
+
+# Returns the time and event of each instance of a dataset
+#
+# filename  The name of the dataset
+def read_times_and_events(filename):
+    f = open(f"{ORIGINAL_DIRECTORY}/{filename}.txt")
+    lines = f.read().strip().split("\n")
+    f.close()
+
+    times = [float(line.split(",")[0]) for line in lines[1:]]
+    events = [int(line.split(",")[1]) for line in lines[1:]]
+    return times, events
+
+# Returns the indices of the censored and of the uncensored instances
+#
+# events    The event of each instance
+def indices_per_event(events):
+    indices = [[], []]
+    for i in range(len(events)):
+        indices[events[i]].append(i)
+    return indices
+
+# Returns the random state with which a single repeat shuffles a dataset
+# All datasets are shuffled with one stream seeded with `SEED`, in the order of `split_order`, which keeps the folds of the archived tree-files
+# The shuffles of the datasets before this one are replayed (they only depend on the number of instances per event),
+# so every dataset can still be split on its own, with the same result as when all datasets are split at once
+#
+# filename  The name of the dataset
+def single_repeat_random_state(filename):
+    random_state = np.random.RandomState(SEED)
+    order = split_order()
+    for name in order[:order.index(filename)] if filename in order else []:
+        for indices in indices_per_event(read_times_and_events(name)[1]):
+            random_state.shuffle(indices)
+    return random_state
+
+# Splits a single dataset into `K` folds (repeated `R` times) and writes the test rows of each fold
+#
+# filename      The name of the dataset (its filename in the original directory, without extension)
+# random_state  The stream a single repeat shuffles with, which is continued by the next dataset (by default, it is replayed up to this dataset)
+def split_dataset(filename, random_state=None):
+    # Remove the previous folds of this dataset, the train/test-files materialized from them are rewritten once they are older than the folds
+    if os.path.exists(FOLDS_DIRECTORY):
+        for manifest in files_in_directory(FOLDS_DIRECTORY):
+            if manifest.startswith(f"{filename}_partition_") or manifest.startswith(f"{filename}_repeat_"):
+                os.remove(f"{FOLDS_DIRECTORY}/{manifest}")
+
+    # Read the time and event columns from file, the rows themselves are only needed once they are used
+    with phase("load"):
+        times, events = read_times_and_events(filename)
+
+    if R > 1:
+        # Compute all `R` x `K` folds at once and store the test rows of each of them
+        assignments = repeated_stratified_folds(events, times, K, R, SEED, TIME_QUANTILES)
+        with phase("write"):
+            write_fold_manifests(filename, assignments_to_partitions(assignments, K), repeated=True)
+
+        print(f"\033[35mSplit \033[1m{filename}\033[0;35m ({R} x {K} folds)\033[0m")
+        return
+
+    # Group instances based on observation status
+    grouped_indices = indices_per_event(events)
+
+    # Take `100c` percent of each group, make `K` partitions
+    if random_state is None:
+        with phase("load"):
+            random_state = single_repeat_random_state(filename)
+    partitions = [set() for _ in range(K)]
+    for event in range(2):
+        curr_indices = grouped_indices[event]
+        random_state.shuffle(curr_indices)
+        curr_partitions = [{*curr_indices[j * len(curr_indices) // K:(j + 1) * len(curr_indices) // K]} for j in range(K)]
+        if event == 1:
+            curr_partitions = curr_partitions[::-1]
+        for i in range(K):
+            partitions[i] |= curr_partitions[i]
+
+    # Store the test rows of each partition, the train/test-files are only written once a solver needs them (see folds.py)
+    with phase("write"):
+        write_fold_manifests(filename, partitions)
+
+    print(f"\033[35mSplit \033[1m{filename}\033[0m")
+
 def main():
-    # Empty each train/test-directory
+    # Remove the previous folds, including train/test-files that were materialized from them
     for directory in [ORIGINAL_DIRECTORY, NUMERIC_DIRECTORY, BINARY_DIRECTORY]:
         for section in ["train", "test"]:
             path = f"{directory}/{section}"
             if os.path.exists(path):
                 shutil.rmtree(path)
-            os.mkdir(path)
-
-    for filename in [j[:-4] for j in files_in_directory(ORIGINAL_DIRECTORY) if not j.startswith("generated")]:
-        # Read instances from file
-        f = open(f"{ORIGINAL_DIRECTORY}/{filename}.txt")
-        lines = f.read().strip().split("\n")
-        f.close()
-
-        instances = []
-        for line in lines[1:]:
-            inst = parse_line(line)
-            instances.append(inst)
-        f.close()
-
-        # Group instances based on observation status
-        indices_per_event = [[], []]
-        for i in range(len(instances)):
-            indices_per_event[instances[i][1]].append(i)
-
-        # Take `100c` percent of each group, make `K` partitions
-        partitions = [set() for _ in range(K)]
-        for event in range(2):
-            curr_indices = indices_per_event[event]
-            np.random.shuffle(curr_indices)
-            curr_partitions = [{*curr_indices[j * len(curr_indices) // K:(j + 1) * len(curr_indices) // K]} for j in range(K)]
-            if event == 1:
-                curr_partitions = curr_partitions[::-1]
-            for i in range(K):
-                partitions[i] |= curr_partitions[i]
-
-        # Create train/test-files for each partition
-        for i, partition in enumerate(partitions):
-            for directory in [ORIGINAL_DIRECTORY, NUMERIC_DIRECTORY, BINARY_DIRECTORY]:
-                # Read lines from file
-                f = open(f"{directory}/{filename}.txt")
-                lines = f.read().strip().split("\n")
-                f.close()
-
-                info_line = lines[0] + "\n"
-                data_lines = lines[1:]
-
-                # Divide lines into train- and test-group
-                train_lines, test_lines = [], []
-                for j, line in enumerate(data_lines):
-                    if j in partition:
-                        test_lines.append(line)
-                    else:
-                        train_lines.append(line)
-
-                # Write the files
-                for section, lines in [("train", train_lines), ("test", test_lines)]:
-                    path = f"{directory}/{section}/{filename}_partition_{i}.txt"
-
-                    f = open(path, "w")
-                    f.write(info_line)
-                    f.write("\n".join(lines))
-                    f.close()
-
-        print(f"\033[35mSplit \033[1m{filename}\033[0m")
+    if os.path.exists(FOLDS_DIRECTORY):
+        shutil.rmtree(FOLDS_DIRECTORY)
+    os.mkdir(FOLDS_DIRECTORY)
+
+    random_state = np.random.RandomState(SEED)
+    for filename in split_order():
+        split_dataset(filename, random_state)
 
     print("\033[32;1mDone!\033[0m")
 
 if __name__ == "__main__":
-    main()
+    # Usage: python step_4_split_datasets.py [<dataset> ...]
+    # Without arguments all datasets are split, otherwise only the given datasets are split again
+    with step_profile("step_4_split_datasets", PROFILE_DIRECTORY):
+        if len(sys.argv) > 1:
+            for filename in sys.argv[1:]:
+                split_dataset(filename)
+            print("\033[32;1mDone!\033[0m")
+        else:
+            main()
@@ -1,8 +1,12 @@
 import os
-from step_4_split_datasets import K
-from utils import files_in_directory
+from folds import fold_suffixes
+from step_4_split_datasets import K, R
+from utils import files_in_directory, step_profile
 from utils import DIRECTORY, ORIGINAL_DIRECTORY
 
+# The directory to which the profile of this step is written
+PROFILE_DIRECTORY = f"{DIRECTORY}/output"
+
 # Takes the cartesian product of a list of options per parameter
 #
 # items     A list of pairs containing a key and its list of possible values
@@ -57,10 +61,10 @@ def prepare_parameters(parameters):
         parameters["test-file"] = "test/" + parameters["test-file"]
 
         result = []
-        for idx in range(K):
+        for suffix in fold_suffixes(K, R):
             p = parameters.copy()
-            p["file"] += f"_partition_{idx}"
-            p["test-file"] += f"_partition_{idx}"
+            p["file"] += suffix
+            p["test-file"] += suffix
             result.append(p)
 
         return result
@@ -106,4 +110,5 @@ def main():
     print("\033[32;1mDone!\033[0m")
 
 if __name__ == "__main__":
-    main()
+    with step_profile("step_5b_generate_real_data_settings", PROFILE_DIRECTORY):
+        main()
@@ -2,7 +2,11 @@ import os
 import shutil
 from subprocess import Popen, PIPE
 import time
-from utils import get_feature_meanings, parse_settings, DIRECTORY
+from folds import read_split_lines
+from utils import get_feature_meanings, parse_settings, phase, step_profile, DIRECTORY
+
+# The directory to which the profile of this step is written
+PROFILE_DIRECTORY = f"{DIRECTORY}/output"
 
 # Replace paths if necessary!
 EXEC_PATH = "../out/build/x64-Release/STREED.exe"
@@ -13,18 +17,17 @@ PARETO_PRUNING = True
 
 DATASET_TYPE = "binary"
 
-# Takes a comma-separated dataset file and turns it into a file that STreeD can read
+# Takes a comma-separated dataset (or a section of one of its folds) and turns it into a file that STreeD can read
 # Returns the list of feature names found in the first line of the file
 #
-# input_path    The path to the comma-separated file
+# directory     The directory of the comma-separated dataset
+# filename      The filename relative to the directory, without extension
 # output_path   The path to the output file
-def make_streed_compatible(input_path, output_path):
-    f = open(input_path)
-    lines = f.read().strip().split("\n")
-    f.close()
+def make_streed_compatible(directory, filename, output_path):
+    info_line, lines = read_split_lines(directory, filename)
 
-    feature_names = lines[0].split(",")[2:]
-    new_lines = [line.replace(",", " ") for line in lines[1:]]
+    feature_names = info_line.split(",")[2:]
+    new_lines = [line.replace(",", " ") for line in lines]
 
     f = open(output_path, "w")
     f.write("\n".join(new_lines))
@@ -44,31 +47,29 @@ def create_pareto_key(parameters):
     else:
         return (False, filename, depth, None, None)
 
-def contains_pareto_key(key):
+# Returns whether the settings of a Pareto key are dominated by those of a run that timed out
+#
+# key       The Pareto key of the settings, as made by `create_pareto_key`
+# front     The Pareto keys of the runs that timed out, by default those of this process
+def contains_pareto_key(key, front=None):
+    front = pareto_front if front is None else front
     if key[0]:
         _, n, f, c, depth = key
-        for is_synthetic, other_n, other_f, other_c, other_depth in pareto_front:
+        for is_synthetic, other_n, other_f, other_c, other_depth in front:
             if is_synthetic and other_n <= n and other_f <= f and other_c == c and other_depth <= depth:
                 return True
         return False
     else:
         _, filename, depth, _, _ = key
-        for is_synthetic, other_filename, other_depth, _, _ in pareto_front:
+        for is_synthetic, other_filename, other_depth, _, _ in front:
             if not is_synthetic and other_filename == filename and other_depth <= depth:
                 return True
         return False
 
-# Runs STreeD with a set of parameters
-# Returns resulting tree and the time needed to generate it (a negative time indicates a time out)
+# Returns the command line arguments to run STreeD with a set of parameters
 #
 # parameters    The parameters to run the algorithm with
-def run_streed(parameters):
-    global pareto_front
-    pareto_key = create_pareto_key(parameters)
-    if PARETO_PRUNING:
-        if contains_pareto_key(pareto_key):
-            return -1e9, "[None]"
-
+def streed_arguments(parameters):
     # Convert parameters to arguments
     args = []
     for key, value in parameters.items():
@@ -88,29 +89,108 @@ def run_streed(parameters):
         "-use-terminal-solver", "1"
     ])
 
-    # Print executable call for convenience
-    print(f"\033[35;1m{EXEC_PATH} {' '.join(args)}\033[0m")
-
-    # Run executable
-    proc = Popen([EXEC_PATH, *args], stdin=PIPE, stdout=PIPE)
-    out, _ = proc.communicate()
+    return args
 
-    # Read the output from the console
+# Reads the resulting tree and the time needed to generate it from the console output of STreeD
+# Returns the time and the tree, where a negative time indicates a time out
+#
+# out   The bytes written to the console by STreeD
+def parse_streed_output(out):
     out_lines = [j.strip() for j in out.decode().split("\n")]
     time_line = [j for j in out_lines if j.startswith("CLOCKS FOR SOLVE:")][0]
     time = float(time_line.split()[-1])
 
     # Check whether there was a time-out first
     if "No tree found" in out_lines:
-        if PARETO_PRUNING:
-            pareto_front.append(pareto_key)
         return -time, "[None]"
-    
+
     tree_line = [j for j in out_lines if j.startswith("Tree 0:")][0]
     tree = tree_line.split()[-1]
 
     return time, tree
 
+# Runs STreeD with a set of parameters
+# Returns resulting tree and the time needed to generate it (a negative time indicates a time out)
+#
+# parameters    The parameters to run the algorithm with
+# front         The Pareto keys of the runs that timed out, by default those of this process
+def run_streed(parameters, front=None):
+    front = pareto_front if front is None else front
+    pareto_key = create_pareto_key(parameters)
+    if PARETO_PRUNING:
+        if contains_pareto_key(pareto_key, front):
+            return -1e9, "[None]"
+
+    args = streed_arguments(parameters)
+
+    # Print executable call for convenience
+    print(f"\033[35;1m{EXEC_PATH} {' '.join(args)}\033[0m")
+
+    # Run executable
+    proc = Popen([EXEC_PATH, *args], stdin=PIPE, stdout=PIPE)
+    out, _ = proc.communicate()
+
+    # Read the output from the console
+    time, tree = parse_streed_output(out)
+    if time < 0 and PARETO_PRUNING:
+        front.append(pareto_key)
+
+    return time, tree
+
+# Skips the results of settings that a serial run would not have run, since a setting before them (in the order of the settings) timed out
+# Runs at the same time (or on other hosts) may finish before the time-out that rules them out is known, so this is decided once they are all done
+# Returns the results, with the skipped ones replaced
+#
+# rows      The line of the settings file and the result ("<settings>;<time>;<tree>") of each finished setting, in the order of the settings
+def prune_results(rows):
+    front, results = [], []
+    for settings_line, result in rows:
+        pareto_key = create_pareto_key(eval(settings_line))
+        if PARETO_PRUNING and contains_pareto_key(pareto_key, front):
+            result = ";".join(str(j) for j in (eval(settings_line), -1e9, "[None]"))
+        elif PARETO_PRUNING and float(result.split(";")[1]) < 0:
+            front.append(pareto_key)
+        results.append(result)
+    return results
+
+# Points the train- and test-file of a set of parameters to the files that STreeD reads
+# Returns the original train- and test-filename, to reset the parameters with after running
+#
+# params                The parameters to run the algorithm with
+# dataset_directory     The directory of the comma-separated datasets
+# data_directory        The directory of the STreeD files
+def use_streed_files(params, dataset_directory, data_directory=DATA_DIRECTORY):
+    train_filename = params["file"]
+    train_path = f"{dataset_directory}/{train_filename}.txt"
+    params["file"] = train_path.replace(dataset_directory, data_directory)
+    test_filename = params["test-file"]
+    test_path = f"{dataset_directory}/{test_filename}.txt"
+    params["test-file"] = test_path.replace(dataset_directory, data_directory)
+
+    return train_filename, test_filename
+
+# Prints the outcome of a run of STreeD
+#
+# params            The parameters STreeD was run with
+# time_duration     The time returned by `run_streed`
+# tree              The tree returned by `run_streed`
+def print_streed_result(params, time_duration, tree):
+    if time_duration >= 0:
+        print(f"\033[33;1m{tree}\033[0m")
+        print(f"\033[34mTime: \033[1m{time_duration:.3f}\033[0;34m seconds\033[0m")
+    elif time_duration >= -1e8:
+        print(f"\033[31mOut of time: \033[1m{-time_duration:.3f}\033[0;31m seconds\033[0m")
+    else:
+        print(f"\033[30mIgnored due to Pareto front: {params['file'].split('/')[-1]} (depth = {params['max-depth']})\033[0m")
+
+# Clears the STreeD-datasets, these will be replaced anyway
+#
+# data_directory    The directory of the STreeD files
+def clear_streed_files(data_directory=DATA_DIRECTORY):
+    shutil.rmtree(data_directory, ignore_errors=True)
+    for section in ["", "/train", "/test"]:
+        os.mkdir(f"{data_directory}{section}")
+
 # Turn tree structure with numbers into tree structure with lambda's
 #
 # tree              The tree to convert
@@ -133,60 +213,59 @@ def serialize_tree_with_features(tree, feature_names, feature_meanings):
         right_child = serialize_tree_with_features(right, feature_names, feature_meanings)
         return f"[{feature_meaning},{left_child},{right_child}]"
 
+# Runs STreeD with a single set of parameters, writing its train-file first
+# Returns the parameters (with the original filenames), the time and the tree with lambda's
+#
+# params            The parameters to run the algorithm with
+# data_directory    The directory of the STreeD files
+# front             The Pareto keys of the runs that timed out, by default those of this process
+def run_setting(params, data_directory=DATA_DIRECTORY, front=None):
+    dataset_directory = f"{DIRECTORY}/datasets/{DATASET_TYPE}"
+
+    # Change files to new STreeD files
+    train_filename, test_filename = use_streed_files(params, dataset_directory, data_directory)
+
+    # Write STreeD files
+    feature_names = make_streed_compatible(dataset_directory, train_filename, params["file"])
+
+    # Run STreeD
+    with phase("solve"):
+        time_duration, tree = run_streed(params, front)
+    print_streed_result(params, time_duration, tree)
+
+    # Parse tree string to lambda-structure
+    feature_meanings = get_feature_meanings(params["core-file"])
+    tree = serialize_tree_with_features(eval(tree), feature_names, feature_meanings)
+
+    # Reset parameters to write to file nicely
+    params["file"] = train_filename
+    params["test-file"] = test_filename
+
+    return params, time_duration, tree
+
 def main():
     total_start_time = time.time()
 
-    # Clear STreeD-datasets, these will be replaced anyway
-    shutil.rmtree(DATA_DIRECTORY)
-    for section in ["", "/train", "/test"]:
-        os.mkdir(f"{DATA_DIRECTORY}{section}")
+    clear_streed_files()
 
     # Read settings
-    params_settings = parse_settings(f"{DIRECTORY}/output/settings.txt")
+    with phase("load"):
+        params_settings = parse_settings(f"{DIRECTORY}/output/settings.txt")
 
     results = []
     try:
-        dataset_directory = f"{DIRECTORY}/datasets/{DATASET_TYPE}"
-
         for params in params_settings:
-            # Change files to new STreeD files
-            train_filename = params["file"]
-            train_path = f"{dataset_directory}/{train_filename}.txt"
-            params["file"] = train_path.replace(dataset_directory, DATA_DIRECTORY)
-            test_filename = params["test-file"]
-            test_path = f"{dataset_directory}/{test_filename}.txt"
-            params["test-file"] = test_path.replace(dataset_directory, DATA_DIRECTORY)
-
-            # Write STreeD files
-            feature_names = make_streed_compatible(train_path, params["file"])
-
-            # Run STreeD
-            time_duration, tree = run_streed(params)
-            if time_duration >= 0:
-                print(f"\033[33;1m{tree}\033[0m")
-                print(f"\033[34mTime: \033[1m{time_duration:.3f}\033[0;34m seconds\033[0m")
-            elif time_duration >= -1e8:
-                print(f"\033[31mOut of time: \033[1m{-time_duration:.3f}\033[0;31m seconds\033[0m")
-            else:
-                print(f"\033[30mIgnored due to Pareto front: {params['file'].split('/')[-1]} (depth = {params['max-depth']})\033[0m")
-
-            # Parse tree string to lambda-structure
-            feature_meanings = get_feature_meanings(params["core-file"])
-            tree = serialize_tree_with_features(eval(tree), feature_names, feature_meanings)
-            results.append((params, time_duration, tree))
-
-            # Reset parameters to write to file nicely
-            params["file"] = train_filename
-            params["test-file"] = test_filename
+            results.append(run_setting(params))
     except KeyboardInterrupt:
         print("\033[33;1mHalted program!\033[0m")
 
     # Write trees to file
-    f = open(f"{DIRECTORY}/output/streed_trees.csv", "w")
-    f.write("id;settings;time;tree\n")
-    for i, data in enumerate(results):
-        f.write(f"{i};" + ";".join(str(j) for j in data) + "\n")
-    f.close()
+    with phase("write"):
+        f = open(f"{DIRECTORY}/output/streed_trees.csv", "w")
+        f.write("id;settings;time;tree\n")
+        for i, data in enumerate(results):
+            f.write(f"{i};" + ";".join(str(j) for j in data) + "\n")
+        f.close()
 
     total_end_time = time.time()
     print(f"\033[34mTotal time: \033[1m{total_end_time - total_start_time:.4f}\033[0;34m seconds")
@@ -194,4 +273,5 @@ def main():
     print("\033[32;1mDone!\033[0m")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with step_profile("step_6_run_streed", PROFILE_DIRECTORY):
+        main()
@@ -5,6 +5,13 @@ DIRECTORY = dirname(Base.source_path())
 DATASET_TYPE = "original"
 #DATASET_TYPE = "binary"
 
+# The train/test-files of folds are only written on demand, run `python folds.py original` (or binary) first
+
+# In worker mode (`julia step_7_run_ost.jl --worker`), settings lines are read from stdin until it is closed, and each result is written to stdout
+# as a single line starting with `RESULT_MARKER`, instead of writing all trees to file at the end (see run_solvers.py)
+WORKER_MODE = "--worker" in ARGS
+RESULT_MARKER = "#RESULT#"
+
 # Import modules (takes long)
 using CSV
 using DataFrames
@@ -74,7 +81,11 @@ function serialize_tree(tree, node_idx, feature_meanings)
 end
 
 results = []
-open(DIRECTORY * "/output/settings.txt") do f
+
+# Runs OST for every settings line read from a stream
+#
+# f     The stream to read settings lines from
+function run_settings(f)
     # Default parameters for warming up
     file = "divorce"
     core_file = file
@@ -83,13 +94,10 @@ open(DIRECTORY * "/output/settings.txt") do f
     cost_complexity = 0
     hypertuning = false
 
-    continuing = true
     warming_up = true
     settings_line = nothing
 
     while true
-        continuing = !eof(f)
-
         # Read data
         df = CSV.read(DIRECTORY * "/datasets/" * DATASET_TYPE * "/" * file * ".txt", DataFrame, pool=true)
         events = df[!, "event"] .== 1
@@ -190,11 +198,16 @@ open(DIRECTORY * "/output/settings.txt") do f
             push!(results, (settings_line, time_duration, tree_string))
 
             println("\033[34;1mTime: ", time_duration, " seconds\033[0m\n")
+            if WORKER_MODE
+                println(RESULT_MARKER * settings_line * ";" * string(time_duration) * ";" * tree_string)
+                flush(stdout)
+            end
         else
             warming_up = false
         end
 
-        if !continuing
+        # Only check for more settings after the run, so a worker runs each line as soon as it arrives
+        if eof(f)
             break
         end
 
@@ -211,19 +224,25 @@ open(DIRECTORY * "/output/settings.txt") do f
     end
 end
 
-# Write trees to file
-id = 0
-open(DIRECTORY * "/output/ost_trees.csv", "w") do f
-    write(f, "id;settings;time;tree\n")
+if WORKER_MODE
+    run_settings(stdin)
+else
+    open(run_settings, DIRECTORY * "/output/settings.txt")
 
-    for data in results
-        global id
+    # Write trees to file
+    id = 0
+    open(DIRECTORY * "/output/ost_trees.csv", "w") do f
+        write(f, "id;settings;time;tree\n")
 
-        settings_line, time_duration, tree_string = data
-        line = string(id) * ";" * settings_line * ";" * string(time_duration) * ";" * tree_string * "\n"
-        write(f, line)
+        for data in results
+            global id
 
-        id += 1
+            settings_line, time_duration, tree_string = data
+            line = string(id) * ";" * settings_line * ";" * string(time_duration) * ";" * tree_string * "\n"
+            write(f, line)
+
+            id += 1
+        end
     end
 end
 
@@ -11,10 +11,18 @@ library("mlr3tuning")
 directory <- getwd()
 dataset_type = "numeric"
 #dataset_type = "binary"
+
+# The train/test-files of folds are only written on demand, run `python folds.py numeric` (or binary) first
+
 TIME_OUT_IN_SECONDS <- 600
 
 settings_file <- paste(directory, "/output/settings.txt", sep = "")
 
+# In worker mode (`Rscript step_8_run_ctree.r --worker`), settings lines are read from stdin until it is closed, and each result is written to stdout
+# as a single line starting with `RESULT_MARKER`, instead of writing all trees to file at the end (see run_solvers.py)
+WORKER_MODE <- "--worker" %in% commandArgs(trailingOnly = TRUE)
+RESULT_MARKER <- "#RESULT#"
+
 total_start_time <- Sys.time()
 
 # Serialize the tree learner to a lambda-structure
@@ -168,31 +176,42 @@ run_ctree <- function(settings) {
   return(list(duration, tree_string))
 }
 
-id <- 0
-output_lines <- "id;settings;time;results"
-
-settings_lines <- read_lines(settings_file)
-for (settings_line in settings_lines) {
-  # Read settings
-  settings <- fromJSON(settings_line)
-  result <- run_ctree(settings)
-  duration <- result[[1]]
-  tree_string <- result[[2]]
-
-  # Append results
-  output_line <- paste("\n",
-    paste(id, settings_line, duration, tree_string, sep = ";"),
-    sep = ""
-  )
-  output_lines <- paste(output_lines, output_line)
-
-  id <- id + 1
-}
+if (WORKER_MODE) {
+  input <- file("stdin", open = "r")
+  while (length(settings_line <- readLines(input, n = 1)) > 0) {
+    settings <- fromJSON(settings_line)
+    result <- run_ctree(settings)
+    cat(paste(RESULT_MARKER, paste(settings_line, result[[1]], result[[2]], sep = ";"), "\n", sep = ""))
+    flush(stdout())
+  }
+  close(input)
+} else {
+  id <- 0
+  output_lines <- "id;settings;time;results"
+
+  settings_lines <- read_lines(settings_file)
+  for (settings_line in settings_lines) {
+    # Read settings
+    settings <- fromJSON(settings_line)
+    result <- run_ctree(settings)
+    duration <- result[[1]]
+    tree_string <- result[[2]]
+
+    # Append results
+    output_line <- paste("\n",
+      paste(id, settings_line, duration, tree_string, sep = ";"),
+      sep = ""
+    )
+    output_lines <- paste(output_lines, output_line)
+
+    id <- id + 1
+  }
 
-# Write trees to file
-sink(paste(directory, "/output/ctree_trees.csv", sep = ""))
-cat(output_lines)
-sink()
+  # Write trees to file
+  sink(paste(directory, "/output/ctree_trees.csv", sep = ""))
+  cat(output_lines)
+  sink()
+}
 
 total_end_time <- Sys.time()
 print(paste("Total time:", total_end_time - total_start_time))
@@ -1,47 +1,86 @@
 import numpy as np
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import lru_cache, partial
 from sksurv.metrics import integrated_brier_score
-from utils import fill_tree, parse_tree, read_dataset, Tree
-from utils import DIRECTORY, ORIGINAL_DIRECTORY
+from sksurv.nonparametric import CensoringDistributionEstimator
+from arena import arena_path, attach, attach_split, attach_step_function, DatasetArena
+from bootstrap import bootstrap_option, bootstrap_replicates, cached_resample_counts, resample_counts, BOOTSTRAP_METRICS
+from folds import load_split
+from record_log import follow_record_log, POLL_INTERVAL
+from results_store import add_results, results_row, write_results
+from step_6_run_streed import prune_results
+from predicates import leaf_assignment, survival_arrays
+from utils import fill_tree, nelson_aalen, parse_tree, phase, profiled, step_profile, Tree
+from utils import DIRECTORY, ORIGINAL_DIRECTORY, PROFILER
+
+# The directory to which the profile of this step is written
+PROFILE_DIRECTORY = f"{DIRECTORY}/output"
+
+# The number of processes to evaluate trees with
+WORKERS = os.cpu_count()
+
+# How the Brier score is integrated over time
+# "exact" integrates the piecewise-constant Brier score between its jump points, "grid" uses sksurv's trapezoid rule on a fixed grid of times
+IBS_MODE = "exact"
+
+# The quantiles of the test times at which the cumulative/dynamic AUC is calculated
+AUC_QUANTILES = [0.25, 0.5, 0.75]
+
+# Groups instances by the risk predicted by their leaf, where a higher theta means a higher risk
+# Returns the risk group of each instance, numbered in increasing order of risk
+#
+# root          The tree to evaluate the instances with
+# instances     The instances to group
+def risk_groups(root, instances):
+    leaves, leaf_ids = leaf_assignment(root, instances)
+    thetas = np.array([leaf.theta for leaf in leaves], dtype=float)
+    _, buckets = np.unique(thetas[leaf_ids], return_inverse=True)
+    return buckets
+
+# Counts the pairs (i, j) with T_i < T_j for a set of cases i, split by whether i has a higher (concordant), equal (tied) or lower (discordant) risk than j
+# For each risk group, the instances that outlive each case are counted with binary search on the sorted times of the group
+# Returns the counts as Python ints, or as weighted sums if weights are given
+#
+# times         The time of each instance
+# order         The order that sorts the instances by time
+# buckets       The risk group of each instance
+# cases         The mask of the instances that are cases
+# weights       The weight of each case, or None to count every pair once
+def pair_counts(times, order, buckets, cases, weights=None):
+    sorted_times, sorted_buckets = times[order], buckets[order]
+    case_times, case_buckets = times[cases], buckets[cases]
+
+    cc = tr = dc = 0
+    for bucket in range(buckets.max() + 1 if len(buckets) else 0):
+        bucket_times = sorted_times[sorted_buckets == bucket]
+        survivors = len(bucket_times) - np.searchsorted(bucket_times, case_times, side="right")
+        if weights is not None:
+            survivors = survivors * weights
+
+        cc += survivors[case_buckets > bucket].sum().item()
+        tr += survivors[case_buckets == bucket].sum().item()
+        dc += survivors[case_buckets < bucket].sum().item()
+
+    return cc, tr, dc
 
 # Calculates the Harrell's C-index (concordance) for a certain tree
 #
 # root          The tree to evaluate the instances with
 # instances     The instances to calculate the concordance with
-def calculate_concordance(root, instances, method="leblanc"):
-    # Group the instances together based on their theta
-    buckets = {}
-    
+# order         The order that sorts the instances by time, if it has already been computed
+def calculate_concordance(root, instances, method="leblanc", order=None):
     if True or method == "leblanc":
-        for inst in instances:
-            theta, _, _ = root.classify(inst)
-            if theta not in buckets:
-                buckets[theta] = [[], [], []] # [censored, death, all]
-            buckets[theta][inst.event].append(inst)
-            buckets[theta][2].append(inst)
-        buckets = [buckets[key] for key in sorted(buckets.keys())]
-        for i in range(len(buckets)):
-            for j in range(3):
-                buckets[i][j] = sorted(buckets[i][j], key=lambda x: x.time)
-
-        # Apply binary search to compute the amount of discordance and concordant pairs efficiently
-        cc = tr = dc = 0
-        for i in range(len(buckets)):
-            for j in range(len(buckets)):
-                for inst_i in buckets[i][2]:
-                    a, b = 0, len(buckets[j][1])
-                    while a < b:
-                        mid = (a + b) // 2
-                        if buckets[j][1][mid].time < inst_i.time:
-                            a = mid + 1
-                        else:
-                            b = mid
-
-                    if i < j:
-                        cc += a
-                    elif i == j:
-                        tr += a
-                    else:
-                        dc += a
+        # Group the instances together based on the theta of their leaf
+        buckets = risk_groups(root, instances)
+        times, events = survival_arrays(instances)
+        if order is None:
+            order = np.argsort(times, kind="stable")
+
+        # For each death, count the instances in each bucket that survived it
+        cc, tr, dc = pair_counts(times, order, buckets, events == 1)
 
         # Return C-index
         if cc + tr + dc:
@@ -52,18 +91,99 @@ def calculate_concordance(root, instances, method="leblanc"):
         # CTree does not generate a theta, but a kaplan meier distribution in the leaf node, so when comparing to CTree, the actual distributions need to be compared.
         raise NotImplementedError()
 
+# Calculates Uno's C-index for a certain tree, truncated at the end of the integration range of the context
+# Every death before the truncation time is weighted by the inverse of the squared probability of not being censored before it
+#
+# root          The tree to evaluate the instances with
+# context       The evaluation context of the train- and test-set
+# name          Either "train" or "test"
+def calculate_uno_concordance(root, context, name):
+    buckets = risk_groups(root, context.instances[name])
+    times, _ = survival_arrays(context.instances[name])
+    weights = context.uno_weights[name]
+    cases = weights > 0
+
+    cc, tr, dc = pair_counts(times, context.orders[name], buckets, cases, weights[cases])
+    if cc + tr + dc:
+        return (cc + 0.5 * tr) / (cc + tr + dc)
+    return 1
+
+# Calculates the cumulative/dynamic AUC of a certain tree at each horizon of the context
+# At horizon t, the deaths up to t (weighted by the inverse probability of not being censored before them) are compared with the instances that outlive t
+# Returns a list with the AUC at each horizon
+#
+# root          The tree to evaluate the instances with
+# context       The evaluation context of the train- and test-set
+# name          Either "train" or "test"
+def calculate_cumulative_dynamic_auc(root, context, name):
+    buckets = risk_groups(root, context.instances[name])
+    times, _ = survival_arrays(context.instances[name])
+    weights = context.auc_weights[name]
+    num_buckets = buckets.max() + 1 if len(buckets) else 0
+
+    # Per horizon and risk group, sum the weights of the deaths up to the horizon and count the instances that outlive it
+    positions = np.searchsorted(context.horizons, times, side="left")
+    cases = np.zeros((len(context.horizons) + 1, num_buckets))
+    ended = np.zeros((len(context.horizons) + 1, num_buckets))
+    np.add.at(cases, (positions, buckets), weights)
+    np.add.at(ended, (positions, buckets), 1)
+    cases = np.cumsum(cases, axis=0)[:-1]
+    controls = np.bincount(buckets, minlength=num_buckets)[None, :] - np.cumsum(ended, axis=0)[:-1]
+
+    # Cases are concordant with the controls in lower risk groups, and tied with those in the same risk group
+    lower_controls = np.cumsum(controls, axis=1) - controls
+    numerators = (cases * (lower_controls + 0.5 * controls)).sum(axis=1)
+    denominators = cases.sum(axis=1) * controls.sum(axis=1)
+    return [numerator / denominator if denominator > 0 else 0.5 for numerator, denominator in zip(numerators.tolist(), denominators.tolist())]
+
 # Calculates the Integrated Brier Score for a certain tree
+# The leaves of the tree must have been labeled with the train-set of the context
 #
 # root              The tree to evaluate the instances with
-# train_instances   The train instances used to create the tree
-# test_instances    The train instances used to test the tree
-def calculate_integrated_brier_score(root, train_instances, test_instances, method='leblanc'):
-    # Drop test instances that appear after the latest train instance (ideally just a few)
-    max_train_time = max(inst.time for inst in train_instances)
-    test_instances = [inst for inst in test_instances if inst.time < max_train_time]
+# context           The evaluation context of the train- and test-set
+# mode              Either "exact" or "grid" (see `IBS_MODE`)
+def calculate_integrated_brier_score(root, context, method='leblanc', mode=IBS_MODE):
+    leaves, leaf_ids = root.apply(context.test_instances)
+    leaf_ids = leaf_ids[context.keep]
 
+    if mode == "exact":
+        return exact_integrated_brier_score(leaves, leaf_ids, method, context)
+
+    # Create survival distribution estimates for each leaf, and give each test instance the estimate of its leaf
+    estimates = context.leaf_survival_matrix(leaves, "grid", method)[leaf_ids]
+
+    # Use sksurv's IBS method
+    score = integrated_brier_score(context.train_formatted, context.test_formatted, estimates, context.grid)
+    return score
+
+# Calculates the Integrated Brier Score exactly, for trees whose leaves predict step-shaped survival distributions
+# Between consecutive jump points of the leaf distributions, the censoring distribution and the test times, the Brier score is constant,
+# so it is evaluated once per interval and summed per leaf instead of per instance
+#
+# leaves            The leaves of the tree
+# leaf_ids          The index of the leaf of each (kept) test instance
+# method            Either "leblanc" or "kaplan_meier"
+# context           The evaluation context of the train- and test-set
+def exact_integrated_brier_score(leaves, leaf_ids, method, context):
+    # Per leaf and point, sum the weights of the deaths so far and count the instances still alive
+    num_points = len(context.points)
+    cases = np.zeros((len(leaves), num_points + 1))
+    ended = np.zeros((len(leaves), num_points + 1))
+    np.add.at(cases, (leaf_ids, context.positions), context.case_weights)
+    np.add.at(ended, (leaf_ids, context.positions), 1)
+    cases = np.cumsum(cases, axis=1)[:, :-1]
+    controls = np.bincount(leaf_ids, minlength=len(leaves))[:, None] - np.cumsum(ended, axis=1)[:, :-1]
+
+    estimates = context.leaf_survival_matrix(leaves, "points", method)
+    brier_scores = (np.square(estimates) * cases + np.square(1 - estimates) * controls * context.control_weights).sum(axis=0) / len(leaf_ids)
+    return float(np.dot(brier_scores, context.widths) / (context.upper - context.lower))
+
+# Returns the time range over which the Brier score is integrated, and the grid of times used to integrate it with the trapezoid rule
+#
+# test_times    The times of the test instances
+def integration_range(test_times):
     # Get the non-extreme test-instance-times
-    times = sorted(set([inst.time for inst in test_instances]))
+    times = np.unique(test_times).tolist()
         
     if len(times) >= 10:
         lower = times[len(times) // 10]
@@ -78,38 +198,289 @@ def calculate_integrated_brier_score(root, train_instances, test_instances, meth
         times = [lower + j * (upper - lower) / 100 for j in range(101)]
     else:
         times = np.arange(lower, upper)
-    
 
-    # Create survival distribution estimates for each test instance
-    estimates = []
-    estimates_per_leaf = {}
-    for inst in test_instances:
-        _, km_survival_distribution, leblanc_survival_distribution = root.classify(inst)
-        distribution = leblanc_survival_distribution if method == 'leblanc' else km_survival_distribution
+    return lower, upper, np.asarray(times)
 
-        if distribution not in estimates_per_leaf:
-            estimate = []
-            for t in times:
-                estimate.append(distribution(t))
-            estimates_per_leaf[distribution] = estimate
-        estimates.append(estimates_per_leaf[distribution])
+# Returns how much lower a score (e.g. an error or integrated Brier score) is than that of the base tree, relative to the score of the base tree
+# Returns 1 if the base tree scores (nearly) zero, and 0 if the difference is negligible
+#
+# value         The score of the tree
+# base_value    The score of the base tree
+def relative_score(value, base_value):
+    score = 1
+    if base_value > 1e-6:
+        score = 1 - value / base_value
+    if abs(score) < 1e-6:
+        score = 0
+    return score
 
-    # Format all instances to structured array
-    train_instances_formatted = np.array([(inst.event, inst.time) for inst in train_instances], dtype=[("event", "?"), ("time", "f4")])
-    test_instances_formatted = np.array([(inst.event, inst.time) for inst in test_instances], dtype=[("event", "?"), ("time", "f4")])
+# Returns the instances of a dataset or of a section of one of its folds, together with their Nelson-Aalen estimator
+# Inside worker processes, both are read from the arena published by the main process
+#
+# filename      The filename relative to the original dataset directory
+# arena_name    The name of the arena to attach to, or None to read the dataset directly
+def load_instances(filename, arena_name=None):
+    if arena_name is None:
+        instances = load_split(ORIGINAL_DIRECTORY, filename)
+        return instances, nelson_aalen(instances)
+    return attach_split(arena_name, filename), attach_step_function(arena_name, f"hazard/{filename}")
 
-    # Use sksurv's IBS method
-    score = integrated_brier_score(train_instances_formatted, test_instances_formatted, np.asarray(estimates), np.asarray(times))
-    return score
+# Everything that is shared by the trees evaluated on the same train- and test-set, computed once per process
+# This covers the instances and their hazard functions, the time-sorted arrays, the times and censoring weights of the integrated Brier score,
+# the hazard function at those times, the weights of Uno's C-index and the cumulative/dynamic AUC, and the scores of the base tree
+class EvaluationContext:
+    def __init__(self, train_filename, test_filename, arena_name=None):
+        self.train_filename, self.test_filename = train_filename, test_filename
+        self.instances = {}
+        self.hazard_functions = {}
+        self.orders = {}
+        for name, filename in [("train", train_filename), ("test", test_filename)]:
+            self.instances[name], self.hazard_functions[name] = load_instances(filename, arena_name)
+            self.orders[name] = np.argsort(survival_arrays(self.instances[name])[0], kind="stable")
 
-def main():
-    for algorithm in ["streed", "ctree", "ost"]:
-        print(f"\n\033[33;1mEvaluating {algorithm.upper()}'s output...\033[0m")
-        
-        # Survival distribution method
-        sd_method = "kaplan_meier"#'kaplan_meier' if algorithm == 'ctree' else 'leblanc'
+        self.train_instances, self.test_instances = self.instances["train"], self.instances["test"]
+        self.train_hazard_function = self.hazard_functions["train"]
+        train_times, train_events = survival_arrays(self.train_instances)
+        test_times, test_events = survival_arrays(self.test_instances)
+
+        # Drop test instances that appear after the latest train instance (ideally just a few)
+        self.keep = test_times < train_times.max()
+        test_times, test_events = test_times[self.keep], test_events[self.keep]
+        self.lower, self.upper, self.grid = integration_range(test_times)
+
+        # Format all instances to structured array
+        self.train_formatted = np.empty(len(train_times), dtype=[("event", "?"), ("time", "f4")])
+        self.train_formatted["event"], self.train_formatted["time"] = train_events, train_times
+        self.test_formatted = np.empty(len(test_times), dtype=[("event", "?"), ("time", "f4")])
+        self.test_formatted["event"], self.test_formatted["time"] = test_events, test_times
+
+        # Every leaf distribution labeled on the train-set can only change at 0 or at a train time, so together with the test times these are all the jump points
+        points = np.unique(np.concatenate([[0.0], np.asarray(train_times, dtype=float), np.asarray(test_times, dtype=float)]))
+        self.points = np.concatenate([[self.lower], points[(points > self.lower) & (points < self.upper)]])
+        self.widths = np.diff(np.append(self.points, self.upper))
+        self.positions = np.searchsorted(self.points, test_times, side="left")
+
+        # Inverse probability of censoring weights of the test deaths and of the points, with the censoring distribution estimated like sksurv does
+        train_formatted = np.empty(len(train_times), dtype=[("event", "?"), ("time", "f8")])
+        train_formatted["event"], train_formatted["time"] = train_events, train_times
+        censoring = CensoringDistributionEstimator().fit(train_formatted)
+        self.censoring = censoring
+        with np.errstate(divide="ignore"):
+            self.case_weights = np.where(test_events == 1, 1 / censoring.predict_proba(np.asarray(test_times, dtype=float)), 0)
+            self.control_weights = 1 / censoring.predict_proba(self.points)
+        self.case_weights[~np.isfinite(self.case_weights)] = 0
+        self.control_weights[~np.isfinite(self.control_weights)] = 0
+
+        # The hazard function of the train-set at the times of both integration modes
+        self.times = {"grid": self.grid, "points": self.points}
+        self.hazards = {key: self.train_hazard_function.evaluate(times) for key, times in self.times.items()}
+
+        # Weights of the deaths for Uno's C-index (truncated at the end of the integration range) and for the AUC at each horizon
+        self.horizons = np.quantile(test_times, AUC_QUANTILES)
+        self.uno_weights = {}
+        self.auc_weights = {}
+        for name in ["train", "test"]:
+            times, events = survival_arrays(self.instances[name])
+            self.uno_weights[name] = np.square(self.inverse_censoring_weights(times, events, self.upper, inclusive=False))
+            self.auc_weights[name] = self.inverse_censoring_weights(times, events, self.horizons[-1], inclusive=True)
+
+        self.base_tree = Tree(None, None, None, self.train_instances, self.train_hazard_function)
+        self.base_scores = {}
+
+    # Returns the inverse probability of censoring weight of each death up to a time, and zero for all other instances
+    #
+    # times         The time of each instance
+    # events        The event indicator of each instance
+    # end           The time after which deaths are not weighted
+    # inclusive     Whether deaths at the end time itself are weighted
+    def inverse_censoring_weights(self, times, events, end, inclusive):
+        mask = (events == 1) & ((times <= end) if inclusive else (times < end))
+        weights = np.zeros(len(times))
+        if mask.any():
+            with np.errstate(divide="ignore"):
+                weights[mask] = 1 / self.censoring.predict_proba(np.asarray(times[mask], dtype=float))
+        weights[~np.isfinite(weights)] = 0
+        return weights
+
+    # Evaluates the survival distribution of each leaf at the grid or at the jump points
+    # Leblanc distributions based on the hazard function of the train-set reuse its precomputed values
+    #
+    # leaves    The leaves to evaluate
+    # key       Either "grid" or "points"
+    # method    Either "leblanc" or "kaplan_meier"
+    def leaf_survival_matrix(self, leaves, key, method):
+        if method == "leblanc" and all(leaf.leblanc_distribution.hazard_function is self.train_hazard_function for leaf in leaves):
+            return np.exp(-np.array([leaf.theta * self.hazards[key] for leaf in leaves]).reshape(len(leaves), -1))
+        return Tree.leaf_survival_matrix(leaves, self.times[key], method)
+
+    # Returns the integrated Brier score of the base tree
+    def base_integrated_brier_score(self):
+        if "ibs" not in self.base_scores:
+            self.base_scores["ibs"] = calculate_integrated_brier_score(self.base_tree, self, method='kaplan_meier')
+        return self.base_scores["ibs"]
+
+    # Returns the error of the base tree on the train- or test-set
+    #
+    # name      Either "train" or "test"
+    def base_error(self, name):
+        if name not in self.base_scores:
+            self.base_tree.fill_summaries(self.instances[name], self.hazard_functions[name], keep_times=False)
+            self.base_scores[name] = self.base_tree.calculate_error(self.hazard_functions[name])
+        return self.base_scores[name]
 
-        # Read trees
+# Returns the evaluation context of a train- and test-set, which is only computed once per process
+#
+# train_filename    The filename of the train-set
+# test_filename     The filename of the test-set
+# arena_name        The name of the arena to attach to, or None to read the datasets directly
+@lru_cache(maxsize=8)
+def evaluation_context(train_filename, test_filename, arena_name=None):
+    return EvaluationContext(train_filename, test_filename, arena_name)
+
+# Returns the key under which the resample counts of a test-set are published
+#
+# test_filename     The filename of the test-set
+# replicates        The number of bootstrap replicates
+def resample_counts_key(test_filename, replicates):
+    return f"bootstrap/{replicates}/{test_filename}"
+
+# Publishes the datasets and hazard functions needed to evaluate a list of trees, so worker processes can share them
+# With bootstrapping, the resample counts of every test-set are published as well, so they are drawn once instead of once per tree
+#
+# arena         The arena to publish to
+# lines         The lines of the trees file (without header)
+# replicates    The number of bootstrap replicates per tree
+def publish_datasets(arena, lines, replicates=0):
+    for line in lines:
+        settings = eval(line.split(";")[1])
+        for filename in [settings["file"], settings["test-file"]]:
+            if f"hazard/{filename}" in arena.keys:
+                continue
+            instances = load_split(ORIGINAL_DIRECTORY, filename)
+            arena.publish_dataset(ORIGINAL_DIRECTORY, filename)
+            arena.publish_step_function(f"hazard/{filename}", nelson_aalen(instances))
+            if replicates > 0 and filename == settings["test-file"]:
+                arena.publish(resample_counts_key(filename, replicates), {"counts": resample_counts(len(instances), filename, replicates)})
+
+# Returns the resample counts of the test-set of a context, from the arena if it was published there and otherwise drawn once per process
+#
+# context       The evaluation context of the train- and test-set
+# replicates    The number of bootstrap replicates
+# arena_name    The name of the arena to read the counts from, or None to draw them
+def test_resample_counts(context, replicates, arena_name=None):
+    if arena_name is not None and os.path.exists(arena_path(arena_name, resample_counts_key(context.test_filename, replicates))):
+        return attach(arena_name, resample_counts_key(context.test_filename, replicates))["counts"]
+    return cached_resample_counts(len(context.test_instances), context.test_filename, replicates)
+
+# Evaluates a single tree of a trees file
+# Returns the line to write to the output file, the id, settings and results of the tree for the results table,
+# and the bootstrap replicates of the test scores (or None if bootstrapping is disabled)
+#
+# line          The line of the trees file
+# sd_method     The survival distribution method
+# arena_name    The name of the arena to read datasets from, or None to read them directly
+# replicates    The number of bootstrap replicates (0 disables bootstrapping)
+def evaluate_line(line, sd_method, arena_name=None, replicates=0):
+    # Parse line
+    null = None
+    id, settings, time_duration, flat_tree = [eval(j) for j in line.split(";")]
+    train_filename = settings["file"]
+    test_filename = settings["test-file"]
+
+    results = {}
+
+    # Parse given tree and determine labels using training set
+    tree = parse_tree(flat_tree)
+    with phase("load"):
+        context = evaluation_context(train_filename, test_filename, arena_name)
+    with phase("fill_tree"):
+        fill_tree(tree, context.train_instances, context.train_hazard_function)
+
+    # Store time
+    results["runtime"] = time_duration
+
+    # Count number of nodes
+    results["num_nodes"] = tree.size()
+
+    # Calculate the Integrated Brier Score ratio
+    with phase("IBS"):
+        base_tree_ibs = context.base_integrated_brier_score()
+        curr_tree_ibs = calculate_integrated_brier_score(tree, context, method=sd_method)
+    results["integrated_brier_score_ratio"] = relative_score(curr_tree_ibs, base_tree_ibs)
+    results["auc_horizons"] = context.horizons.tolist()
+
+    # For both the training set and the testing set
+    for name in ["train", "test"]:
+        instances, hazard_function = context.instances[name], context.hazard_functions[name]
+
+        # Fill the tree with summaries of the instances, keeping the labels determined on the training set
+        with phase("fill_tree"):
+            tree.fill_summaries(instances, hazard_function, keep_times=False)
+            tree.calculate_error(hazard_function)
+
+        print(tree)
+
+        # Calculate the objective score
+        with phase("fill_tree"):
+            objective_score = relative_score(tree.error, context.base_error(name))
+
+        # Calculate Harrell's C-index, Uno's C-index and the cumulative/dynamic AUC
+        with phase("concordance"):
+            results[name] = {
+                "objective_score": objective_score,
+                "concordance_score": calculate_concordance(tree, instances, method=sd_method, order=context.orders[name]),
+                "uno_concordance_score": calculate_uno_concordance(tree, context, name),
+                "cumulative_dynamic_auc": calculate_cumulative_dynamic_auc(tree, context, name),
+            }
+
+    # Push results on a single line
+    info_line = ";".join(line.split(";")[:-2])
+    results_line = str(results)
+    new_line = f"{info_line};{results_line}"
+    print(f"\033[35;1m{info_line}\033[30;1m;\033[34;1m{results_line}\033[0m")
+
+    bootstrap = None
+    if replicates > 0:
+        with phase("bootstrap"):
+            bootstrap = bootstrap_replicates(tree, context, sd_method, test_resample_counts(context, replicates, arena_name))
+
+    return new_line, (id, settings, results), bootstrap
+
+# Evaluates a single tree in a worker process, like `evaluate_line`
+# Returns the evaluation together with the phases measured by the worker since its previous tree, which the main process adds to its own profile
+#
+# line          The line of the trees file
+# sd_method     The survival distribution method
+# arena_name    The name of the arena to read datasets from, or None to read them directly
+# replicates    The number of bootstrap replicates (0 disables bootstrapping)
+def evaluate_line_profiled(line, sd_method, arena_name=None, replicates=0):
+    evaluation = evaluate_line(line, sd_method, arena_name, replicates)
+    return evaluation, PROFILER.drain()
+
+# Writes the bootstrap replicates of the trees of an algorithm, with one row per tree (in the order of the output file) and one column per replicate
+#
+# algorithm     The name of the algorithm
+# ids           The id of each tree
+# replicates    The replicates of each tree
+def write_bootstrap_replicates(algorithm, ids, replicates):
+    if not os.path.exists(f"{DIRECTORY}/output/bootstrap"):
+        os.makedirs(f"{DIRECTORY}/output/bootstrap")
+
+    arrays = {metric: np.array([j[metric] for j in replicates], dtype=float).reshape(len(replicates), -1 if replicates else 0) for metric in BOOTSTRAP_METRICS}
+    np.savez_compressed(f"{DIRECTORY}/output/bootstrap/{algorithm}_bootstrap.npz", ids=np.array(ids), **arrays)
+
+# Evaluates the trees of an algorithm and writes the results, both as an output file and to the results table
+#
+# algorithm     The name of the algorithm, whose trees are read from "output/<algorithm>_trees.csv"
+# replicates    The number of bootstrap replicates per tree (0 disables bootstrapping)
+def evaluate_algorithm(algorithm, replicates=0):
+    print(f"\n\033[33;1mEvaluating {algorithm.upper()}'s output...\033[0m")
+
+    # Survival distribution method
+    sd_method = "kaplan_meier"#'kaplan_meier' if algorithm == 'ctree' else 'leblanc'
+
+    # Read trees
+    with phase("load"):
         f = open(f"{DIRECTORY}/output/{algorithm}_trees.csv")
         #f = open(f"{DIRECTORY}/tree-files/{algorithm}_trees_depth4_hyper_synthetic.csv")
         #f = open(f"{DIRECTORY}/tree-files/{algorithm}_trees_depth4_hyper_real.csv")
@@ -117,82 +488,157 @@ def main():
         lines = f.read().strip().split("\n")
         f.close()
 
-        new_lines = [";".join(lines[0].split(";")[:-2] + ["results"])]
+    new_lines = [";".join(lines[0].split(";")[:-2] + ["results"])]
+    evaluations = []
 
+    if WORKERS > 1:
+        # Publish every dataset once, and let the workers attach to it
+        with DatasetArena() as arena, ProcessPoolExecutor(WORKERS) as executor:
+            with phase("load"):
+                publish_datasets(arena, lines[1:], replicates)
+            # Neighbouring lines usually share their train- and test-set, so they are handed out in chunks to reuse the evaluation contexts
+            chunksize = max(1, len(lines[1:]) // (4 * WORKERS))
+            for evaluation, phases in executor.map(partial(evaluate_line_profiled, sd_method=sd_method, arena_name=arena.name, replicates=replicates), lines[1:], chunksize=chunksize):
+                evaluations.append(evaluation)
+                PROFILER.merge(phases)
+    else:
         for line in lines[1:]:
-            # Parse line
-            null = None
-            id, settings, time_duration, flat_tree = [eval(j) for j in line.split(";")]
-            train_filename = settings["file"]
-            test_filename = settings["test-file"]
-
-            results = {}
-
-            # Parse given tree and determine labels using training set
-            tree = parse_tree(flat_tree)
-            train_instances = fill_tree(tree, f"{ORIGINAL_DIRECTORY}/{train_filename}.txt")
-            test_instances = read_dataset(f"{ORIGINAL_DIRECTORY}/{test_filename}.txt")
-            base_tree = Tree(None, None, None, train_instances)
-
-            # Store time
-            results["runtime"] = time_duration
-
-            # Count number of nodes
-            results["num_nodes"] = tree.size()
-
-            # Calculate the Integrated Brier Score ratio
-            base_tree_ibs = calculate_integrated_brier_score(base_tree, train_instances, test_instances, method='kaplan_meier')
-            curr_tree_ibs = calculate_integrated_brier_score(tree, train_instances, test_instances, method=sd_method)
-            ibs_ratio = 1
-            if base_tree_ibs > 1e-6:
-                ibs_ratio = 1 - curr_tree_ibs / base_tree_ibs
-            if abs(ibs_ratio) < 1e-6:
-                ibs_ratio = 0
-            results["integrated_brier_score_ratio"] = ibs_ratio
-
-            # For both the training set and the testing set
-            for name, filename, instances in [("train", train_filename, train_instances), ("test", test_filename, test_instances)]:
-                instances = fill_tree(tree, f"{ORIGINAL_DIRECTORY}/{filename}.txt")
-
-                # Fill tree and base tree with instances
-                for t in [tree, base_tree]:
-                    t.clear_instances()
-                    for inst in instances:
-                        t.classify(inst, True)
-                    t.calculate_error()
-
-                print(tree)
-
-                # Calculate the objective score
-                base_tree_error = base_tree.error
-                tree_error = tree.error
-                objective_score = 1
-                if base_tree_error > 1e-6:
-                    objective_score = 1 - tree_error / base_tree_error
-                if abs(objective_score) < 1e-6:
-                    objective_score = 0
-
-                # Calculate Harrell's C-index
-                concordance_score = calculate_concordance(tree, instances, method=sd_method)
-
-                results[name] = {
-                    "objective_score": objective_score,
-                    "concordance_score": concordance_score,
-                }
-
-            # Push results on a single line
-            info_line = ";".join(line.split(";")[:-2])
-            results_line = str(results)
-            new_line = f"{info_line};{results_line}"
-            new_lines.append(new_line)
-            print(f"\033[35;1m{info_line}\033[30;1m;\033[34;1m{results_line}\033[0m")
-
-        # Write results to file
-        f = open(f"{DIRECTORY}/output/{algorithm}_output.csv", "w")
-        f.write("\n".join(new_lines))
-        f.close()
+            evaluations.append(evaluate_line(line, sd_method, replicates=replicates))
+    write_evaluations(algorithm, new_lines[0], [int(line.split(";")[0]) for line in lines[1:]], evaluations)
+
+# Writes the evaluations of the trees of an algorithm, both as an output file and to the results table
+#
+# algorithm     The name of the algorithm
+# header        The header of the output file
+# ids           The id of each tree
+# evaluations   The evaluation of each tree, as returned by `evaluate_line`
+@profiled("write")
+def write_evaluations(algorithm, header, ids, evaluations):
+    new_lines = [header] + [new_line for new_line, _, _ in evaluations]
+
+    # Replicates of an earlier run with bootstrapping would no longer match the output file
+    replicates = [j for _, _, j in evaluations]
+    if replicates and all(j is not None for j in replicates):
+        write_bootstrap_replicates(algorithm, ids, replicates)
+    elif os.path.exists(f"{DIRECTORY}/output/bootstrap/{algorithm}_bootstrap.npz"):
+        os.remove(f"{DIRECTORY}/output/bootstrap/{algorithm}_bootstrap.npz")
+
+    # Write results to file
+    f = open(f"{DIRECTORY}/output/{algorithm}_output.csv", "w")
+    f.write("\n".join(new_lines))
+    f.close()
+
+    # Store the results as a flat table as well, for the steps that process them
+    write_results(algorithm, [results_row(algorithm, *record) for _, record, _ in evaluations])
+
+# Evaluates the trees of algorithms while their solvers are still running, by following the record logs that `run_solvers.py` appends to
+# Every record is handed to a worker as soon as it appears, and the results of every evaluated tree are added to the results table right away
+# Once the log of an algorithm is finished and all of its trees are evaluated, its output file is written in the order of the settings,
+# with ids numbered like those of its trees file
+#
+# algorithms    The names of the algorithms to follow
+# replicates    The number of bootstrap replicates per tree (0 disables bootstrapping)
+# workers       The number of processes to evaluate trees with, which `run_solvers.py` takes from the CPU budget of the solvers
+def evaluate_streams(algorithms, replicates=0, workers=WORKERS):
+    sd_method = "kaplan_meier"
+    logs = {algorithm: follow_record_log(algorithm) for algorithm in algorithms}
+    records = {algorithm: {} for algorithm in algorithms}
+    evaluations = {algorithm: {} for algorithm in algorithms}
+    pending = {}
+    for algorithm in algorithms:
+        write_results(algorithm, [])
+
+    with DatasetArena() as arena, ProcessPoolExecutor(max(1, workers)) as executor:
+        while logs or pending:
+            # Hand out every record that has appeared since the last time
+            received = False
+            for algorithm, log in [*logs.items()]:
+                for record in log:
+                    if record is None:
+                        break
+                    index, record = record
+                    records[algorithm][index] = record
+                    line = f"{index};{record}"
+                    with phase("load"):
+                        publish_datasets(arena, [line], replicates)
+                    pending[executor.submit(evaluate_line_profiled, line, sd_method, arena.name, replicates)] = (algorithm, index)
+                    received = True
+                else:
+                    del logs[algorithm]
+
+            # Store the evaluations that finished in the meantime
+            if pending:
+                done, _ = wait(pending, timeout=0 if received else POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                rows = {}
+                for future in done:
+                    algorithm, index = pending.pop(future)
+                    evaluations[algorithm][index], phases = future.result()
+                    PROFILER.merge(phases)
+                    rows.setdefault(algorithm, []).append(results_row(algorithm, *evaluations[algorithm][index][1]))
+                for algorithm, algorithm_rows in rows.items():
+                    add_results(algorithm, algorithm_rows)
+            elif not received:
+                time.sleep(POLL_INTERVAL)
+
+            # Write the output of the algorithms that are done
+            busy = set(logs) | {algorithm for algorithm, _ in pending.values()}
+            for algorithm in [j for j in evaluations if j not in busy]:
+                if algorithm == "streed":
+                    prune_stream_evaluations(records[algorithm], evaluations[algorithm], sd_method, replicates)
+                write_stream_evaluations(algorithm, evaluations.pop(algorithm))
+
+# Replaces the evaluations of the STreeD runs that `run_solvers.py` leaves out of its trees file, since a serial run of step 6 would have skipped them
+# due to the Pareto front, by those of the skipped runs
+#
+# records       The record of each run, by index of its settings
+# evaluations   The evaluation of each run, by index of its settings
+# sd_method     The survival distribution method
+# replicates    The number of bootstrap replicates per tree (0 disables bootstrapping)
+def prune_stream_evaluations(records, evaluations, sd_method, replicates):
+    indices = sorted(records)
+    pruned = prune_results([(records[j].split(";", 1)[0], records[j]) for j in indices])
+    for index, record in zip(indices, pruned):
+        if record != records[index]:
+            evaluations[index] = evaluate_line(f"{index};{record}", sd_method, replicates=replicates)
+
+# Writes the evaluations of a followed record log, numbering the trees in the order of their settings like `run_solvers.py` numbers the trees file
+#
+# algorithm     The name of the algorithm
+# evaluations   The evaluation of each tree, by index of its settings
+def write_stream_evaluations(algorithm, evaluations):
+    renumbered = []
+    for id, index in enumerate(sorted(evaluations)):
+        new_line, (_, settings, results), replicates = evaluations[index]
+        renumbered.append((f"{id};{new_line.split(';', 1)[1]}", (id, settings, results), replicates))
+    write_evaluations(algorithm, "id;settings;results", [*range(len(renumbered))], renumbered)
+    print(f"\033[33;1mEvaluated {algorithm.upper()}'s output\033[0m")
+
+# replicates    The number of bootstrap replicates per tree (0 disables bootstrapping)
+def main(replicates=0):
+    for algorithm in ["streed", "ctree", "ost"]:
+        evaluate_algorithm(algorithm, replicates)
 
     print("\033[32;1mDone!\033[0m")
 
 if __name__ == "__main__":
-    main()
+    # Usage: python step_9_evaluate_trees.py [--stream [--workers=<n>]] [--bootstrap[=<replicates>]] [<algorithm> ...]
+    # Without algorithms the trees of all algorithms are evaluated
+    # With --stream, the trees are evaluated while `run_solvers.py` creates them, until the solvers of all (or the given) algorithms are done,
+    # with n processes (by default one per CPU)
+    # With --bootstrap, the bootstrap replicates of the test scores of every tree are written to output/bootstrap as well
+    algorithms = [j for j in sys.argv[1:] if not j.startswith("--")]
+    replicates = bootstrap_option(sys.argv[1:])
+    workers = WORKERS
+    for arg in sys.argv[1:]:
+        if arg.startswith("--workers="):
+            workers = int(arg.split("=", 1)[1])
+    with step_profile("step_9_evaluate_trees", PROFILE_DIRECTORY):
+        if "--stream" in sys.argv[1:]:
+            evaluate_streams(algorithms or ["streed", "ctree", "ost"], replicates, workers)
+            print("\033[32;1mDone!\033[0m")
+        elif algorithms:
+            for algorithm in algorithms:
+                evaluate_algorithm(algorithm, replicates)
+            print("\033[32;1mDone!\033[0m")
+        else:
+            main(replicates)
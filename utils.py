@@ -1,11 +1,32 @@
+from bisect import bisect_right
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
 from math import log, exp
+import hashlib
+import json
+import numpy as np
 import os
+import sys
+import time
+import tracemalloc
 import warnings
 
+# The resource module only exists on Unix, elsewhere (e.g. Windows) the peak RSS is not recorded
+try:
+    import resource
+except ImportError:
+    resource = None
+
 DIRECTORY = os.path.realpath(os.path.dirname(__file__))
 ORIGINAL_DIRECTORY = f"{DIRECTORY}/datasets/original"
 NUMERIC_DIRECTORY = f"{DIRECTORY}/datasets/numeric"
 BINARY_DIRECTORY = f"{DIRECTORY}/datasets/binary"
+FOLDS_DIRECTORY = f"{DIRECTORY}/datasets/folds"
+CATALOG_FILE = f"{DIRECTORY}/datasets/catalog.csv"
+
+# The columns of the dataset catalog, which holds one row of metadata per converted dataset
+CATALOG_COLUMNS = ["dataset", "n_instances", "n_features", "n_binary_features", "censoring", "min_time", "max_time", "original_hash", "binary_hash"]
 
 # Reads the settings from a filename and returns them as maps
 # The file must be formatted with one JSON object on each individual line
@@ -32,6 +53,264 @@ def parse_line(line, sep=","):
 def files_in_directory(directory):
     return [j for j in os.listdir(directory) if os.path.isfile(f"{directory}/{j}")]
 
+# Returns the SHA-256 hash of the contents of a file
+#
+# filename      The path to the file
+def file_hash(filename):
+    h = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+# Whether phases also record their top allocators with tracemalloc, which makes allocation-heavy code a few times slower
+# Set the environment variable TRACE_ALLOCATIONS=1 to enable it, which also enables it in worker processes
+TRACE_ALLOCATIONS = os.environ.get("TRACE_ALLOCATIONS", "0") == "1"
+
+# The number of allocators that is kept per phase
+TOP_ALLOCATORS = 5
+
+# A phase or step is flagged as a regression when its wall time, CPU time or peak RSS grew by more than this fraction,
+# and by more than the minimum amounts below (so noise in very short phases is not flagged)
+REGRESSION_THRESHOLD = 0.1
+REGRESSION_MIN_SECONDS = 0.05
+REGRESSION_MIN_MEGABYTES = 10
+
+# Returns the peak resident set size in megabytes of this process, or of its largest finished child process if that is larger
+# Returns None where it is unavailable
+def peak_rss():
+    if resource is None:
+        return None
+    usage = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return usage / (1024 ** 2 if sys.platform == "darwin" else 1024)
+
+# Returns a snapshot of the memory allocated since tracing started, leaving out the snapshots of enclosing phases
+def allocation_snapshot():
+    return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+# Accumulates the wall time, CPU time, peak RSS and (optionally) the top allocators of named phases, such as "load", "fill_tree", "IBS",
+# "concordance" and "write", over all times they run
+# The CPU time only covers this process; phases that run in worker processes are measured there and merged with `merge`
+class Profiler:
+    def __init__(self):
+        self.phases = {}
+
+    # Measures a phase while the body of the with-statement runs
+    #
+    # name      The name of the phase
+    @contextmanager
+    def phase(self, name):
+        if TRACE_ALLOCATIONS and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        snapshot = allocation_snapshot() if tracemalloc.is_tracing() else None
+        wall_time, cpu_time = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            allocations = {}
+            if snapshot is not None:
+                for diff in allocation_snapshot().compare_to(snapshot, "lineno")[:TOP_ALLOCATORS]:
+                    allocations[str(diff.traceback[0])] = diff.size_diff
+            self.merge({name: {
+                "calls": 1,
+                "wall_time": time.perf_counter() - wall_time,
+                "cpu_time": time.process_time() - cpu_time,
+                "peak_rss": peak_rss(),
+                "allocations": allocations,
+            }})
+
+    # Returns a decorator that measures every call of a function as a phase
+    #
+    # name      The name of the phase
+    def profiled(self, name):
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.phase(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # Adds the measurements of phases (e.g. those of a worker process) to those of this profiler
+    # Times and calls are summed, the peak RSS is the largest one and the allocations are summed per line of code
+    #
+    # phases    The phases to add, as returned by `drain`
+    def merge(self, phases):
+        for name, measurements in phases.items():
+            phase = self.phases.setdefault(name, {"calls": 0, "wall_time": 0.0, "cpu_time": 0.0, "peak_rss": 0.0, "allocations": {}})
+            for key in ["calls", "wall_time", "cpu_time"]:
+                phase[key] += measurements[key]
+            if measurements["peak_rss"] is None or phase["peak_rss"] is None:
+                phase["peak_rss"] = None
+            else:
+                phase["peak_rss"] = max(phase["peak_rss"], measurements["peak_rss"])
+            for location, size in measurements["allocations"].items():
+                phase["allocations"][location] = phase["allocations"].get(location, 0) + size
+            # Only keep the largest allocators, so the measurements stay small
+            phase["allocations"] = dict(sorted(phase["allocations"].items(), key=lambda j: -j[1])[:4 * TOP_ALLOCATORS])
+
+    # Returns the measurements so far and starts over
+    def drain(self):
+        phases, self.phases = self.phases, {}
+        return phases
+
+# The profiler of this process, which the steps measure their phases with
+PROFILER = Profiler()
+
+# Measures a phase with the profiler of this process (see `Profiler.phase`)
+#
+# name      The name of the phase
+def phase(name):
+    return PROFILER.phase(name)
+
+# Measures every call of a function as a phase with the profiler of this process (see `Profiler.profiled`)
+#
+# name      The name of the phase
+def profiled(name):
+    return PROFILER.profiled(name)
+
+# Returns the path of the profile of a step
+#
+# step          The name of the step, such as "step_9_evaluate_trees"
+# directory     The directory of the outputs of the step
+def profile_path(step, directory):
+    return f"{directory}/{step}_profile.json"
+
+# Measures a whole step and writes its profile as JSON next to its outputs, keeping the profile of the previous run as "<step>_profile.previous.json"
+# Besides the phases measured meanwhile, the profile holds the wall time, the CPU time (including that of finished child processes) and the peak RSS of the step
+#
+# step          The name of the step, such as "step_9_evaluate_trees"
+# directory     The directory of the outputs of the step
+@contextmanager
+def step_profile(step, directory):
+    PROFILER.drain()
+    started = datetime.now().isoformat(timespec="seconds")
+    wall_time, times = time.perf_counter(), os.times()
+    try:
+        yield PROFILER
+    finally:
+        end_times = os.times()
+        cpu_time = sum(end_times[:4]) - sum(times[:4])
+        phases = PROFILER.drain()
+        for measurements in phases.values():
+            measurements["allocations"] = [
+                {"location": location, "size": size} for location, size in sorted(measurements["allocations"].items(), key=lambda j: -j[1])[:TOP_ALLOCATORS]
+            ]
+        profile = {
+            "step": step,
+            "arguments": sys.argv[1:],
+            "started": started,
+            "wall_time": time.perf_counter() - wall_time,
+            "cpu_time": cpu_time,
+            "peak_rss": peak_rss(),
+            "phases": phases,
+        }
+
+        os.makedirs(directory, exist_ok=True)
+        path = profile_path(step, directory)
+        if os.path.exists(path):
+            os.replace(path, path.replace("_profile.json", "_profile.previous.json"))
+        f = open(path, "w")
+        f.write(json.dumps(profile, indent=4))
+        f.close()
+
+# Returns the profiles of a run by step, from a profile file or from all profiles in a directory (and its subdirectories)
+#
+# path      The path to a profile file or to a directory
+def read_profiles(path):
+    paths = [path]
+    if os.path.isdir(path):
+        paths = sorted(f"{root}/{j}" for root, _, files in os.walk(path) for j in files if j.endswith("_profile.json"))
+
+    profiles = {}
+    for profile_file in paths:
+        f = open(profile_file)
+        profile = json.load(f)
+        f.close()
+        profiles[profile["step"]] = profile
+    return profiles
+
+# Returns the measurements of two runs that grew by more than the regression threshold, as (step, phase, measurement, old value, new value)
+# Steps and phases that only one of the runs has are not compared
+#
+# old_profiles  The profiles of the old run by step, as returned by `read_profiles`
+# new_profiles  The profiles of the new run by step
+def profile_regressions(old_profiles, new_profiles):
+    regressions = []
+    for step in sorted(set(old_profiles) & set(new_profiles)):
+        old, new = old_profiles[step], new_profiles[step]
+        pairs = [("total", old, new)] + [(j, old["phases"][j], new["phases"][j]) for j in sorted(set(old["phases"]) & set(new["phases"]))]
+        for name, old_measurements, new_measurements in pairs:
+            for key, minimum in [("wall_time", REGRESSION_MIN_SECONDS), ("cpu_time", REGRESSION_MIN_SECONDS), ("peak_rss", REGRESSION_MIN_MEGABYTES)]:
+                old_value, new_value = old_measurements[key], new_measurements[key]
+                if old_value is None or new_value is None:
+                    continue
+                if new_value > old_value * (1 + REGRESSION_THRESHOLD) and new_value - old_value > minimum:
+                    regressions.append((step, name, key, old_value, new_value))
+    return regressions
+
+# Prints the measurements of two runs side by side, with regressions in red and improvements in green
+# Returns the regressions, as returned by `profile_regressions`
+#
+# old_profiles  The profiles of the old run by step, as returned by `read_profiles`
+# new_profiles  The profiles of the new run by step
+def print_profile_comparison(old_profiles, new_profiles):
+    regressions = profile_regressions(old_profiles, new_profiles)
+    flagged = {j[:3] for j in regressions}
+    improvements = {j[:3] for j in profile_regressions(new_profiles, old_profiles)}
+    units = {"wall_time": "s", "cpu_time": "s", "peak_rss": "MB"}
+
+    for step in sorted(set(old_profiles) | set(new_profiles)):
+        if step not in old_profiles or step not in new_profiles:
+            print(f"\033[30m{step}: only in the {'new' if step in new_profiles else 'old'} run\033[0m")
+            continue
+        print(f"\033[35;1m{step}\033[0m")
+        old, new = old_profiles[step], new_profiles[step]
+        for name in ["total"] + sorted(set(old["phases"]) | set(new["phases"])):
+            if name != "total" and (name not in old["phases"] or name not in new["phases"]):
+                print(f"  \033[30m{name}: only in the {'new' if name in new['phases'] else 'old'} run\033[0m")
+                continue
+            old_measurements = old if name == "total" else old["phases"][name]
+            new_measurements = new if name == "total" else new["phases"][name]
+            columns = []
+            for key, unit in units.items():
+                color = "31;1" if (step, name, key) in flagged else "32" if (step, name, key) in improvements else "0"
+                old_value, new_value = [j if j is None else f"{j:.3f}" for j in (old_measurements[key], new_measurements[key])]
+                columns.append(f"\033[{color}m{key} {old_value or 'n/a'} -> {new_value or 'n/a'} {unit}\033[0m")
+            print(f"  {name:<12} " + "  ".join(columns))
+
+    for step, name, key, old_value, new_value in regressions:
+        growth = f"{new_value / old_value - 1:+.0%}" if old_value > 0 else "new"
+        print(f"\033[31;1mRegression: {step} {name} {key} grew from {old_value:.3f} to {new_value:.3f} ({growth})\033[0m")
+    return regressions
+
+# A step function given by the sorted times at which it changes and its value from each of these times onward
+# Before the first time, it takes its first value
+class StepFunction:
+    def __init__(self, keys, values):
+        self.keys = [*keys]
+        self.values = [*values]
+
+    def __call__(self, x):
+        idx = bisect_right(self.keys, x) - 1
+        return self.values[max(0, idx)]
+
+    # Returns the index of the value that the function takes at each of the given times
+    #
+    # xs    The times to look up
+    def indices(self, xs):
+        return np.maximum(0, np.searchsorted(np.asarray(self.keys), xs, side="right") - 1)
+
+    # Evaluates the function at many times at once
+    #
+    # xs    The times to evaluate the function at
+    def evaluate(self, xs):
+        return np.asarray(self.values)[self.indices(xs)]
+
+    # Returns the times at which the function may change value
+    def jump_times(self):
+        return self.keys
+
 def nelson_aalen(instances):
     ts = {}
     for inst in instances:
@@ -54,25 +333,7 @@ def nelson_aalen(instances):
         if died > 0:
             d[t] = sum
 
-    keys = [*d.keys()]
-
-    def f(x):
-        try:
-            return d[x]
-        except:
-            pass
-
-        a = 0
-        b = len(keys) - 1
-        while a != b:
-            mid = (a + b + 1) // 2
-            if keys[mid] > x:
-                b = mid - 1
-            else:
-                a = mid
-        return d[keys[a]]
-
-    return f
+    return StepFunction(d.keys(), d.values())
 
 def kaplan_meier(instances):
     ts = {}
@@ -93,29 +354,56 @@ def kaplan_meier(instances):
         at_risk -= died + left
         prev_t = t
 
-    keys = [*d.keys()]
-    def f(x):
-        try:
-            return d[x]
-        except:
-            pass
+    return StepFunction(d.keys(), d.values())
 
-        a = 0
-        b = len(keys) - 1
-        while a != b:
-            mid = (a + b + 1) // 2
-            if keys[mid] > x:
-                b = mid - 1
-            else:
-                a = mid
-        return d[keys[a]]
+# Computes the same estimator as `kaplan_meier`, from the times and events as arrays
+#
+# times     The time of each instance
+# events    The event indicator of each instance
+def kaplan_meier_from_arrays(times, events):
+    unique_times, inverse = np.unique(np.asarray(times), return_inverse=True)
+    totals = np.bincount(inverse, minlength=len(unique_times))
+    deaths = np.bincount(inverse[np.asarray(events) == 1], minlength=len(unique_times))
 
-    return f
+    d = {0: 1}
+    at_risk = len(inverse)
+    prev_t = 0
+    for t, total, died in zip(unique_times.tolist(), totals.tolist(), deaths.tolist()):
+        d[t] = d[prev_t] * (1 - died / at_risk)
+        at_risk -= total
+        prev_t = t
+
+    return StepFunction(d.keys(), d.values())
+
+# The survival distribution exp(-theta * H(t)) of a leaf, given the baseline hazard function H
+class LeblancDistribution:
+    def __init__(self, hazard_function, theta):
+        self.hazard_function = hazard_function
+        self.theta = theta
+
+    def __call__(self, t):
+        return exp(-self.theta * self.hazard_function(t))
+
+    # Evaluates the cumulative hazard theta * H(t) at many times at once
+    #
+    # xs    The times to evaluate the cumulative hazard at
+    def cumulative_hazard(self, xs):
+        if isinstance(self.hazard_function, StepFunction):
+            return self.theta * self.hazard_function.evaluate(xs)
+        return self.theta * np.array([self.hazard_function(x) for x in xs])
+
+    # Evaluates the distribution at many times at once
+    #
+    # xs    The times to evaluate the distribution at
+    def evaluate(self, xs):
+        return np.exp(-self.cumulative_hazard(xs))
+
+    # Returns the times at which the distribution may change value, which are those of its (step-shaped) hazard function
+    def jump_times(self):
+        return self.hazard_function.jump_times()
 
 def leblanc(hazard_function, theta):
-    def f(t):
-        return exp(-theta * hazard_function(t))
-    return f
+    return LeblancDistribution(hazard_function, theta)
 
 class Instance:
     def __init__(self, feats):
@@ -137,16 +425,90 @@ def calculate_theta(events, hazards):
     theta = numerator / denominator
     return theta
 
+# The sufficient statistics of the instances in a node, which replace the instances themselves in summary mode
+# Summaries of separate chunks of a dataset can be merged, so a tree can be filled incrementally or in parallel
+class LeafSummary:
+    def __init__(self, count=0, events=0, hazard_sum=0, negative_log_hazard_sum=0, times=None, event_flags=None):
+        self.count = count
+        self.events = events
+        self.hazard_sum = hazard_sum
+        self.negative_log_hazard_sum = negative_log_hazard_sum
+        self.times = times
+        self.event_flags = event_flags
+
+    # Summarizes instances given as arrays
+    #
+    # times                 The time of each instance
+    # events                The event indicator of each instance
+    # hazards               The baseline cumulative hazard at the time of each instance
+    # negative_log_hazards  The negative logarithm of each hazard
+    # keep_times            Whether to keep compact copies of the times and events, which are needed for the Kaplan-Meier estimator
+    @staticmethod
+    def from_arrays(times, events, hazards, negative_log_hazards, keep_times=True):
+        died = np.asarray(events) == 1
+        return LeafSummary(
+            len(times),
+            int(died.sum()),
+            sum(np.asarray(hazards).tolist()),
+            sum(np.asarray(negative_log_hazards)[died].tolist()),
+            np.array(times) if keep_times else None,
+            np.array(events, dtype=np.int8) if keep_times else None,
+        )
+
+    # Returns the summary of the instances of both summaries together
+    #
+    # other     The summary to merge with
+    def merge(self, other):
+        if self.times is None or other.times is None:
+            times, event_flags = None, None
+        else:
+            times, event_flags = np.concatenate([self.times, other.times]), np.concatenate([self.event_flags, other.event_flags])
+
+        return LeafSummary(
+            self.count + other.count,
+            self.events + other.events,
+            self.hazard_sum + other.hazard_sum,
+            self.negative_log_hazard_sum + other.negative_log_hazard_sum,
+            times,
+            event_flags,
+        )
+
+    def theta(self):
+        if self.count == 0:
+            warnings.warn("encountered empty leaf node.")
+            return 1
+
+        return max(0.5, self.events) / self.hazard_sum
+
+    def kaplan_meier(self):
+        if self.times is None:
+            return None
+        return kaplan_meier_from_arrays(self.times, self.event_flags)
+
+    def error(self, theta):
+        return max(0, self.negative_log_hazard_sum - self.events * log(theta))
+
+# A node of a survival tree
+# The baseline hazard function that labels and errors are calculated with is passed explicitly or kept per tree, never shared between trees,
+# so that separate trees can be filled and evaluated concurrently (e.g. in threads)
+#
+# criterium         The predicate that sends instances to the second subtree, or -1 for a leaf
+# tree_0            The subtree of instances for which the criterium does not hold
+# tree_1            The subtree of instances for which the criterium holds
+# instances         The instances to label the node with
+# hazard_function   The baseline hazard function of the instances
 class Tree:
-    def __init__(self, criterium, tree_0, tree_1, instances=None):
+    def __init__(self, criterium, tree_0, tree_1, instances=None, hazard_function=None):
         self.criterium = criterium
         self.trees = [tree_0, tree_1] if tree_0 else []
         self.instances = instances or []
+        self.hazard_function = hazard_function
 
         self.theta = None
         self.kaplan_meier_distribution = None
         self.leblanc_distribution = None
         self.error = None
+        self.summary = None
 
         if instances:
             self.calculate_label()
@@ -169,15 +531,31 @@ class Tree:
         else:
             return self.trees[1].classify(instance, store)
 
-    def calculate_label(self):
+    def calculate_label(self, hazard_function=None):
+        if self.summary is not None:
+            self.theta = self.summary.theta()
+            self.kaplan_meier_distribution = self.summary.kaplan_meier()
+            return (self.theta, self.kaplan_meier_distribution)
+
+        hazard_function = self.fit_hazard_function(hazard_function)
         events = [inst.event for inst in self.instances]
-        hazards = [Tree.hazard_function(inst.time) for inst in self.instances]
+        hazards = [hazard_function(inst.time) for inst in self.instances]
 
         self.theta = calculate_theta(events, hazards)
         self.kaplan_meier_distribution = kaplan_meier(self.instances)
 
         return (self.theta, self.kaplan_meier_distribution)
 
+    # Returns the hazard function to label the stored instances with: the given one, or otherwise the one the node was created with
+    #
+    # hazard_function   The hazard function passed by the caller, if any
+    def fit_hazard_function(self, hazard_function):
+        if hazard_function is not None:
+            return hazard_function
+        if self.hazard_function is None:
+            raise ValueError("no hazard function was given to label the instances of the tree with.")
+        return self.hazard_function
+
     def calculate_leblanc_km_estimator(self, hazard_function):
         if self.trees:
             for i in range(2):
@@ -187,24 +565,29 @@ class Tree:
         assert(self.theta is not None)
         self.leblanc_distribution = leblanc(hazard_function, self.theta)
 
-    def calculate_error(self):
+    def calculate_error(self, hazard_function=None):
         if self.trees:
             self.error = 0
             for i in range(2):
                 if self.trees[i].error == None:
-                    self.trees[i].error = self.trees[i].calculate_error()
+                    self.trees[i].error = self.trees[i].calculate_error(hazard_function)
                 self.error += self.trees[i].error
             return self.error
 
         if self.theta == None or self.kaplan_meier_distribution == None:
-            self.theta, self.kaplan_meier_distribution = self.calculate_label()
+            self.theta, self.kaplan_meier_distribution = self.calculate_label(hazard_function)
 
+        if self.summary is not None:
+            self.error = self.summary.error(self.theta)
+            return self.error
+
+        hazard_function = self.fit_hazard_function(hazard_function)
         event_sum = 0
         negative_log_hazard_sum = 0
 
         for inst in self.instances:
             event = inst.event
-            hazard = Tree.hazard_function(inst.time)
+            hazard = hazard_function(inst.time)
 
             if event:
                 event_sum += 1
@@ -214,6 +597,119 @@ class Tree:
 
         return self.error
 
+    # Returns the leaves of the tree and, for each instance, the index of the leaf it ends up in
+    #
+    # X     The instances, as a sequence of instances or as a map from feature name to column
+    def apply(self, X):
+        # Imported here, since the predicate cache itself depends on this module
+        from predicates import leaf_assignment
+        return leaf_assignment(self, X)
+
+    # Evaluates the survival distribution of each leaf at the given times
+    # Returns a (leaves x T) array
+    #
+    # leaves    The leaves to evaluate
+    # times     The T times to evaluate the distributions at
+    # method    Either "leblanc" or "kaplan_meier"
+    @staticmethod
+    def leaf_survival_matrix(leaves, times, method):
+        times = np.asarray(times)
+        matrix = np.empty((len(leaves), len(times)))
+        for j, leaf in enumerate(leaves):
+            distribution = leaf.leblanc_distribution if method == "leblanc" else leaf.kaplan_meier_distribution
+            matrix[j] = distribution.evaluate(times)
+        return matrix
+
+    # Predicts the survival distribution of many instances at once
+    # Returns a dense (n x T) array, or if `compact` is set, the (leaves x T) array and the leaf index of each instance
+    #
+    # X         The instances, as a sequence of instances or as a map from feature name to column
+    # times     The T times to evaluate the distributions at
+    # method    Either "leblanc" or "kaplan_meier"
+    # compact   Whether to return the per-leaf matrix and leaf indices instead of the dense array
+    def predict_survival(self, X, times, method="leblanc", compact=False):
+        leaves, leaf_ids = self.apply(X)
+        matrix = Tree.leaf_survival_matrix(leaves, times, method)
+        if compact:
+            return matrix, leaf_ids
+        return matrix[leaf_ids]
+
+    # Predicts the cumulative hazard of many instances at once
+    # Returns a dense (n x T) array, or if `compact` is set, the (leaves x T) array and the leaf index of each instance
+    #
+    # X         The instances, as a sequence of instances or as a map from feature name to column
+    # times     The T times to evaluate the cumulative hazards at
+    # method    Either "leblanc" (theta * H(t)) or "kaplan_meier" (-log S(t))
+    # compact   Whether to return the per-leaf matrix and leaf indices instead of the dense array
+    def predict_cumulative_hazard(self, X, times, method="leblanc", compact=False):
+        leaves, leaf_ids = self.apply(X)
+        if method == "leblanc":
+            matrix = np.array([leaf.leblanc_distribution.cumulative_hazard(np.asarray(times)) for leaf in leaves])
+        else:
+            with np.errstate(divide="ignore"):
+                matrix = -np.log(Tree.leaf_survival_matrix(leaves, times, method))
+        if compact:
+            return matrix, leaf_ids
+        return matrix[leaf_ids]
+
+    # Summarizes a chunk of instances per leaf, without changing the tree
+    # Returns one summary per leaf, in the order of `get_leaves`
+    #
+    # X                 The instances, as a sequence of instances or as a map from feature name to column
+    # hazard_function   The baseline cumulative hazard function
+    # keep_times        Whether the summaries keep the times and events, which are needed for the Kaplan-Meier estimator
+    def summarize(self, X, hazard_function, keep_times=True):
+        # Imported here, since the predicate cache itself depends on this module
+        from predicates import survival_arrays
+        leaves, leaf_ids = self.apply(X)
+        times, events = survival_arrays(X)
+
+        if isinstance(hazard_function, StepFunction):
+            idx = hazard_function.indices(times)
+            hazards = np.asarray(hazard_function.values)[idx]
+            negative_log_hazards = np.array([-log(j) if j > 0 else 0.0 for j in hazard_function.values])[idx]
+        else:
+            hazards = np.array([hazard_function(t) for t in times.tolist()])
+            negative_log_hazards = np.array([-log(j) if j > 0 else 0.0 for j in hazards.tolist()])
+
+        # Group the instances per leaf, keeping their original order within each leaf
+        order = np.argsort(leaf_ids, kind="stable")
+        bounds = np.searchsorted(leaf_ids[order], np.arange(len(leaves) + 1))
+
+        summaries = []
+        for j in range(len(leaves)):
+            rows = order[bounds[j]:bounds[j + 1]]
+            summaries.append(LeafSummary.from_arrays(times[rows], events[rows], hazards[rows], negative_log_hazards[rows], keep_times))
+        return summaries
+
+    # Adds summaries of a chunk of instances to the leaves, and updates the summaries of all nodes above them
+    # The labels and errors of the nodes are cleared, so they are recalculated from the summaries
+    #
+    # leaf_summaries    One summary per leaf, in the order of `get_leaves`
+    def fold_summaries(self, leaf_summaries):
+        for leaf, summary in zip(self.get_leaves(), leaf_summaries):
+            leaf.summary = summary if leaf.summary is None else leaf.summary.merge(summary)
+        self.update_summaries()
+
+    # Recomputes the summaries of the internal nodes from those of the leaves
+    def update_summaries(self):
+        self.error = None
+        if not self.trees:
+            return self.summary
+
+        summaries = [child.update_summaries() for child in self.trees]
+        self.summary = summaries[0].merge(summaries[1])
+        return self.summary
+
+    # Replaces the instances of the tree with per-node summaries of a dataset
+    #
+    # X                 The instances, as a sequence of instances or as a map from feature name to column
+    # hazard_function   The baseline cumulative hazard function
+    # keep_times        Whether the summaries keep the times and events, which are needed for the Kaplan-Meier estimator
+    def fill_summaries(self, X, hazard_function, keep_times=True):
+        self.clear_instances()
+        self.fold_summaries(self.summarize(X, hazard_function, keep_times))
+
     def get_leaves(self):
         if self.trees:
             return self.trees[0].get_leaves() + self.trees[1].get_leaves()
@@ -222,6 +718,7 @@ class Tree:
     def clear_instances(self):
         self.error = None
         self.instances = []
+        self.summary = None
         for child in self.trees:
             child.clear_instances()
 
@@ -242,12 +739,17 @@ class Tree:
             r.append(self.trees[0].to_string(path))
             path.pop()
 
-        if self.instances:
+        if self.summary is not None:
+            count, died = self.summary.count, self.summary.events
+        else:
+            count, died = len(self.instances), sum(inst.event for inst in self.instances)
+
+        if count:
             if self.trees:
                 r[0] += "\033[38;5;232m"
             else:
                 r[0] += "\033[38;5;248m"
-            r[0] += f"<error = {self.error or 0:.4f}, avg-error = {(self.error or 0) / len(self.instances):.4f}, {sum(inst.event for inst in self.instances)} / {len(self.instances)} died>\033[0m"
+            r[0] += f"<error = {self.error or 0:.4f}, avg-error = {(self.error or 0) / count:.4f}, {died} / {count} died>\033[0m"
         r[0] += "\n"
         return "".join(r)
 
@@ -268,6 +770,27 @@ def get_feature_meanings(filename):
 
     return feature_meanings
 
+# Turns instances into a map from column name to an array with the values of all instances
+# Columns with mixed types (other than integers and floats) are stored as object arrays, so their values compare the same as before
+#
+# instances     The instances to convert
+def columns_from_instances(instances):
+    instances = [*instances]
+    columns = {
+        "time": np.array([inst.time for inst in instances]),
+        "event": np.array([inst.event for inst in instances], dtype=np.int8),
+    }
+
+    for key in (instances[0].feats if instances else []):
+        values = [inst.feats[key] for inst in instances]
+        types = {type(j) for j in values}
+        if types <= {int, float} or types == {str}:
+            columns[key] = np.array(values)
+        else:
+            columns[key] = np.array(values, dtype=object)
+
+    return columns
+
 def read_dataset(filename):
     f = open(filename)
     lines = f.read().strip().split("\n")
@@ -302,15 +825,44 @@ def read_tree(filename):
     flat_tree = eval(d)
     return parse_tree(flat_tree), dataset_filename
 
-def fill_tree(tree, dataset_filename):
-    instances = read_dataset(dataset_filename)
+# Fills a tree with a dataset and labels its leaves
+# The nodes only keep summaries of the instances (see `LeafSummary`), not the instances themselves
+# Returns the instances of the dataset
+#
+# tree              The tree to fill
+# dataset           The path to the dataset, or a sequence of already read instances
+# hazard_function   The Nelson-Aalen estimator of the dataset, if it has already been computed
+def fill_tree(tree, dataset, hazard_function=None):
+    instances = read_dataset(dataset) if isinstance(dataset, str) else dataset
 
-    Tree.hazard_function = nelson_aalen(instances)
+    if hazard_function is None:
+        hazard_function = nelson_aalen(instances)
 
-    for inst in instances:
-        tree.classify(inst, True)
-    
-    tree.calculate_error()
-    tree.calculate_leblanc_km_estimator(Tree.hazard_function)
+    tree.fill_summaries(instances, hazard_function)
+    tree.calculate_error(hazard_function)
+    tree.calculate_leblanc_km_estimator(hazard_function)
 
     return instances
+
+if __name__ == "__main__":
+    # Usage: python utils.py compare-profiles [<old run> <new run>]
+    # Compares the profiles of two runs, each given as a profile file or as a directory that is searched for profiles
+    # Without runs, the previous profile of every step in this repository is compared with its latest one
+    # Exits with status 1 if any step or phase regressed
+    if sys.argv[1:2] != ["compare-profiles"]:
+        raise ValueError("usage: python utils.py compare-profiles [<old run> <new run>]")
+
+    if len(sys.argv) > 3:
+        old_profiles, new_profiles = read_profiles(sys.argv[2]), read_profiles(sys.argv[3])
+    else:
+        new_profiles = read_profiles(DIRECTORY)
+        old_profiles = {}
+        for root, _, files in os.walk(DIRECTORY):
+            for j in files:
+                if j.endswith("_profile.previous.json"):
+                    old_profiles.update(read_profiles(f"{root}/{j}"))
+
+    regressions = print_profile_comparison(old_profiles, new_profiles)
+    print("\033[32;1mDone!\033[0m")
+    if regressions:
+        sys.exit(1)
@@ -0,0 +1,313 @@
+import json
+import numpy as np
+import os
+import shutil
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from bootstrap import bootstrap_option
+from step_6_run_streed import clear_streed_files, create_pareto_key, prune_results, run_setting
+from step_9_evaluate_trees import evaluate_line, write_evaluations
+from utils import step_profile, DIRECTORY
+
+# The number of seconds a worker owns a task after claiming it or after its last heartbeat; tasks whose lease expired are handed out again
+LEASE_SECONDS = 120
+
+# The number of heartbeats per lease, so a few can be missed (e.g. by a busy file server) before the lease expires
+HEARTBEATS_PER_LEASE = 4
+
+# The number of times a task is handed out before it is given up on
+MAX_ATTEMPTS = 3
+
+# The number of seconds to wait for another worker to release the database, which may take a while on a shared filesystem
+LOCK_TIMEOUT = 300
+
+# The number of seconds an idle worker waits before looking for work again, while other workers still hold leases that may expire
+IDLE_INTERVAL = 5
+
+# A queue is a directory on a shared filesystem with a single SQLite database, in which every task is a row that is claimed by setting a lease on it
+# SQLite's locks need a filesystem with working POSIX locks (e.g. NFSv4 or Lustre), and the default rollback journal is used since WAL needs shared memory
+#
+# queue_directory   The directory of the queue
+def queue_database(queue_directory):
+    return f"{queue_directory}/queue.sqlite"
+
+def connect(queue_directory):
+    # Transactions are started explicitly, so a claim reads and updates a task under a single write lock
+    return sqlite3.connect(queue_database(queue_directory), timeout=LOCK_TIMEOUT, isolation_level=None)
+
+# Creates a queue with a task per payload, replacing any queue in the directory
+# The id of a task is the position of its payload, which is the order in which the results are merged
+#
+# queue_directory   The directory of the queue
+# kind              The kind of the tasks, either "streed" or "evaluate:<algorithm>"
+# payloads          The payload of each task, such as a line of the settings file or of a trees file
+# replicates        The number of bootstrap replicates per evaluated tree (0 disables bootstrapping)
+def create_queue(queue_directory, kind, payloads, replicates=0):
+    os.makedirs(queue_directory, exist_ok=True)
+    if os.path.exists(queue_database(queue_directory)):
+        os.remove(queue_database(queue_directory))
+
+    connection = connect(queue_directory)
+    connection.execute("CREATE TABLE queue (kind TEXT, created REAL, replicates INTEGER)")
+    connection.execute("""CREATE TABLE tasks (
+        id INTEGER PRIMARY KEY, payload TEXT, state TEXT, worker TEXT, lease_expires REAL, attempts INTEGER, result TEXT, error TEXT
+    )""")
+    connection.execute("CREATE INDEX tasks_state ON tasks (state, id)")
+    connection.execute("BEGIN IMMEDIATE")
+    connection.execute("INSERT INTO queue VALUES (?, ?, ?)", (kind, time.time(), replicates))
+    connection.executemany("INSERT INTO tasks VALUES (?, ?, 'pending', NULL, NULL, 0, NULL, NULL)", enumerate(payloads))
+    connection.execute("COMMIT")
+    connection.close()
+
+# Returns the kind of the tasks of a queue
+#
+# connection    The connection to the queue
+def queue_kind(connection):
+    return connection.execute("SELECT kind FROM queue").fetchone()[0]
+
+# Returns the number of bootstrap replicates per evaluated tree of a queue
+#
+# connection    The connection to the queue
+def queue_replicates(connection):
+    return connection.execute("SELECT replicates FROM queue").fetchone()[0]
+
+# Claims the first pending task, after handing out the tasks whose lease expired again (or giving up on them after `MAX_ATTEMPTS` attempts)
+# Returns the id and payload of the task, or None if no task is pending
+#
+# connection    The connection to the queue
+# worker        The name of the worker
+# lease         The number of seconds of the lease
+def claim_task(connection, worker, lease=LEASE_SECONDS):
+    now = time.time()
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        connection.execute("UPDATE tasks SET state = 'failed', error = 'lease expired' WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?", (now, MAX_ATTEMPTS))
+        connection.execute("UPDATE tasks SET state = 'pending', worker = NULL WHERE state = 'leased' AND lease_expires < ?", (now,))
+        task = connection.execute("SELECT id, payload FROM tasks WHERE state = 'pending' ORDER BY id LIMIT 1").fetchone()
+        if task is not None:
+            connection.execute("UPDATE tasks SET state = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE id = ?", (worker, now + lease, task[0]))
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    return task
+
+# Extends the lease of a task
+# Returns whether the worker still owns the task
+#
+# connection    The connection to the queue
+# task_id       The id of the task
+# worker        The name of the worker
+# lease         The number of seconds of the lease
+def renew_lease(connection, task_id, worker, lease=LEASE_SECONDS):
+    cursor = connection.execute("UPDATE tasks SET lease_expires = ? WHERE id = ? AND worker = ? AND state = 'leased'", (time.time() + lease, task_id, worker))
+    return cursor.rowcount > 0
+
+# Stores the result of a task
+# A task that was handed out again after its lease expired may be finished twice, in which case the first result is kept
+#
+# connection    The connection to the queue
+# task_id       The id of the task
+# result        The result of the task
+def complete_task(connection, task_id, result):
+    connection.execute("UPDATE tasks SET state = 'done', result = ?, error = NULL WHERE id = ? AND state != 'done'", (result, task_id))
+
+# Hands a task that raised an error out again, or gives up on it after `MAX_ATTEMPTS` attempts
+#
+# connection    The connection to the queue
+# task_id       The id of the task
+# worker        The name of the worker
+# error         The error of the task
+def fail_task(connection, task_id, worker, error):
+    connection.execute(
+        "UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, worker = NULL, error = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+        (MAX_ATTEMPTS, error, task_id, worker),
+    )
+
+# Keeps the lease of a task while the body runs, with heartbeats from a background thread (with its own connection)
+#
+# queue_directory   The directory of the queue
+# task_id           The id of the task
+# worker            The name of the worker
+# lease             The number of seconds of the lease
+@contextmanager
+def kept_lease(queue_directory, task_id, worker, lease=LEASE_SECONDS):
+    stopped = threading.Event()
+
+    def heartbeat():
+        connection = connect(queue_directory)
+        while not stopped.wait(lease / HEARTBEATS_PER_LEASE):
+            if not renew_lease(connection, task_id, worker, lease):
+                print(f"\033[33mLost the lease of task {task_id}\033[0m")
+                break
+        connection.close()
+
+    thread = threading.Thread(target=heartbeat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+# Returns the number of tasks of a queue per state
+#
+# connection    The connection to the queue
+def task_counts(connection):
+    return dict(connection.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall())
+
+# Returns the Pareto keys of the finished tasks before a task whose run timed out (or was skipped due to the Pareto front)
+# These are shared by all workers through the queue, instead of each worker only knowing the time-outs of its own runs
+#
+# connection    The connection to the queue
+# task_id       The id of the task
+def timed_out_keys(connection, task_id):
+    rows = connection.execute("SELECT payload, result FROM tasks WHERE state = 'done' AND id < ? ORDER BY id", (task_id,))
+    return [create_pareto_key(eval(payload)) for payload, result in rows if float(result.split(";")[1]) < 0]
+
+# Runs a single setting with STreeD, like step 6 does
+# Returns the settings, time and tree as a line of the trees file without id
+#
+# payload           The line of the settings file
+# data_directory    The directory of the STreeD files of this worker
+# front             The Pareto keys of the earlier settings that timed out
+def streed_task(payload, data_directory, front):
+    return ";".join(str(j) for j in run_setting(eval(payload), data_directory, front))
+
+# Evaluates a single tree, like step 9 does
+# Returns the line of the output file and the bootstrap replicates of the tree as JSON
+#
+# payload       The line of the trees file
+# replicates    The number of bootstrap replicates (0 disables bootstrapping)
+def evaluate_task(payload, replicates):
+    new_line, _, replicates = evaluate_line(payload, "kaplan_meier", replicates=replicates)
+    if replicates is not None:
+        replicates = {metric: values.tolist() for metric, values in replicates.items()}
+    return json.dumps({"line": new_line, "replicates": replicates})
+
+# Claims and runs tasks until no task is pending or leased anymore
+# Every worker writes its STreeD files to a directory of its own, since the directories of all workers may be on the same shared filesystem
+#
+# queue_directory   The directory of the queue
+# lease             The number of seconds of a lease
+def run_worker(queue_directory, lease=LEASE_SECONDS):
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    connection = connect(queue_directory)
+    kind = queue_kind(connection)
+    replicates = queue_replicates(connection)
+    data_directory = tempfile.mkdtemp(prefix="streed_queue_")
+    clear_streed_files(data_directory)
+
+    num_tasks = 0
+    try:
+        while True:
+            task = claim_task(connection, worker, lease)
+            if task is None:
+                # Wait for the leases of other workers, which are handed out again if their workers stopped
+                if task_counts(connection).get("leased", 0) == 0:
+                    break
+                time.sleep(IDLE_INTERVAL)
+                continue
+
+            task_id, payload = task
+            print(f"\033[35mRunning task \033[1m{task_id}\033[0;35m on \033[1m{worker}\033[0m")
+            try:
+                with kept_lease(queue_directory, task_id, worker, lease):
+                    result = streed_task(payload, data_directory, timed_out_keys(connection, task_id)) if kind == "streed" else evaluate_task(payload, replicates)
+            except Exception:
+                fail_task(connection, task_id, worker, traceback.format_exc())
+                print(f"\033[31;1mTask {task_id} failed\033[0m")
+                continue
+            complete_task(connection, task_id, result)
+            num_tasks += 1
+    finally:
+        connection.close()
+        shutil.rmtree(data_directory, ignore_errors=True)
+
+    print(f"\033[34mFinished \033[1m{num_tasks}\033[0;34m tasks on \033[1m{worker}\033[0m")
+
+# Writes the results of a queue to the usual output files, in the order of the tasks, so the result does not depend on which worker ran what
+# Tasks that failed are left out, like the settings that were not run when a step is halted
+# Returns False without writing anything if some tasks are not finished yet
+#
+# queue_directory   The directory of the queue
+def merge_queue(queue_directory):
+    connection = connect(queue_directory)
+    kind = queue_kind(connection)
+    counts = task_counts(connection)
+    rows = connection.execute("SELECT payload, result FROM tasks WHERE state = 'done' ORDER BY id").fetchall()
+    results = prune_results(rows) if kind == "streed" else [j[1] for j in rows]
+    connection.close()
+
+    if counts.get("pending", 0) + counts.get("leased", 0) > 0:
+        print(f"\033[31;1mNot all tasks are finished yet: {counts}\033[0m")
+        return False
+    if counts.get("failed", 0) > 0:
+        print(f"\033[33mLeaving out {counts['failed']} failed tasks\033[0m")
+
+    if kind == "streed":
+        f = open(f"{DIRECTORY}/output/streed_trees.csv", "w")
+        f.write("id;settings;time;tree\n")
+        for i, result in enumerate(results):
+            f.write(f"{i};{result}\n")
+        f.close()
+    else:
+        null = None
+        algorithm = kind.split(":", 1)[1]
+        evaluations = []
+        for result in results:
+            result = json.loads(result)
+            id, settings, tree_results = [eval(j) for j in result["line"].split(";")]
+            replicates = result["replicates"] and {metric: np.array(values) for metric, values in result["replicates"].items()}
+            evaluations.append((result["line"], (id, settings, tree_results), replicates))
+        write_evaluations(algorithm, "id;settings;results", [j[1][0] for j in evaluations], evaluations)
+
+    print(f"\033[35mMerged \033[1m{len(results)}\033[0;35m results of \033[1m{kind}\033[0m")
+    return True
+
+# Returns the payloads of the tasks of a kind: the lines of the settings file for STreeD, or the lines of the trees file of an algorithm to evaluate
+#
+# kind      Either "streed" or "evaluate:<algorithm>"
+def task_payloads(kind):
+    filename = f"{DIRECTORY}/output/settings.txt" if kind == "streed" else f"{DIRECTORY}/output/{kind.split(':', 1)[1]}_trees.csv"
+    f = open(filename)
+    lines = [j for j in f.read().split("\n") if j.strip()]
+    f.close()
+    return lines if kind == "streed" else lines[1:]
+
+if __name__ == "__main__":
+    # Usage: python work_queue.py create <queue directory> <streed|evaluate:<algorithm>> [--bootstrap[=<replicates>]]
+    #        python work_queue.py work <queue directory> [--lease=<seconds>]
+    #        python work_queue.py status <queue directory>
+    #        python work_queue.py merge <queue directory>
+    # The queue directory must be on a filesystem that all hosts share; start any number of workers on any number of hosts,
+    # and merge the results once they are done
+    command, queue_directory = sys.argv[1], sys.argv[2]
+    if command == "create":
+        create_queue(queue_directory, sys.argv[3], task_payloads(sys.argv[3]), bootstrap_option(sys.argv[4:]))
+    elif command == "work":
+        lease = LEASE_SECONDS
+        for arg in sys.argv[3:]:
+            if arg.startswith("--lease="):
+                lease = float(arg.split("=", 1)[1])
+        with step_profile(f"work_queue_{socket.gethostname()}_{os.getpid()}", queue_directory):
+            run_worker(queue_directory, lease)
+    elif command == "status":
+        connection = connect(queue_directory)
+        print(f"\033[35m{queue_kind(connection)}: \033[1m{task_counts(connection)}\033[0m")
+        for task_id, attempts, error in connection.execute("SELECT id, attempts, error FROM tasks WHERE state = 'failed' ORDER BY id"):
+            print(f"\033[31mTask {task_id} failed after {attempts} attempts:\033[0m\n{error}")
+        connection.close()
+    elif command == "merge":
+        if not merge_queue(queue_directory):
+            sys.exit(1)
+    else:
+        raise ValueError(f"unknown command {command}")
+
+    print("\033[32;1mDone!\033[0m")